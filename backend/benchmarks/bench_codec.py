@@ -0,0 +1,97 @@
+"""
+Compression ratio of the EPDF payload encodings against what they cost to decode, using the device's decoders
+(frontend utils/codec.py) under CPython. Every payload is decoded and checked against the raw one.
+
+    python benchmarks/bench_codec.py --images 5
+
+Decode times are CPython's, the ESP32 is one to two orders of magnitude slower but scales the same way: inflate runs in
+C on both, the RLE decoder is pure Python.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from common import BACKEND_DIR, make_corpus
+from frame_format import ENCODINGS, EPDF_HEADER, encode_epdf, panel_pixels, pack_4bpp, to_panel_order
+from renderer import render_image
+
+sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+from utils.codec import open_payload, CHUNK_SIZE
+
+
+def quote_card(size=(1280, 960), seed=0):
+    # What @dailystoic posts mostly look like: a flat background and a few lines of text
+    rng = np.random.default_rng(seed)
+    img = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(img)
+    for line in range(8):
+        text = "".join(chr(c) for c in rng.integers(97, 123, 40))
+        draw.text((80, 200 + line * 60), text, fill=0)
+    return np.asarray(img)
+
+
+def decode(data):
+    hdr = EPDF_HEADER.unpack(data[:EPDF_HEADER.size])
+    src = io.BytesIO(data[EPDF_HEADER.size:])
+    payload = open_payload(src, {"encoding": hdr[10], "length": hdr[11]})
+    out = bytearray()
+    chunk = payload.read(CHUNK_SIZE)
+    while chunk:
+        out += chunk
+        chunk = payload.read(CHUNK_SIZE)
+    return bytes(out)
+
+
+def measure(frames, bpp):
+    results = dict()
+    for encoding in ENCODINGS:
+        size = raw_size = encode_s = decode_s = 0
+        for pixels in frames:
+            values = panel_pixels(pixels, bpp)
+            raw = to_panel_order(values.tobytes() if bpp == 8 else pack_4bpp(values))
+            start = time.perf_counter()
+            data = encode_epdf(pixels, bpp=bpp, encoding=encoding)
+            encode_s += time.perf_counter() - start
+            start = time.perf_counter()
+            decoded = decode(data)
+            decode_s += time.perf_counter() - start
+            assert decoded == raw, f"{encoding} round trip failed"
+            size += len(data) - EPDF_HEADER.size
+            raw_size += len(raw)
+        results[encoding] = {
+            "ratio": raw_size / size,
+            "kb_per_frame": size / len(frames) / 1024,
+            "encode_ms": encode_s / len(frames) * 1000,
+            "decode_ms": decode_s / len(frames) * 1000,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus_small"))
+    args = parser.parse_args()
+
+    photos = list()
+    with tempfile.TemporaryDirectory() as render_dir:
+        for path in make_corpus(args.corpus, args.images, size=(1600, 1200)):
+            dest = os.path.join(render_dir, "frame.pgm")
+            with Image.open(render_image(path, dest)) as img:
+                photos.append(np.asarray(img))
+    cards = [quote_card(seed=i) for i in range(args.images)]
+
+    for name, frames in (("quote cards", cards), ("photos", photos)):
+        for bpp in (8, 4):
+            for encoding, stats in measure(frames, bpp).items():
+                print(f"{name} {bpp}bpp {encoding}: " + ", ".join(f"{k}={v:.1f}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Bytes a device downloads to refresh a window of the panel (a widget), with the backend cropping the frame against the
+device cropping it itself, running the device's driver (frontend S1D135xx._load_image) under CPython against the real
+request handler, SPI replaced by a buffer. Each crop is checked against the same window of the full frame.
+
+    python benchmarks/bench_crop.py --images 6 --bpp 4
+
+Without a server side crop the device reads, and throws away, every byte before the window's last row.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from common import BACKEND_DIR, make_corpus, serve_in_thread, summarize
+from frame_format import EPDF_HEADER
+import server
+
+sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+from hardware.display_platforms.pl_epd.epson import epson_s1d135xx
+from hardware.display_platforms.pl_epd.epson.epson_s1d13524 import S1D13524
+from utils import misc
+from utils.comm import RemoteFile, close_connections
+
+# (left, top, width, height): a clock in a corner, a weather strip, the lower half
+WINDOWS = [(960, 0, 320, 160), (0, 720, 640, 240), (0, 480, 1280, 480)]
+
+
+class CountingRemoteFile(RemoteFile):
+    received = 0
+
+    def close(self):
+        # Body bytes that came off the socket, whether they were read or skipped
+        CountingRemoteFile.received += self._curr_pos + self._conn.buffered()
+        super().close()
+
+
+class WholeFrameImageFile(misc.ImageFile):
+    # What the device did before the server could crop: always ask for the full frame
+    def __init__(self, path, etag=None, crop=None):
+        super().__init__(path, etag=etag)
+
+
+class BufferSpi:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write_bytes(self, data):
+        self.data += data
+
+
+class BenchDriver(S1D13524):
+    # Just the image loading path, no controller behind it
+    def __init__(self):
+        self._spi = BufferSpi()
+
+    def _set_cs(self, state):
+        pass
+
+    def _send_cmd(self, cmd):
+        pass
+
+    def _send_params(self, params):
+        pass
+
+    def _send_param(self, param):
+        pass
+
+    def _wait_idle(self, timeout_ms=5000):
+        pass
+
+
+def load(url, window, server_crop):
+    left, top, width, height = window
+    epson_s1d135xx.ImageFile = misc.ImageFile if server_crop else WholeFrameImageFile
+    driver = BenchDriver()
+    CountingRemoteFile.received = 0
+    start = time.perf_counter()
+    driver.load_image(url, {"left": left, "top": top, "width": width, "height": height}, left, top)
+    return time.perf_counter() - start, CountingRemoteFile.received, bytes(driver._spi.data)
+
+
+def expected(frame, window, bpp):
+    # The window cut out of the full frame's payload, row by row
+    data = frame.encode("epdf", bpp=bpp)[EPDF_HEADER.size:]
+    left, top, width, height = window
+    row = frame.width * bpp // 8
+    return b"".join(data[y * row + left * bpp // 8:y * row + (left + width) * bpp // 8]
+                    for y in range(top, top + height))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=6)
+    parser.add_argument("--bpp", type=int, default=4, choices=(4, 8))
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus"))
+    args = parser.parse_args()
+
+    misc.RemoteFile = CountingRemoteFile
+    corpus = make_corpus(args.corpus, args.images)
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in corpus:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        image_server = server.image_server = server.ImageServer(repo_dir=repo_dir, dedup_distance=None)
+        httpd = serve_in_thread(server.ImageRequestHandler)
+        url = f"http://127.0.0.1/the_image.epdf?bpp={args.bpp}&device=bench:{httpd.server_address[1]}"
+        try:
+            for window in WINDOWS:
+                for server_crop in (False, True):
+                    received, latencies = list(), list()
+                    for _ in range(args.images):
+                        seconds, nbytes, spi = load(url, window, server_crop)
+                        if spi != expected(image_server.shown_frame("bench"), window, args.bpp):
+                            raise AssertionError(f"Wrong pixels for {window}, server_crop={server_crop}")
+                        received.append(nbytes)
+                        latencies.append(seconds)
+                    stats = summarize(latencies)
+                    print(f"{window} server_crop={server_crop}: {sum(received) / len(received) / 1024:.0f} KB "
+                          f"received, load p50 {stats['p50_ms']:.1f} ms")
+        finally:
+            # The server handles one connection at a time, it's waiting on ours
+            close_connections()
+            httpd.shutdown()
+            httpd.server_close()
+            image_server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Near-duplicate lookups against an index the size of a large repository, through DedupIndex's vectorized scan and
+through a BK-tree walked in Python. Also checks that reposts are caught and distinct images kept: quote cards that
+share a layout, and the same cards reposted smaller and recompressed.
+
+    python benchmarks/bench_dedup.py --images 50000 --lookups 200
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from common import summarize
+from dedup_index import HASH_WORDS, DedupIndex, dhash, hamming
+
+
+class BKTree:
+    def __init__(self):
+        self._root = None
+
+    @staticmethod
+    def distance(a, b):
+        return (a ^ b).bit_count()
+
+    def add(self, h):
+        if self._root is None:
+            self._root = (h, dict())
+            return
+        node = self._root
+        while True:
+            d = self.distance(h, node[0])
+            if d not in node[1]:
+                node[1][d] = (h, dict())
+                return
+            node = node[1][d]
+
+    def nearest(self, h, radius):
+        best = None
+        stack = [self._root]
+        while stack:
+            value, children = stack.pop()
+            d = self.distance(h, value)
+            if d <= radius and (best is None or d < best):
+                best = d
+            for k, child in children.items():
+                if d - radius <= k <= d + radius:
+                    stack.append(child)
+        return best
+
+
+def quote_card(text, seed):
+    rng = random.Random(seed)
+    img = Image.new("L", (1080, 1080), 255)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((60, 60, 1020, 1020), outline=0, width=6)
+    for i, line in enumerate(text):
+        y = 200 + i * 90
+        draw.text((140 + rng.randrange(40), y), line, fill=0, font_size=56)
+    return img
+
+
+def jpeg(img, size=None, quality=90):
+    if size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    buf.seek(0)
+    return Image.open(buf)
+
+
+def check_reposts(max_distance):
+    words = "the obstacle is the way what stands in it becomes waste no time arguing about what a good man should " \
+            "be one be it you have power over your mind not outside events realize this and you will find strength"
+    words = words.split()
+    rng = random.Random(0)
+    cards = [quote_card([" ".join(rng.sample(words, 4)) for _ in range(6)], seed) for seed in range(20)]
+    hashes = [dhash(jpeg(card)) for card in cards]
+    distinct = [int(hamming(np.stack(hashes[:i]), h).min()) for i, h in enumerate(hashes) if i]
+    reposts = [int(hamming(h[None], dhash(jpeg(card, size=(640, 640), quality=50)))[0])
+               for card, h in zip(cards, hashes)]
+    print(f"distinct cards: closest {min(distinct)} bits apart, reposts: furthest {max(reposts)} bits apart "
+          f"(max distance {max_distance})")
+    assert min(distinct) > max_distance, "distinct cards would be dropped as reposts"
+    assert max(reposts) <= max_distance, "reposts would be kept"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--max-distance", type=int, default=24)
+    args = parser.parse_args()
+
+    check_reposts(args.max_distance)
+
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2 ** 63, (args.images, HASH_WORDS), dtype=np.uint64, endpoint=True)
+    probes = hashes[rng.integers(0, args.images, args.lookups)].copy()
+    # Flip a few bits, like a repost would
+    for probe in probes:
+        for bit in rng.integers(0, 64 * HASH_WORDS, args.max_distance // 2):
+            probe[bit // 64] ^= np.uint64(1 << int(bit % 64))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "dedup.log")
+        index = DedupIndex(path, max_distance=args.max_distance)
+        start = time.perf_counter()
+        for i, h in enumerate(hashes):
+            index._append(f"{i}.jpg", h)
+        print(f"index: {len(index)} images loaded in {time.perf_counter() - start:.2f} s")
+        samples = list()
+        for probe in probes:
+            start = time.perf_counter()
+            match = index.nearest(probe)
+            samples.append(time.perf_counter() - start)
+            assert match is not None and match[0] <= args.max_distance
+        s = summarize(samples)
+        print(f"vectorized scan: p50 {s['p50_ms']:.3f} ms, p99 {s['p99_ms']:.3f} ms")
+        index.close()
+
+    tree = BKTree()
+    start = time.perf_counter()
+    for h in hashes:
+        tree.add(int.from_bytes(h.tobytes(), "little"))
+    print(f"BK-tree: built in {time.perf_counter() - start:.2f} s")
+    samples = list()
+    for probe in probes[:max(1, args.lookups // 10)]:
+        start = time.perf_counter()
+        best = tree.nearest(int.from_bytes(probe.tobytes(), "little"), args.max_distance)
+        samples.append(time.perf_counter() - start)
+        assert best is not None
+    s = summarize(samples)
+    print(f"BK-tree: p50 {s['p50_ms']:.3f} ms, p99 {s['p99_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Instagram pulls against a local stand-in: fake profiles whose posts point at a local HTTP server that answers each
+image after a delay, like a CDN far away. Compares one download worker (how downloads used to go, one at a time under
+a lock) with a pool, and checks every post made it to the repository and the inventory.
+
+    python benchmarks/bench_downloads.py --profiles 3 --posts 12 --latency 0.2
+"""
+import argparse
+import collections
+import datetime
+import http.server
+import io
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from common import serve_in_thread
+from image_repo_builder import ImageRepoBuilder
+from repo_inventory import RepoInventory
+
+
+def jpeg(size=(1080, 1080), seed=0):
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, size[::-1], dtype=np.uint8), "L").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    body = b""
+    connections = set()
+
+    def do_GET(self):
+        StandInHandler.connections.add(self.client_address)
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+FrozenPosts = collections.namedtuple("FrozenPosts", "index")
+
+
+class StandInPosts:
+    """
+    A profile's posts, newest first, that can be paused and resumed like instaloader's NodeIterator
+    """
+    def __init__(self, base_url, username, count, index=0):
+        self._base_url = base_url
+        self._username = username
+        self._count = count
+        self._index = index
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._index >= self._count:
+            raise StopIteration
+        self._index += 1
+        i = self._count - self._index
+        return SimpleNamespace(typename="GraphImage", owner_username=self._username,
+                               date_utc=datetime.datetime(2024, 1, 1) + datetime.timedelta(days=i),
+                               url=f"{self._base_url}/{self._username}/{i}.jpg")
+
+    def freeze(self):
+        # Like NodeIterator, resuming repeats the last post handed out
+        return FrozenPosts(max(self._index - 1, 0))
+
+
+class StandInBuilder(ImageRepoBuilder):
+    def __init__(self, base_url, posts, **kwargs):
+        super().__init__(**kwargs)
+        self._base_url = base_url
+        self._posts = posts
+
+    def _instagram_posts(self, username, resume=None):
+        index = resume["index"] if resume else 0
+        return StandInPosts(self._base_url, username, self._posts, index=index)
+
+
+def run(base_url, profiles, posts, workers, rate):
+    with tempfile.TemporaryDirectory() as repo_dir:
+        inventory = RepoInventory(repo_dir)
+        builder = StandInBuilder(base_url, posts, dest_dir=repo_dir, inventory=inventory, workers=workers, rate=rate,
+                                 instagram=[f"profile{i}" for i in range(profiles)])
+        StandInHandler.connections.clear()
+        start = time.perf_counter()
+        builder.download_from_instagram(n=profiles * posts)
+        elapsed = time.perf_counter() - start
+        assert len(inventory) == profiles * posts, f"{len(inventory)} of {profiles * posts} posts in the inventory"
+        stats = builder._downloads.stats
+        builder.close()
+        inventory.close()
+    return elapsed, len(StandInHandler.connections), stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=3)
+    parser.add_argument("--posts", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=None, help="requests/sec allowed per profile")
+    args = parser.parse_args()
+
+    StandInHandler.latency = args.latency
+    StandInHandler.body = jpeg()
+    httpd = serve_in_thread(StandInHandler, server_cls=http.server.ThreadingHTTPServer)
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        for workers in (1, args.workers):
+            elapsed, connections, stats = run(base_url, args.profiles, args.posts, workers, args.rate)
+            files = sum(s["files"] for s in stats.values())
+            print(f"workers={workers}: {files} files in {elapsed:.2f} s ({files / elapsed:.1f} files/s), "
+                  f"{connections} connections")
+            for source, s in sorted(stats.items()):
+                print(f"    {source}: {s['files']} files, {s['bytes'] / s['seconds'] / 1e6:.2f} MB/s while busy")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
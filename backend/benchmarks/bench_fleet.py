@@ -0,0 +1,72 @@
+"""
+A fleet of devices waking up on the same minute, each fetching its own next frame.
+
+    python benchmarks/bench_fleet.py --devices 200 --wakes 3
+
+Every wake starts all devices at once (a barrier), like frames on the same sleep schedule. Reports latency and
+throughput per wake, and how many renders the shared render cache needed for all the frames served.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from common import make_corpus, summarize, serve_in_thread
+from load_test import fetch
+import server
+
+
+def wake(url, devices):
+    latencies = [None] * devices
+    barrier = threading.Barrier(devices)
+
+    def _device(i):
+        barrier.wait()
+        latencies[i], _ = fetch(f"{url}&device=frame{i:04d}", chunk_size=65536)
+
+    threads = [threading.Thread(target=_device, args=(i,)) for i in range(devices)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stats = summarize(latencies)
+    stats["requests_per_s"] = devices / elapsed
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--wakes", type=int, default=3)
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--query", default="bpp=4")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus_small"))
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.corpus, args.images, size=(1600, 1200))
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in corpus:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        server.IMAGE_REPO_DIR = repo_dir
+        image_server = server.image_server = server.ImageServer(repo_dir=repo_dir, prefetch=args.prefetch,
+                                                                  max_devices=args.devices)
+        httpd = serve_in_thread(server.ImageRequestHandler, server_cls=server.FleetHTTPServer)
+        url = f"http://127.0.0.1:{httpd.server_address[1]}/the_image.epdf?{args.query}"
+        try:
+            for i in range(args.wakes):
+                print(f"wake {i}: {wake(url, args.devices)}")
+            renders = image_server.renders
+            print(f"{args.devices * args.wakes} frames served from {renders.misses} renders "
+                  f"({renders.hits} cache hits)")
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            image_server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cost of recording a displayed image and of "already shown?" lookups, legacy pickle vs HistoryStore.
+
+    python benchmarks/bench_history.py --entries 100000
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+from common import summarize
+from history_store import HistoryStore
+
+
+def fake_paths(repo_dir, count, start=0):
+    return [os.path.join(repo_dir, f"instagram_dailystoic_2023-01-01 00:00:{i:08d}.jpg")
+            for i in range(start, start + count)]
+
+
+def bench_pickle(path, existing, adds):
+    with open(path, "wb") as fh:
+        pickle.dump(set(existing), fh)
+
+    samples = list()
+    for image in adds:
+        # What ImageServer used to do for every served image
+        start = time.perf_counter()
+        with open(path, "rb") as fh:
+            history = pickle.load(fh)
+        history.add(image)
+        with open(path, "wb") as fh:
+            pickle.dump(history, fh)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_store(path, legacy, adds, lookups):
+    start = time.perf_counter()
+    store = HistoryStore(path, legacy_pickle=legacy)
+    migrate_s = time.perf_counter() - start
+
+    samples = list()
+    for image in adds:
+        start = time.perf_counter()
+        store.add(image)
+        samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    hits = sum(1 for image in lookups if image in store)
+    lookup_s = (time.perf_counter() - start) / len(lookups)
+    store.close()
+
+    start = time.perf_counter()
+    HistoryStore(path).close()
+    load_s = time.perf_counter() - start
+    return samples, migrate_s, lookup_s, load_s, hits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--adds", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        existing = fake_paths(tmp, args.entries)
+        adds = fake_paths(tmp, args.adds, start=args.entries)
+
+        legacy = os.path.join(tmp, "history.pkl")
+        print(f"pickle add @ {args.entries}: {summarize(bench_pickle(legacy, existing, adds))}")
+        print(f"pickle size: {os.path.getsize(legacy) / 1e6:.1f} MB")
+
+        with open(legacy, "wb") as fh:
+            pickle.dump(set(existing), fh)
+        journal = os.path.join(tmp, "history.log")
+        samples, migrate_s, lookup_s, load_s, hits = bench_store(journal, legacy, adds, existing[::10] + adds)
+        print(f"store add @ {args.entries}: {summarize(samples)}")
+        print(f"store migration: {migrate_s * 1000:.0f} ms, reload: {load_s * 1000:.1f} ms, "
+              f"lookup: {lookup_s * 1e6:.2f} us ({hits} hits)")
+        print(f"journal size: {os.path.getsize(journal) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
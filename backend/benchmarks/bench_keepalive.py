@@ -0,0 +1,231 @@
+"""
+What a device pays to fetch several resources in one wake (the conditional HEAD, the frame, a few small files, as
+tiles or metadata would be) with the frontend's HTTP client (utils/comm.py) under CPython, against the real request
+handler behind a proxy that adds a round trip of latency per connection and per request:
+
+  - close: a new connection, and name lookup, per resource, as the client did before keep-alive
+  - keep-alive: one after the other on the same connection
+  - pipelined: every request sent up front, the answers read in order
+
+    python benchmarks/bench_keepalive.py --wakes 10 --rtt-ms 30 --files 4
+
+Every body is checked against what was served. A stand-in that answers with chunked bodies (in chunks of random size)
+checks the chunked decoding too, lines read across chunk boundaries included.
+"""
+import argparse
+import http.server
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from common import BACKEND_DIR, make_corpus, serve_in_thread, summarize
+from frame_format import encode_pgm
+import server
+
+sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+from utils import comm
+
+
+class LatencyProxy:
+    """
+    Relays each connection to `upstream`, `rtt` seconds late for the handshake and for every request sent through it
+    (data going out from the device), so a request that has to wait for the previous answer costs a round trip
+    """
+    def __init__(self, upstream, rtt):
+        self._upstream = upstream
+        self._rtt = rtt
+        self.connections = 0
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._relay, args=(client,), daemon=True).start()
+
+    def _relay(self, client):
+        time.sleep(self._rtt)
+        # Not through getaddrinfo, only the device's name lookups are counted
+        upstream = socket.socket()
+        upstream.connect(self._upstream)
+        for sock in (client, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=self._pump, args=(upstream, client, 0), daemon=True).start()
+        self._pump(client, upstream, self._rtt)
+
+    @staticmethod
+    def _pump(src, dest, delay):
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data:
+                    break
+                time.sleep(delay)
+                dest.sendall(data)
+        except OSError:
+            pass
+        for sock in (src, dest):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class ChunkedHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/x-portable-graymap")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        rng = np.random.default_rng(len(self.path))
+        pos = 0
+        while pos < len(self.body):
+            size = int(rng.integers(1, 3000))
+            chunk = self.body[pos:pos + size]
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            pos += size
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CountingLookups:
+    def __init__(self):
+        self.calls = 0
+        self._getaddrinfo = socket.getaddrinfo
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self._getaddrinfo(*args)
+
+
+def read_body(remote_file):
+    data = bytearray()
+    buf = bytearray(2048)
+    n = remote_file.readinto(buf)
+    while n:
+        data += buf[:n]
+        n = remote_file.readinto(buf)
+    return bytes(data)
+
+
+def wake(host, port, paths, mode):
+    # HEAD then GET the frame, then the files. Returns the bodies, in order
+    resources = [("HEAD", paths[0], {"If-None-Match": 'W/"none"'})] + [("GET", path, None) for path in paths]
+    bodies = list()
+    if mode == "pipelined":
+        conn = comm.get_connection(host, port)
+        for method, path, headers in resources:
+            conn.request(path, headers, method)
+        for _ in resources:
+            with conn.response() as remote_file:
+                bodies.append(read_body(remote_file))
+    else:
+        for method, path, headers in resources:
+            if mode == "close":
+                headers = dict(headers or dict(), Connection="close")
+            with comm.RemoteFile(url=f"http://{host}/{path}", port=port, headers=headers, method=method) as f:
+                bodies.append(read_body(f))
+            if mode == "close":
+                # Nothing kept from one resource to the next, the name is looked up again
+                comm.close_connections()
+    comm.close_connections()
+    return bodies[1:]
+
+
+def check_chunked():
+    pixels = np.random.default_rng(0).integers(0, 256, (960, 1280), dtype=np.uint8)
+    ChunkedHandler.body = encode_pgm(pixels)
+    httpd = serve_in_thread(ChunkedHandler, server_cls=http.server.ThreadingHTTPServer)
+    port = httpd.server_address[1]
+    try:
+        conn = comm.get_connection("127.0.0.1", port)
+        for i in range(3):
+            conn.request(f"frame_{i}.pgm")
+        for _ in range(3):
+            with conn.response() as remote_file:
+                header = remote_file.readline() + remote_file.readline() + remote_file.readline()
+                body = header + read_body(remote_file)
+            if body != ChunkedHandler.body:
+                raise AssertionError("Chunked body read wrong")
+        connects = conn.connects
+        comm.close_connections()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    print(f"chunked: 3 pipelined frames of {len(ChunkedHandler.body)} bytes intact, {connects} connection")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wakes", type=int, default=10)
+    parser.add_argument("--rtt-ms", type=float, default=30)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus"))
+    args = parser.parse_args()
+
+    check_chunked()
+    corpus = make_corpus(args.corpus, 2)
+    lookups = comm.socket.getaddrinfo = CountingLookups()
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in corpus:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        files = list()
+        for i in range(args.files):
+            files.append(f"tile_{i}.bin")
+            with open(os.path.join(repo_dir, files[-1]), "wb") as fh:
+                fh.write(os.urandom(2048))
+        image_server = server.image_server = server.ImageServer(repo_dir=repo_dir, dedup_distance=None)
+        server.IMAGE_REPO_DIR = repo_dir
+        httpd = serve_in_thread(server.ImageRequestHandler, server_cls=server.FleetHTTPServer)
+        proxy = LatencyProxy(httpd.server_address, args.rtt_ms / 1000)
+        frame_path = "the_image.epdf?bpp=4&device=bench"
+        try:
+            for mode in ("close", "keep-alive", "pipelined"):
+                proxy.connections = lookups.calls = 0
+                latencies = list()
+                for _ in range(args.wakes):
+                    start = time.perf_counter()
+                    bodies = wake("127.0.0.1", proxy.port, [frame_path] + files, mode)
+                    latencies.append(time.perf_counter() - start)
+                    expected = [image_server.shown_frame("bench").encode("epdf", bpp=4)]
+                    for name in files:
+                        with open(os.path.join(repo_dir, name), "rb") as fh:
+                            expected.append(fh.read())
+                    if [zlib.crc32(body) for body in bodies] != [zlib.crc32(body) for body in expected]:
+                        raise AssertionError(f"{mode} read the wrong bodies")
+                stats = summarize(latencies)
+                print(f"{mode:>10}: {len(files) + 2} requests per wake in p50 {stats['p50_ms']:.0f} ms, "
+                      f"{proxy.connections / args.wakes:.0f} connections and {lookups.calls / args.wakes:.0f} "
+                      f"name lookups per wake")
+        finally:
+            comm.socket.getaddrinfo = lookups._getaddrinfo
+            proxy.close()
+            httpd.shutdown()
+            httpd.server_close()
+            image_server.close()
+
+
+if __name__ == "__main__":
+    main()
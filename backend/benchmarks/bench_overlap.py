@@ -0,0 +1,165 @@
+"""
+Wall-clock time to load a frame into the EPD controller with the network receive overlapped with SPI (two buffers,
+one filled on a second thread while the other is sent) against receiving and sending in turn. Runs the device's
+driver (frontend S1D135xx._load_image) under CPython against the real request handler, behind a proxy that paces the
+response to the WiFi's throughput, with SPI replaced by a fake that takes as long as the bus would.
+
+    python benchmarks/bench_overlap.py --loads 5 --net-kbps 1000 --spi-mhz 20
+
+The device's socket gets a receive buffer the size of lwIP's TCP window on the ESP32 (5744 bytes), so while it's busy
+with SPI the server can only send that much ahead, as on the device. Every load is checked against the frame served.
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from common import BACKEND_DIR, make_corpus, serve_in_thread, summarize
+from frame_format import EPDF_HEADER
+import server
+
+sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+from bench_crop import BenchDriver
+from hardware.display_platforms.pl_epd.epson.epson_s1d135xx import S1D135xx
+from utils import comm
+
+TCP_WND = 5744
+SEGMENT = 1460
+
+
+class DeviceSocket(socket.socket):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TCP_WND)
+
+
+class TimedSpi:
+    def __init__(self, bytes_per_s):
+        self._bytes_per_s = bytes_per_s
+        self.crc = 0
+
+    def write_bytes(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        time.sleep(len(data) / self._bytes_per_s)
+
+
+class ThrottledProxy:
+    """
+    Relays each connection to `upstream`, sending responses on in TCP segments at `bytes_per_s`
+    """
+    def __init__(self, upstream, bytes_per_s):
+        self._upstream = upstream
+        self._bytes_per_s = bytes_per_s
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._relay, args=(client,), daemon=True).start()
+
+    def _relay(self, client):
+        # Small send buffer, what's waiting to go out over the air is on this side of it
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TCP_WND)
+        upstream = socket.socket()
+        upstream.connect(self._upstream)
+        threading.Thread(target=self._forward, args=(client, upstream), daemon=True).start()
+        try:
+            data = upstream.recv(65536)
+            due = time.perf_counter()
+            while data:
+                for pos in range(0, len(data), SEGMENT):
+                    segment = data[pos:pos + SEGMENT]
+                    due += len(segment) / self._bytes_per_s
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    # Blocks while the device's window is full, the air time it didn't use is lost
+                    client.sendall(segment)
+                    due = max(due, time.perf_counter())
+                data = upstream.recv(65536)
+        except OSError:
+            pass
+        finally:
+            client.close()
+            upstream.close()
+
+    @staticmethod
+    def _forward(client, upstream):
+        try:
+            data = client.recv(4096)
+            while data:
+                upstream.sendall(data)
+                data = client.recv(4096)
+        except OSError:
+            pass
+
+
+class TimedDriver(BenchDriver):
+    spi_bytes_per_s = 2.5e6
+
+    def __init__(self):
+        self._spi = TimedSpi(self.spi_bytes_per_s)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--loads", type=int, default=5)
+    parser.add_argument("--net-kbps", type=float, default=1000, help="WiFi throughput, KB/s")
+    parser.add_argument("--spi-mhz", type=float, default=20)
+    parser.add_argument("--bpp", type=int, default=4, choices=(4, 8))
+    parser.add_argument("--encoding", default="raw")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus"))
+    args = parser.parse_args()
+
+    TimedDriver.spi_bytes_per_s = args.spi_mhz * 1e6 / 8
+    comm.socket.socket = DeviceSocket
+    corpus = make_corpus(args.corpus, args.images)
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in corpus:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        image_server = server.image_server = server.ImageServer(repo_dir=repo_dir, dedup_distance=None)
+        httpd = serve_in_thread(server.ImageRequestHandler, server_cls=server.FleetHTTPServer)
+        proxy = ThrottledProxy(httpd.server_address, args.net_kbps * 1024)
+        url = f"http://127.0.0.1/the_image.epdf?bpp={args.bpp}&encoding={args.encoding}&device=bench:{proxy.port}"
+        try:
+            for overlap in (False, True):
+                S1D135xx.OVERLAP_TRANSFERS = overlap
+                latencies = list()
+                for _ in range(args.loads):
+                    driver = TimedDriver()
+                    start = time.perf_counter()
+                    driver.load_image(url, None, 0, 0)
+                    latencies.append(time.perf_counter() - start)
+                    comm.close_connections()
+                    frame = image_server.shown_frame("bench")
+                    if driver._spi.crc != zlib.crc32(frame.encode("epdf", bpp=args.bpp)[EPDF_HEADER.size:]):
+                        raise AssertionError("Loaded frame doesn't match the one served")
+                stats = summarize(latencies)
+                print(f"{'overlapped' if overlap else 'serial':>10}: load p50 {stats['p50_ms']:.0f} ms, "
+                      f"max {stats['max_ms']:.0f} ms ({args.encoding}, {args.bpp}bpp, {args.net_kbps:.0f} KB/s, "
+                      f"SPI at {args.spi_mhz:.0f} MHz)")
+        finally:
+            proxy.close()
+            httpd.shutdown()
+            httpd.server_close()
+            image_server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+GET latency of the_image.pgm with and without background pre-rendering.
+
+    python benchmarks/bench_prefetch.py --images 30 --requests 20
+
+Without prefetch the render runs on the request thread right after the response, so it shows up as latency
+whenever the next request arrives before it finishes. --interval 0 measures sustained render throughput instead.
+"""
+import argparse
+import os
+import tempfile
+import time
+import urllib.request
+
+from common import make_corpus, summarize, serve_in_thread
+import server
+
+
+def run(repo_dir, prefetch, requests, interval):
+    image_server = server.ImageServer(repo_dir=repo_dir, prefetch=prefetch)
+    server.IMAGE_REPO_DIR = repo_dir
+    server.image_server = image_server
+    httpd = serve_in_thread(server.ImageRequestHandler)
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/the_image.pgm"
+
+    latencies = list()
+    try:
+        for _ in range(requests):
+            # Give the background workers the time a real device would leave between wakes
+            time.sleep(interval)
+            start = time.perf_counter()
+            with urllib.request.urlopen(url) as resp:
+                resp.read()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        image_server.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus"))
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.corpus, args.images)
+    for prefetch in (0, args.prefetch):
+        with tempfile.TemporaryDirectory() as repo_dir:
+            for path in corpus:
+                os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+            stats = summarize(run(repo_dir, prefetch, args.requests, args.interval))
+            print(f"prefetch={prefetch}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
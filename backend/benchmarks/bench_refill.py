@@ -0,0 +1,100 @@
+"""
+Background refills against stand-in sources: one that takes --pull-latency seconds to come back with --batch new
+images, and one that always fails. A device takes frames at --rate frames/s straight from ImageServer, and the time
+each take_frame call takes is measured, along with how often the device found nothing new. Pulls never show up in
+that time, they run on the refill thread. Run once with a fixed low watermark, and once forecasting it from the
+serve rate (--lead), which starts pulls early enough for the device not to run dry.
+
+    python benchmarks/bench_refill.py --rate 20 --pull-latency 1 --batch 30 --seconds 8
+"""
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+import time
+
+from common import make_corpus, summarize
+from image_repo_builder import ImageRepoBuilder
+import server
+
+
+class StandInBuilder(ImageRepoBuilder):
+    corpus = list()
+    latency = 1.0
+    batch = 30
+    failures = list()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._count = itertools.count()
+
+    def sources(self):
+        return {"slow": self._slow, "broken": self._broken}
+
+    def _slow(self):
+        time.sleep(self.latency)
+        for _ in range(self.batch):
+            i = next(self._count)
+            path = os.path.join(self._dest_dir, f"pulled_{i:06d}.jpg")
+            shutil.copyfile(self.corpus[i % len(self.corpus)], path)
+            self._register(path)
+
+    def _broken(self):
+        StandInBuilder.failures.append(time.monotonic())
+        raise ConnectionError("stand-in source is down")
+
+
+def run(args, lead):
+    StandInBuilder.failures = list()
+    with tempfile.TemporaryDirectory() as repo_dir:
+        image_server = server.ImageServer(repo_dir=repo_dir, prefetch=2, min_queue=args.low, max_queue=args.high,
+                                          refill_lead=lead, dedup_distance=None)
+        image_server._refills._backoff = 0.5
+        try:
+            # First pull, before the device starts
+            while image_server._level() < args.low:
+                time.sleep(0.05)
+            samples = list()
+            starved = 0
+            start = time.monotonic()
+            for i in range(int(args.seconds * args.rate)):
+                time.sleep(max(0.0, start + i / args.rate - time.monotonic()))
+                t = time.perf_counter()
+                frame, shown, new = image_server.take_frame("bench")
+                samples.append(time.perf_counter() - t)
+                if frame is None or frame is shown:
+                    starved += 1
+            failures = [round(t - StandInBuilder.failures[0], 1) for t in StandInBuilder.failures]
+        finally:
+            image_server.close()
+    return summarize(samples), starved, failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=20, help="frames/s the device takes")
+    parser.add_argument("--pull-latency", type=float, default=1.0)
+    parser.add_argument("--batch", type=int, default=30, help="new images per pull")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--low", type=int, default=5)
+    parser.add_argument("--high", type=int, default=30)
+    parser.add_argument("--lead", type=float, default=3, help="seconds of serving the forecast covers")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus_small"))
+    args = parser.parse_args()
+
+    StandInBuilder.corpus = make_corpus(args.corpus, 20, size=(800, 600))
+    StandInBuilder.latency = args.pull_latency
+    StandInBuilder.batch = args.batch
+    server.ImageRepoBuilder = StandInBuilder
+    for lead in (0, args.lead):
+        stats, starved, failures = run(args, lead)
+        print(f"lead={lead}s: take_frame p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms, "
+              f"max {stats['max_ms']:.1f} ms (pulls take {args.pull_latency * 1000:.0f} ms); "
+              f"nothing new on {starved} of {stats['count']} takes")
+        print(f"    broken source tried at {failures} s")
+        assert stats["max_ms"] < args.pull_latency * 1000
+
+
+if __name__ == "__main__":
+    main()
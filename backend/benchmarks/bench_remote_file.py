@@ -0,0 +1,150 @@
+"""
+The device's HTTP reader (frontend utils/comm.py RemoteFile) under CPython, against a local stand-in serving a full
+PGM frame with the real server's headers: opening (connect and HTTP header), the PGM header, and reading the whole
+frame in 2 KB chunks, with read() and with readinto() into one buffer. Compared with the reader it replaced, which
+received the headers a byte at a time and handed out whatever recv() returned. Socket calls are counted too, each is
+a trip through lwIP on the ESP32.
+
+    python benchmarks/bench_remote_file.py --runs 20
+
+Every read is checked against the frame that was served. Over loopback the frame is there as fast as it's read, which
+flatters the old reader: each of its calls is one recv(), against a few Python calls for the new one.
+"""
+import argparse
+import http.server
+import os
+import socket
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from common import BACKEND_DIR, serve_in_thread, summarize
+from frame_format import encode_pgm
+
+sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+from utils import comm, misc
+
+CHUNK = 2048
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    body = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/x-portable-graymap")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.send_header("ETag", 'W/"0123456789abcdef"')
+        self.send_header("Vary", "Accept")
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CountingSocket(socket.socket):
+    calls = 0
+
+    def recv(self, *args):
+        CountingSocket.calls += 1
+        return super().recv(*args)
+
+    def recv_into(self, *args):
+        CountingSocket.calls += 1
+        return super().recv_into(*args)
+
+
+class UnbufferedRemoteFile(comm.RemoteFile):
+    # How RemoteFile used to read: one recv() per call, headers one byte at a time
+    def __init__(self, url, port, headers=None):
+        _, _, host, path = url.split('/', 3)
+        self._socket = CountingSocket()
+        self._socket.connect(socket.getaddrinfo(host, port)[0][-1])
+        self._socket.send(f"GET /{path} HTTP/1.0\r\nHost: {host}\r\n\r\n".encode())
+        self._curr_pos = 0
+        self.headers = {"content-type": "image/x-portable-graymap"}
+        self.readline(end=b"\r\n\r\n")
+        self._curr_pos = 0
+
+    def read(self, nbytes):
+        rx = self._socket.recv(nbytes)
+        self._curr_pos += len(rx)
+        return rx
+
+    def readline(self, end=b"\n"):
+        line = b""
+        while line[-len(end):] != end:
+            line += self.read(1)
+        return line
+
+    def close(self):
+        self._socket.close()
+
+
+def run(url, port, reader, expected, runs):
+    samples = {"open": list(), "pgm_header": list(), "frame": list()}
+    calls = 0
+    for _ in range(runs):
+        CountingSocket.calls = 0
+        start = time.perf_counter()
+        img_file = misc.ImageFile(f"{url}:{port}")
+        samples["open"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        hdr = img_file.read_header()
+        samples["pgm_header"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        crc = size = 0
+        if reader == "readinto":
+            buf = bytearray(CHUNK)
+            view = memoryview(buf)
+            n = img_file._file_handle.readinto(buf)
+            while n:
+                crc = zlib.crc32(view[:n], crc)
+                size += n
+                n = img_file._file_handle.readinto(buf)
+        else:
+            chunk = img_file.read(CHUNK)
+            while chunk:
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                chunk = img_file.read(CHUNK)
+        samples["frame"].append(time.perf_counter() - start)
+        img_file.close()
+        calls += CountingSocket.calls
+        if hdr["width"] != 1280 or (size, crc) != (len(expected), zlib.crc32(expected)):
+            raise AssertionError(f"{reader} read the wrong frame")
+    return samples, calls / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    pixels = np.random.default_rng(0).integers(0, 256, (960, 1280), dtype=np.uint8)
+    StandInHandler.body = encode_pgm(pixels)
+    httpd = serve_in_thread(StandInHandler, server_cls=http.server.ThreadingHTTPServer)
+    url = "http://127.0.0.1/the_image.pgm"
+    port = httpd.server_address[1]
+
+    real_socket = comm.socket.socket
+    comm.socket.socket = CountingSocket
+    try:
+        for reader in ("unbuffered", "read", "readinto"):
+            misc.RemoteFile = UnbufferedRemoteFile if reader == "unbuffered" else comm.RemoteFile
+            samples, calls = run(url, port, reader, pixels.tobytes(), args.runs)
+            line = ", ".join(f"{name} p50 {summarize(values)['p50_ms']:.2f} ms" for name, values in samples.items())
+            print(f"{reader:>10}: {line}, {calls:.0f} socket reads per frame")
+    finally:
+        comm.socket.socket = real_socket
+        httpd.shutdown()
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
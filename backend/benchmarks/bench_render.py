@@ -0,0 +1,70 @@
+"""
+Frames/sec of the render stage against the original PIL-only path (convert, rotate, stretch to the frame size).
+
+    python benchmarks/bench_render.py --images 10
+
+Run it on the server itself, a Pi-class CPU is what matters. The tone curve is also timed on its own, through np.take
+and through a per-pixel Python loop over a slice of the frame, scaled up to a full frame.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from common import make_corpus
+from renderer import FRAME_SIZE, PANELS, render_pixels, tone_lut
+
+
+def legacy(path):
+    img = Image.open(path).convert("L")
+    img = img.rotate(90, expand=1).resize(FRAME_SIZE, Image.Resampling.LANCZOS)
+    return np.asarray(img)
+
+
+def pipeline(path, fit, panel):
+    with Image.open(path) as img:
+        return render_pixels(img, fit=fit, panel=panel)
+
+
+def frames_per_s(render, paths, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            render(path)
+    return repeat * len(paths) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus"))
+    args = parser.parse_args()
+
+    paths = make_corpus(args.corpus, args.images)
+    print(f"legacy: {frames_per_s(legacy, paths, args.repeat):.2f} frames/s")
+    for fit in ("fit", "fill"):
+        for panel in PANELS:
+            fps = frames_per_s(lambda path: pipeline(path, fit, panel), paths, args.repeat)
+            print(f"{fit} {panel}: {fps:.2f} frames/s")
+
+    pixels = legacy(paths[0])
+    lut = tone_lut(**PANELS["pl_10.7"])
+    start = time.perf_counter()
+    for _ in range(20):
+        np.take(lut, pixels)
+    print(f"tone curve, np.take: {(time.perf_counter() - start) / 20 * 1000:.2f} ms/frame")
+
+    rows = 16
+    table = lut.tolist()
+    start = time.perf_counter()
+    [[table[v] for v in row] for row in pixels[:rows].tolist()]
+    elapsed = (time.perf_counter() - start) * pixels.shape[0] / rows
+    print(f"tone curve, per pixel: {elapsed * 1000:.2f} ms/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+The on-disk render cache: frame fetch latency with nothing cached, for a second device once the images are rendered,
+after a restart (only the disk cache left), and after changing the render parameters, which must not reuse anything.
+Then a small byte budget, to check eviction keeps the cache within it.
+
+    python benchmarks/bench_render_cache.py --images 40 --budget-mb 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import REALISTIC_SIZES, make_corpus, summarize
+import server
+
+
+def fetch_all(image_server, device, count, params):
+    samples = list()
+    for _ in range(count):
+        start = time.perf_counter()
+        frame, _, _ = image_server.take_frame(device)
+        frame.encode("epdf", **params)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--budget-mb", type=float, default=8)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus_realistic"))
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.corpus, args.images, size=REALISTIC_SIZES)
+    params = {"bpp": 4, "encoding": "deflate"}
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in corpus:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+
+        def _server(**kwargs):
+            # In-memory frames kept few, so the second device mostly reads back from disk
+            image_server = server.ImageServer(repo_dir=repo_dir, dedup_distance=None, **kwargs)
+            image_server._renders._max_frames = 4
+            return image_server
+
+        image_server = _server()
+        print(f"nothing cached: {fetch_all(image_server, 'a', args.images, params)}")
+        print(f"second device: {fetch_all(image_server, 'b', args.images, params)}")
+        image_server.close()
+
+        image_server = _server()
+        print(f"after restart: {fetch_all(image_server, 'c', args.images, params)}")
+        stats = dict(image_server.renders.store.stats)
+        print(f"    disk cache: {stats}")
+        assert stats.get("frame_miss", 0) == 0 and stats.get("epdf_miss", 0) == 0
+        image_server.close()
+
+        image_server = _server(render={"fit": "fill", "panel": "pl_10.7"})
+        print(f"other fit: {fetch_all(image_server, 'd', args.images, params)}")
+        stats = dict(image_server.renders.store.stats)
+        assert stats.get("frame_hit", 0) == 0, "a render with other parameters was reused"
+        image_server.close()
+
+        budget = int(args.budget_mb * 2 ** 20)
+        image_server = _server(render_cache_bytes=budget)
+        fetch_all(image_server, 'e', args.images, params)
+        store = image_server.renders.store
+        print(f"budget {args.budget_mb} MB: {len(store)} entries, {store.bytes / 2 ** 20:.1f} MB, "
+              f"{store.stats['evictions']} evicted")
+        assert store.bytes <= budget
+        image_server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Frame downloads over a connection that keeps dropping: a proxy in front of the real request handler cuts responses at
+random offsets, and the device's driver (frontend S1D135xx._load_image, SPI replaced by a buffer) has to resume each
+one with a Range request, within the same image load. Every load is checked against the frame the server handed out.
+
+    python benchmarks/bench_resume.py --loads 10 --cut-rate 0.5 --encoding deflate
+
+Without resuming, every load with a cut in it would have failed, and retrying it from scratch takes the next frame.
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from common import make_corpus, serve_in_thread
+from bench_crop import BenchDriver
+from frame_format import EPDF_HEADER
+import server
+
+from utils import misc
+from utils.comm import RemoteFile, close_connections
+
+
+class ResumeCounter(RemoteFile):
+    resumes = 0
+
+    def _resume(self):
+        resumed = super()._resume()
+        ResumeCounter.resumes += resumed
+        return resumed
+
+
+class FlakyProxy:
+    """
+    Relays each connection to `upstream`, cutting `cut_rate` of them somewhere in the first `max_offset` bytes of what
+    comes back. A reconnection is just another connection, it may be cut too
+    """
+    def __init__(self, upstream, cut_rate, max_offset, seed=0):
+        self._upstream = upstream
+        self._cut_rate = cut_rate
+        self._max_offset = max_offset
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self.cuts = 0
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                cut = self._rng.random() < self._cut_rate
+                offset = int(self._rng.integers(1, self._max_offset)) if cut else None
+            threading.Thread(target=self._relay, args=(client, offset), daemon=True).start()
+
+    def _relay(self, client, offset):
+        with client, socket.create_connection(self._upstream) as upstream:
+            # Requests go through as they come, there can be several on a kept alive connection
+            threading.Thread(target=self._forward, args=(client, upstream), daemon=True).start()
+            sent = 0
+            while True:
+                data = upstream.recv(65536)
+                if not data:
+                    return
+                if offset is not None and sent + len(data) >= offset:
+                    # Dropped mid-response, the way a WiFi hiccup looks to the device
+                    client.sendall(data[:offset - sent])
+                    with self._lock:
+                        self.cuts += 1
+                    client.shutdown(socket.SHUT_RDWR)
+                    return
+                client.sendall(data)
+                sent += len(data)
+
+    @staticmethod
+    def _forward(client, upstream):
+        try:
+            data = client.recv(4096)
+            while data:
+                upstream.sendall(data)
+                data = client.recv(4096)
+            upstream.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--loads", type=int, default=10)
+    parser.add_argument("--cut-rate", type=float, default=0.5)
+    parser.add_argument("--bpp", type=int, default=8, choices=(4, 8))
+    parser.add_argument("--encoding", default="raw")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus"))
+    args = parser.parse_args()
+
+    misc.RemoteFile = ResumeCounter
+    corpus = make_corpus(args.corpus, args.images)
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in corpus:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        image_server = server.image_server = server.ImageServer(repo_dir=repo_dir, dedup_distance=None)
+        httpd = serve_in_thread(server.ImageRequestHandler, server_cls=server.FleetHTTPServer)
+        # Cut anywhere in the body, past the HTTP header
+        max_offset = 1280 * 960 * args.bpp // 8 if args.encoding == "raw" else 50000
+        proxy = FlakyProxy(httpd.server_address, args.cut_rate, max_offset)
+        url = f"http://127.0.0.1/the_image.epdf?bpp={args.bpp}&encoding={args.encoding}&device=bench:{proxy.port}"
+        start = time.perf_counter()
+        try:
+            for _ in range(args.loads):
+                driver = BenchDriver()
+                driver.load_image(url, None, 0, 0)
+                # A wake each, the device closes its connection before going back to sleep
+                close_connections()
+                frame = image_server.shown_frame("bench")
+                if bytes(driver._spi.data) != frame.encode("epdf", bpp=args.bpp)[EPDF_HEADER.size:]:
+                    raise AssertionError("Resumed frame doesn't match the one served")
+        finally:
+            proxy.close()
+            httpd.shutdown()
+            httpd.server_close()
+            image_server.close()
+        print(f"{args.loads} loads ({args.encoding}, {args.bpp}bpp) in {time.perf_counter() - start:.1f} s: "
+              f"{proxy.cuts} connections cut, {ResumeCounter.resumes} resumed, every frame intact")
+
+
+if __name__ == "__main__":
+    main()
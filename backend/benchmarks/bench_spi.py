@@ -0,0 +1,147 @@
+"""
+Memory churn of streaming a frame to the EPD controller, running the device's driver (frontend S1D135xx._load_image)
+under CPython with SPI replaced by a fake that counts writes and bytes, and which buffers it was handed. Compared with
+the transfer it replaced, which read a new bytes per 2 KB chunk and, for PGM frames, swapped their byte order through
+a tuple of ints and a second packed bytes. Peak memory during the load is from tracemalloc, and the bytes sent to SPI
+are checked against the frame's.
+
+    python benchmarks/bench_spi.py --runs 5
+
+Frames are loaded from local files (PGM, whose words get swapped on the way, and EPDF, already in panel order) and
+from the real request handler (EPDF, raw and deflated). On the ESP32 every allocation in the loop is a trip through
+the GC heap, and enough of them fragment it: gc.mem_alloc() around a load shows the same difference there.
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+import numpy as np
+
+from common import BACKEND_DIR, make_corpus, serve_in_thread, summarize
+from frame_format import EPDF_HEADER, encode_epdf, encode_pgm
+import server
+
+sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+from bench_crop import BenchDriver
+from hardware.display_platforms.pl_epd.epson.epson_s1d135xx import S1D135xx
+from utils.comm import close_connections
+
+
+class CountingSpi:
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+        # Writes handed a different buffer than the one before, i.e. one allocated for them
+        self.new_buffers = 0
+        self.crc = 0
+        self._last = None
+
+    def write_bytes(self, data):
+        buf = data.obj if isinstance(data, memoryview) else data
+        if buf is not self._last:
+            self.new_buffers += 1
+            # Held on to, so that its id can't be reused by the next one
+            self._last = buf
+        self.writes += 1
+        self.bytes += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+
+
+class StreamDriver(BenchDriver):
+    def __init__(self):
+        self._spi = CountingSpi()
+
+
+class CopyingDriver(StreamDriver):
+    # How frames went to SPI before: a new bytes per chunk, and a tuple of ints plus another bytes to swap them
+    def _transfer_file(self, file, panel_order=False, nbytes=None, overlap=False):
+        remaining = nbytes
+        chunk = file.read(S1D135xx.DATA_BUFFER_LENGTH if nbytes is None else min(nbytes, S1D135xx.DATA_BUFFER_LENGTH))
+        while chunk:
+            if panel_order:
+                self._spi.write_bytes(chunk)
+            else:
+                self._transfer_data(chunk)
+            if remaining is None:
+                chunk = file.read(S1D135xx.DATA_BUFFER_LENGTH)
+                continue
+            remaining -= len(chunk)
+            if not remaining:
+                break
+            chunk = file.read(min(remaining, S1D135xx.DATA_BUFFER_LENGTH))
+
+    def _transfer_data(self, data):
+        data = struct.pack(f"<{len(data) // 2}H", *struct.unpack(f">{len(data) // 2}H", data))
+        self._spi.write_bytes(data)
+
+
+def load(driver_cls, path):
+    driver = driver_cls()
+    tracemalloc.start()
+    start = time.perf_counter()
+    driver.load_image(path, None, 0, 0)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    close_connections()
+    return seconds, peak, driver._spi
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus"))
+    args = parser.parse_args()
+
+    # One buffer, as it's used without receiving on a second thread, see bench_overlap.py for that
+    S1D135xx.OVERLAP_TRANSFERS = False
+    pixels = np.random.default_rng(0).integers(0, 256, (960, 1280), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as tmp_dir, tempfile.TemporaryDirectory() as repo_dir:
+        frames = {"pgm": encode_pgm(pixels), "epdf": encode_epdf(pixels)}
+        for ext, data in frames.items():
+            with open(os.path.join(tmp_dir, f"frame.{ext}"), "wb") as fh:
+                fh.write(data)
+        for path in make_corpus(args.corpus, 2):
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        image_server = server.image_server = server.ImageServer(repo_dir=repo_dir, dedup_distance=None)
+        httpd = serve_in_thread(server.ImageRequestHandler, server_cls=server.FleetHTTPServer)
+        url = f"http://127.0.0.1/the_image.epdf?device=bench%s:{httpd.server_address[1]}"
+        sources = {
+            "local pgm": (os.path.join(tmp_dir, "frame.pgm"), None),
+            "local epdf": (os.path.join(tmp_dir, "frame.epdf"), None),
+            "http epdf raw": (url % "", "raw"),
+            "http epdf deflate": (url % "&encoding=deflate", "deflate"),
+        }
+        try:
+            # The server runs in this process: have it encode every frame before anything is traced
+            for path, encoding in list(sources.values())[2:]:
+                for _ in range(2):
+                    load(StreamDriver, path)
+            for name, (path, encoding) in sources.items():
+                for driver_cls in (CopyingDriver, StreamDriver):
+                    latencies, peaks = list(), list()
+                    for _ in range(args.runs):
+                        seconds, peak, spi = load(driver_cls, path)
+                        latencies.append(seconds)
+                        peaks.append(peak)
+                        # Every GET hands out the next frame, check against the one just served
+                        payload = image_server.shown_frame("bench").encode("epdf") if encoding else frames["epdf"]
+                        if spi.crc != zlib.crc32(payload[EPDF_HEADER.size:]):
+                            raise AssertionError(f"{name}: SPI got the wrong bytes")
+                    label = "copying" if driver_cls is CopyingDriver else "streaming"
+                    print(f"{name:>17} {label:>9}: load p50 {summarize(latencies)['p50_ms']:.1f} ms, peak "
+                          f"{max(peaks) / 1024:.0f} KB, {spi.bytes / 1024:.0f} KB in {spi.writes} writes from "
+                          f"{spi.new_buffers} buffers")
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            image_server.close()
+
+
+if __name__ == "__main__":
+    main()
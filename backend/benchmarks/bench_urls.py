@@ -0,0 +1,126 @@
+"""
+URL source polls against a local stand-in that answers each request after a delay. A third of the URLs send an ETag,
+a third Last-Modified, the rest neither. Polls the lot three times, changing some images before the last poll, and
+checks that unchanged URLs come back 304 without a body, changed ones add a new file, and that no more than
+--concurrency requests were ever in flight at once.
+
+    python benchmarks/bench_urls.py --urls 60 --latency 0.2 --concurrency 8
+"""
+import argparse
+import email.utils
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+import time
+
+from bench_downloads import jpeg
+from common import serve_in_thread
+from image_repo_builder import ImageRepoBuilder
+from repo_inventory import RepoInventory
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    # path -> image bytes
+    images = dict()
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    statuses = dict()
+    body_bytes = 0
+
+    def do_GET(self):
+        cls = StandInHandler
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            time.sleep(self.latency)
+            body = cls.images[self.path]
+            version = hashlib.md5(body).hexdigest()
+            etag = f'"{version}"'
+            last_modified = email.utils.formatdate(int(version[:6], 16), usegmt=True)
+            if self.path.startswith("/etag/") and self.headers.get("If-None-Match") == etag:
+                return self._respond(304)
+            if self.path.startswith("/lm/") and self.headers.get("If-Modified-Since") == last_modified:
+                return self._respond(304)
+            headers = {"Content-Type": "image/jpeg", "Content-Length": str(len(body))}
+            if self.path.startswith("/etag/"):
+                headers["ETag"] = etag
+            if self.path.startswith("/lm/"):
+                headers["Last-Modified"] = last_modified
+            self._respond(200, headers, body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def _respond(self, status, headers=None, body=b""):
+        with StandInHandler.lock:
+            StandInHandler.statuses[status] = StandInHandler.statuses.get(status, 0) + 1
+            StandInHandler.body_bytes += len(body)
+        self.send_response(status)
+        for name, value in (headers or {"Content-Length": "0"}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def poll(builder):
+    StandInHandler.statuses = dict()
+    StandInHandler.body_bytes = 0
+    start = time.perf_counter()
+    builder.download_from_urls()
+    return time.perf_counter() - start, dict(StandInHandler.statuses), StandInHandler.body_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    kinds = ("etag", "lm", "plain")
+    paths = [f"/{kinds[i % 3]}/{i}.jpg" for i in range(args.urls)]
+    StandInHandler.latency = args.latency
+    StandInHandler.images = {path: jpeg(size=(800, 600), seed=i) for i, path in enumerate(paths)}
+    httpd = serve_in_thread(StandInHandler, server_cls=http.server.ThreadingHTTPServer)
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        with tempfile.TemporaryDirectory() as repo_dir:
+            inventory = RepoInventory(repo_dir)
+            builder = ImageRepoBuilder(dest_dir=repo_dir, inventory=inventory, workers=args.concurrency,
+                                       urls=[base_url + path for path in paths])
+            for attempt in ("first poll", "re-poll"):
+                elapsed, responses, body_bytes = poll(builder)
+                print(f"{attempt}: {elapsed:.2f} s, responses {responses}, {body_bytes / 1e6:.2f} MB of bodies, "
+                      f"{len(inventory)} images")
+            assert len(inventory) == args.urls
+            unchanged = sum(1 for path in paths if not path.startswith("/plain/"))
+            assert responses.get(304) == unchanged, f"{responses.get(304)} of {unchanged} URLs answered 304"
+
+            changed = paths[:6]
+            for i, path in enumerate(changed):
+                StandInHandler.images[path] = jpeg(size=(800, 600), seed=1000 + i)
+            elapsed, responses, body_bytes = poll(builder)
+            print(f"after changing {len(changed)}: {elapsed:.2f} s, responses {responses}, {len(inventory)} images")
+            assert len(inventory) == args.urls + len(changed)
+            assert not [name for name in os.listdir(repo_dir) if name.endswith(".temp")]
+
+            print(f"at most {StandInHandler.max_in_flight} requests in flight")
+            assert StandInHandler.max_in_flight <= args.concurrency
+            builder.close()
+            inventory.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+import http.server
+
+import numpy as np
+from PIL import Image
+
+# Benchmarks are run as scripts from anywhere, make the backend modules importable
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+# What the sources actually hand out: phone photos, Instagram portrait and square posts, and the odd landscape
+REALISTIC_SIZES = [(4032, 3024), (1080, 1350), (1080, 1080), (1600, 1200)]
+
+
+def make_corpus(dest_dir, count, size=(4032, 3024), seed=0):
+    """
+    Write `count` JPEGs that look roughly like phone photos / quote cards: smooth gradients, some noise and
+    a few flat blocks, so that both decoding and compression behave like on real images.
+    `size` can also be a list of sizes, taken in turn. The same arguments always give the same images, and images
+    already in `dest_dir` are kept, so a corpus is only generated once.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    sizes = size if isinstance(size, list) else [size]
+    paths = list()
+    for i in range(count):
+        width, height = sizes[i % len(sizes)]
+        path = os.path.join(dest_dir, f"synthetic_{seed}_{i:06d}_{width}x{height}.jpg")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        # Seeded per image, so an image doesn't depend on which others were already there
+        rng = np.random.default_rng([seed, i])
+        xx = np.linspace(0, 255, width, dtype=np.float32)
+        yy = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        base = (xx * rng.uniform(0.2, 1.0) + yy * rng.uniform(0.2, 1.0)) / 2
+        noise = rng.normal(0, 12, (-(-height // 8), -(-width // 8))).astype(np.float32)
+        base += np.kron(noise, np.ones((8, 8), dtype=np.float32))[:height, :width]
+        for _ in range(4):
+            x0, y0 = rng.integers(width // 2), rng.integers(height // 2)
+            base[y0:y0 + height // 6, x0:x0 + width // 4] = rng.uniform(0, 255)
+        rgb = np.clip(np.stack([base, base * 0.9, base * 0.8], axis=-1), 0, 255).astype(np.uint8)
+        Image.fromarray(rgb, "RGB").save(path, quality=90)
+    return paths
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    samples = sorted(samples)
+    k = min(len(samples) - 1, max(0, round(pct / 100 * (len(samples) - 1))))
+    return samples[k]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000 if samples else float("nan"),
+    }
+
+
+def serve_in_thread(handler_cls, server_cls=None):
+    if server_cls is None:
+        # What server.py serves with: the handler keeps connections alive, so one thread per connection
+        import server
+        server_cls = server.FleetHTTPServer
+    httpd = server_cls(("127.0.0.1", 0), handler_cls)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
@@ -0,0 +1,105 @@
+"""
+Drive many simulated devices against the frame endpoint and report throughput and latency.
+
+    python benchmarks/load_test.py --clients 32 --requests 5
+    python benchmarks/load_test.py --url http://raspberrypi.local:8080/the_image.pgm
+
+Without --url an in-process server is started on a synthetic corpus, once single-threaded and once threaded.
+--slow-clients adds devices that read their frame at WiFi-like speed, which stall everybody on a single thread.
+"""
+import argparse
+import http.server
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from common import make_corpus, summarize, serve_in_thread
+import server
+
+
+def fetch(url, read_delay=0.0, chunk_size=1024):
+    parts = urllib.parse.urlsplit(url)
+    start = time.perf_counter()
+    received = 0
+    with socket.create_connection((parts.hostname, parts.port or 80)) as sock:
+        path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+        sock.sendall(f"GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n\r\n".encode())
+        while True:
+            data = sock.recv(chunk_size)
+            if not data:
+                break
+            received += len(data)
+            if read_delay:
+                time.sleep(read_delay)
+    return time.perf_counter() - start, received
+
+
+def run_clients(url, clients, requests, slow_clients=0):
+    latencies = list()
+    received = 0
+    lock = threading.Lock()
+
+    def _device(slow):
+        nonlocal received
+        for _ in range(requests):
+            latency, nbytes = fetch(url, read_delay=0.002 if slow else 0.0, chunk_size=16384 if slow else 65536)
+            if not slow:
+                with lock:
+                    latencies.append(latency)
+                    received += nbytes
+
+    threads = [threading.Thread(target=_device, args=(i < slow_clients,)) for i in range(clients + slow_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    stats = summarize(latencies)
+    stats["requests_per_s"] = len(latencies) / elapsed
+    stats["mb_per_s"] = received / elapsed / 1e6
+    return stats
+
+
+def run_local(args, server_cls):
+    corpus = make_corpus(args.corpus, args.images, size=(1600, 1200))
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in corpus:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        server.IMAGE_REPO_DIR = repo_dir
+        server.image_server = server.ImageServer(repo_dir=repo_dir, prefetch=args.prefetch)
+        httpd = serve_in_thread(server.ImageRequestHandler, server_cls=server_cls)
+        try:
+            url = f"http://127.0.0.1:{httpd.server_address[1]}/the_image.pgm"
+            return run_clients(url, args.clients, args.requests, slow_clients=args.slow_clients)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            server.image_server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--slow-clients", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--images", type=int, default=120)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus_small"))
+    args = parser.parse_args()
+
+    if args.url:
+        print(run_clients(args.url, args.clients, args.requests, slow_clients=args.slow_clients))
+        return
+
+    for server_cls in (http.server.HTTPServer, http.server.ThreadingHTTPServer):
+        print(f"{server_cls.__name__}: {run_local(args, server_cls)}")
+
+
+if __name__ == "__main__":
+    main()
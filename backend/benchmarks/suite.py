@@ -0,0 +1,261 @@
+"""
+The backend benchmark suite: serving cost stage by stage, device queue upkeep at large repository sizes, and
+simulated devices fetching frames end to end, on a synthetic corpus at the sizes the sources hand out.
+
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --output after.json --compare before.json
+
+Every timing is reported as p50/p99 (ms) with a throughput, and the lot is saved as JSON along with the machine and
+commit it ran on. --compare prints how each p50/p99 moved against an earlier run. --sections picks what to run.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+from common import REALISTIC_SIZES, make_corpus, serve_in_thread, summarize
+from bench_fleet import wake
+from load_test import run_clients
+from device_cursor import DeviceCursor
+from frame_format import Frame
+from history_store import HistoryStore
+from renderer import FRAME_SIZE, PANELS, render_pixels, tone_lut
+from repo_inventory import RepoInventory
+import server
+
+
+def timed(samples, name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    samples.setdefault(name, list()).append(time.perf_counter() - start)
+    return result
+
+
+def with_throughput(samples):
+    stats = summarize(samples)
+    stats["per_s"] = len(samples) / sum(samples) if samples else 0.0
+    return stats
+
+
+def bench_stages(paths, repeat, fit="fit", panel="pl_10.7"):
+    """
+    What serving a new image costs, split the way render_pixels and take_frame do it
+    """
+    width, height = FRAME_SIZE
+    canvas = (height, width)
+    lut = tone_lut(**PANELS[panel])
+    samples = dict()
+
+    def _decode(path):
+        img = Image.open(path)
+        img.draft("L", canvas)
+        return img.convert("L")
+
+    def _resize(img):
+        pick = min if fit == "fit" else max
+        scale = pick(canvas[0] / img.width, canvas[1] / img.height)
+        scaled = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(scaled, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if scaled != canvas:
+            frame = Image.new("L", canvas, 255)
+            frame.paste(img, ((canvas[0] - scaled[0]) // 2, (canvas[1] - scaled[1]) // 2))
+            img = frame
+        return img
+
+    def _save(pixels, path):
+        tmp_path = f"{path}.tmp"
+        Image.fromarray(pixels, "L").save(tmp_path, format="PPM")
+        os.replace(tmp_path, path)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        history = HistoryStore(os.path.join(tmp_dir, "history.log"))
+        cursor = DeviceCursor("bench", tmp_dir, history=history)
+        for i in range(repeat):
+            for path in paths:
+                start = time.perf_counter()
+                img = timed(samples, "decode", _decode, path)
+                img = timed(samples, "resize", _resize, img)
+                pixels = timed(samples, "rotate", lambda: np.asarray(img.transpose(Image.Transpose.ROTATE_90)))
+                pixels = timed(samples, "tone_curve", np.take, lut, pixels)
+                timed(samples, "save", _save, pixels, os.path.join(tmp_dir, "frame.pgm"))
+                timed(samples, "encode_epdf", lambda: Frame(pixels).encode("epdf", bpp=4, encoding="deflate"))
+                timed(samples, "history_add", history.add, f"{path}.{i}")
+                timed(samples, "cursor_save", cursor._save)
+                samples.setdefault("total", list()).append(time.perf_counter() - start)
+                if i == 0:
+                    # The stages have to add up to what's actually served
+                    with Image.open(path) as src:
+                        assert np.array_equal(pixels, render_pixels(src, fit=fit, panel=panel)), path
+        cursor.close()
+    return {name: with_throughput(stage) for name, stage in samples.items()}
+
+
+class NoRenders:
+    # Stands in for the RenderCache, only the queue upkeep is timed
+    def get(self, source):
+        future = Future()
+        future.set_result(source)
+        return future
+
+
+def bench_queue(sizes, takes, devices, depth=3):
+    """
+    A device's queue upkeep (fill, take, remaining, as in take_frame), rescans and reloads of the inventory, and
+    gauging the neediest of many devices as the refill scheduler does, for repositories of each size
+    """
+    results = dict()
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as repo_dir:
+            for i in range(size):
+                open(os.path.join(repo_dir, f"img_{i:07d}.jpg"), "wb").close()
+            stats = dict()
+            start = time.perf_counter()
+            inventory = RepoInventory(repo_dir)
+            stats["scan_s"] = time.perf_counter() - start
+            inventory.close()
+            start = time.perf_counter()
+            inventory = RepoInventory(repo_dir)
+            stats["load_s"] = time.perf_counter() - start
+
+            state_dir = os.path.join(repo_dir, "devices")
+            os.makedirs(state_dir)
+            renders = NoRenders()
+            cursors = [DeviceCursor(f"frame{i:04d}", state_dir) for i in range(devices)]
+            samples = list()
+            cursor = cursors[0]
+            for _ in range(min(takes, size)):
+                start = time.perf_counter()
+                cursor.fill(inventory, renders, depth)
+                cursor.take()
+                cursor.fill(inventory, renders, depth)
+                cursor.remaining(inventory)
+                samples.append(time.perf_counter() - start)
+            stats["take"] = with_throughput(samples)
+
+            samples = list()
+            for _ in range(20):
+                start = time.perf_counter()
+                min(c.remaining(inventory) for c in cursors)
+                samples.append(time.perf_counter() - start)
+            stats[f"level_{devices}_devices"] = with_throughput(samples)
+
+            samples = list()
+            for i in range(100):
+                path = os.path.join(repo_dir, f"new_{i:04d}.jpg")
+                open(path, "wb").close()
+                start = time.perf_counter()
+                inventory.register(path)
+                samples.append(time.perf_counter() - start)
+            stats["register"] = with_throughput(samples)
+
+            for c in cursors:
+                c.close()
+            inventory.close()
+        results[str(size)] = stats
+    return results
+
+
+def bench_load(paths, clients, requests, devices, prefetch):
+    """
+    Simulated devices fetching frames through ImageRequestHandler on an in-process server
+    """
+    results = dict()
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for path in paths:
+            os.symlink(path, os.path.join(repo_dir, os.path.basename(path)))
+        server.IMAGE_REPO_DIR = repo_dir
+        server.image_server = server.ImageServer(repo_dir=repo_dir, prefetch=prefetch, dedup_distance=None,
+                                                 max_devices=devices)
+        httpd = serve_in_thread(server.ImageRequestHandler, server_cls=server.FleetHTTPServer)
+        base_url = f"http://127.0.0.1:{httpd.server_address[1]}/the_image"
+        try:
+            for name, query in (("pgm", ".pgm"), ("epdf_4bpp_deflate", ".epdf?bpp=4&encoding=deflate")):
+                results[f"{clients}_clients_{name}"] = run_clients(base_url + query, clients, requests)
+            results[f"{devices}_devices_waking"] = wake(f"{base_url}.epdf?bpp=4", devices)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            server.image_server.close()
+    return results
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old, new, path=""):
+    # Print how every p50/p99 moved, walking both result trees side by side
+    for key, value in new.items():
+        if not isinstance(value, dict) or key == "meta":
+            continue
+        before = old.get(key)
+        if not isinstance(before, dict):
+            continue
+        if "p50_ms" in value and "p50_ms" in before:
+            moves = [f"{pct} {before[f'{pct}_ms']:.3f} -> {value[f'{pct}_ms']:.3f} ms "
+                     f"({(value[f'{pct}_ms'] / before[f'{pct}_ms'] - 1) * 100 if before[f'{pct}_ms'] else 0:+.0f}%)"
+                     for pct in ("p50", "p99")]
+            print(f"{path}{key}: {', '.join(moves)}")
+        else:
+            compare(before, value, f"{path}{key}/")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", default="stages,queue,load")
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--repo-sizes", default="1000,10000,100000")
+    parser.add_argument("--takes", type=int, default=500)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "epd_corpus_realistic"))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="results of an earlier run")
+    args = parser.parse_args()
+    sections = args.sections.split(",")
+
+    paths = make_corpus(args.corpus, args.images, size=REALISTIC_SIZES)
+    results = {"meta": {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }}
+    if "stages" in sections:
+        results["stages"] = bench_stages(paths, args.repeat)
+    if "queue" in sections:
+        sizes = [int(size) for size in args.repo_sizes.split(",")]
+        results["queue"] = bench_queue(sizes, args.takes, args.devices)
+    if "load" in sections:
+        results["load"] = bench_load(paths, args.clients, args.requests, args.devices, args.prefetch)
+
+    with open(args.output, "w", encoding="utf8") as fh:
+        json.dump(results, fh, indent=2)
+    print(json.dumps({key: value for key, value in results.items() if key != "meta"}, indent=2))
+    print(f"Saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf8") as fh:
+            compare(json.load(fh), results)
+
+
+if __name__ == "__main__":
+    main()
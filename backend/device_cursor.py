@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import deque
+
+from history_store import HistoryStore
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceCursor:
+    """
+    One device's position in the repository: the sequence number (see RepoInventory) of the last image it took, the
+    frames lined up for it next, and its own history, so devices sharing a server never take images from each other.
+    The position is saved to `<state_dir>/<device>.json` every time it moves.
+    """
+    def __init__(self, device, state_dir, history=None):
+        self.device = device
+        # Held while the device's frames are being handed out or lined up
+        self.lock = threading.Lock()
+        self._state_path = os.path.join(state_dir, f"{device}.json")
+        if history is None:
+            history = HistoryStore(os.path.join(state_dir, f"{device}.history.log"))
+        self.history = history
+        # Last image taken, and the last one looked at while lining up (everything in between was already seen)
+        self.taken = -1
+        self._scanned = -1
+        # Last frame handed out, i.e. what the panel shows, as the base for delta updates
+        self.shown = None
+        # (seq, image, Future of its Frame) to be handed out next, in order
+        self.upcoming = deque()
+        # When the server last looked it up, in time.monotonic() seconds
+        self.used = None
+        self._load()
+
+    @staticmethod
+    def safe_id(device):
+        # Device ids end up in file names
+        if re.fullmatch(r"[A-Za-z0-9_.-]{1,64}", device) and not device.startswith("."):
+            return device
+        return hashlib.blake2b(device.encode(), digest_size=8).hexdigest()
+
+    def fill(self, inventory, render_cache, depth):
+        # Line up to `depth` images this device hasn't seen, starting their renders
+        if len(self.upcoming) >= depth:
+            return
+        for seq, image in inventory.after(self._scanned):
+            self._scanned = seq
+            if image in self.history:
+                continue
+            self.upcoming.append((seq, image, render_cache.get(image)))
+            if len(self.upcoming) >= depth:
+                break
+
+    def remaining(self, inventory):
+        # Roughly how many images the device has left to see, once lined up
+        return len(self.upcoming) + inventory.count_after(self._scanned)
+
+    def current(self):
+        # What the device gets on its next fetch, the frame it already has if there's nothing new
+        while self.upcoming:
+            _, image, future = self.upcoming[0]
+            try:
+                return future.result()
+            except Exception as e:
+                logger.error(f"Can't render {image}, skipping it: {e}")
+                self.upcoming.popleft()
+        return self.shown
+
+    def take(self):
+        frame = self.current()
+        if not self.upcoming:
+            return frame
+        seq, image, _ = self.upcoming.popleft()
+        logger.info(f"{self.device} takes {image}")
+        self.taken = seq
+        self.shown = frame
+        self.history.add(image)
+        self._save()
+        return frame
+
+    def close(self):
+        self.history.close()
+
+    def _load(self):
+        try:
+            with open(self._state_path, "r", encoding="utf8") as fh:
+                self.taken = json.load(fh)["taken"]
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Ignoring broken state {self._state_path}: {e}")
+            return
+        self._scanned = self.taken
+
+    def _save(self):
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as fh:
+            json.dump({"taken": self.taken}, fh)
+        os.replace(tmp_path, self._state_path)
@@ -0,0 +1,153 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = REGISTRY.counter("epd_disk_cache_requests_total", "Lookups in the on-disk render cache, per kind and result",
+                            labels=("kind", "result"))
+EVICTIONS = REGISTRY.counter("epd_disk_cache_evictions_total", "Entries evicted from the on-disk render cache")
+
+
+class DiskCache:
+    """
+    Content-addressed files kept within `max_bytes`, the least recently used evicted first. Entries are named after
+    their key, two levels deep (<dir>/<key[:2]>/<key>), and only ever written through a temporary file and a rename,
+    so a crash leaves nothing half written.
+    Recency survives restarts through the files' mtime, which is only refreshed once an hour per entry to spare the SD
+    card a write on every hit.
+    """
+    TOUCH_INTERVAL = 3600
+
+    def __init__(self, cache_dir, max_bytes=256 * 2 ** 20):
+        self._dir = cache_dir
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> [size, mtime], least recently used first
+        self._entries = collections.OrderedDict()
+        self.bytes = 0
+        self.stats = collections.Counter()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.blake2b("\0".join(str(part) for part in parts).encode(), digest_size=16).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def path(self, key):
+        return os.path.join(self._dir, key[:2], key)
+
+    def lookup(self, key, kind="frame"):
+        """
+        :return: the path of the entry, marked as just used, or None if there's none
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                touch = time.time() - entry[1] > self.TOUCH_INTERVAL
+                if touch:
+                    entry[1] = time.time()
+        result = "hit" if entry is not None else "miss"
+        self.stats[f"{kind}_{result}"] += 1
+        REQUESTS.inc(kind=kind, result=result)
+        if entry is None:
+            return None
+        path = self.path(key)
+        if touch:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Removed behind our back
+                self._forget(key)
+                return None
+        return path
+
+    def get(self, key, kind="frame"):
+        path = self.lookup(key, kind)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+
+    def put(self, key, data):
+        tmp_path = f"{self.path(key)}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        return self.adopt(key, tmp_path)
+
+    def adopt(self, key, path):
+        """
+        Move a finished file into the cache under `key`, it must be on the same filesystem
+        :return: its path in the cache
+        """
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        size = os.path.getsize(path)
+        os.replace(path, dest)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[0]
+            self._entries[key] = [size, time.time()]
+            self.bytes += size
+            evicted = self._evict()
+        for old_key in evicted:
+            try:
+                os.remove(self.path(old_key))
+            except FileNotFoundError:
+                pass
+        return dest
+
+    def _evict(self):
+        # Keys to delete, least recently used first, down to the budget. The newest entry always stays
+        evicted = list()
+        while self.bytes > self._max_bytes and len(self._entries) > 1:
+            key, (size, _) = self._entries.popitem(last=False)
+            self.bytes -= size
+            evicted.append(key)
+        self.stats["evictions"] += len(evicted)
+        if evicted:
+            EVICTIONS.inc(len(evicted))
+        return evicted
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[0]
+
+    def _load(self):
+        entries = list()
+        for sub in os.scandir(self._dir):
+            if not sub.is_dir() or len(sub.name) != 2:
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".tmp"):
+                    # Left by a crash
+                    os.remove(entry.path)
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        for mtime, key, size in sorted(entries):
+            self._entries[key] = [size, mtime]
+            self.bytes += size
+        for key in self._evict():
+            os.remove(self.path(key))
+        logger.info(f"Render cache: {len(self._entries)} entries, {self.bytes / 2 ** 20:.1f} MB")
@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DOWNLOADED_BYTES = REGISTRY.counter("epd_downloaded_bytes_total", "Bytes downloaded, per source", labels=("source",))
+DOWNLOADS = REGISTRY.counter("epd_downloads_total", "Files downloaded, per source and outcome",
+                             labels=("source", "result"))
+
+
+class Quota:
+    """
+    At most `n` claims, taken and given back atomically. Nothing else is done under the lock, so checking the quota
+    never waits on a download
+    """
+    def __init__(self, n):
+        self._left = n
+        self._lock = threading.Lock()
+
+    def claim(self):
+        with self._lock:
+            if self._left <= 0:
+                return False
+            self._left -= 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._left += 1
+
+
+class RateLimiter:
+    """
+    Spaces calls to wait() at least 1 / `rate` seconds apart, across threads. No rate means no limit
+    """
+    def __init__(self, rate=None):
+        self._interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self._interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class DownloadPool:
+    """
+    Downloads files on a bounded pool of worker threads shared by all sources. Each worker keeps its own HTTP session,
+    so consecutive downloads from the same host reuse the connection. Requests are spaced out per source (`rate` per
+    second), and bytes, files and busy time are tallied per source in `stats`.
+    """
+    def __init__(self, workers=4, rate=None, timeout=60, chunk_size=65536):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self._local = threading.local()
+        self._rate = rate
+        self._timeout = timeout
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._limiters = dict()
+        self.stats = dict()
+
+    def submit(self, source, url, path, mtime=None, on_done=None):
+        """
+        Queue a download of `url` to `path`. Blocks the caller, not a worker, while the source is over its rate.
+        :param mtime: datetime to stamp the file with, e.g. the post's date
+        :param on_done: called on the worker with (path, exception or None) before the future completes
+        :return: a Future of the path, once the file is completely written
+        """
+        self._limiter(source).wait()
+        return self._executor.submit(self._run, source, url, path, mtime, on_done)
+
+    def log_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        for source, s in stats.items():
+            rate = s["bytes"] / s["seconds"] / 1e6 if s["seconds"] else 0
+            logger.info(f"{source}: {s['files']} files, {s['bytes'] / 1e6:.1f} MB in {s['seconds']:.1f} s "
+                        f"of downloads ({rate:.2f} MB/s)")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _limiter(self, source):
+        with self._lock:
+            if source not in self._limiters:
+                self._limiters[source] = RateLimiter(self._rate)
+            return self._limiters[source]
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _run(self, source, url, path, mtime, on_done):
+        try:
+            self._download(source, url, path, mtime)
+        except Exception as e:
+            DOWNLOADS.inc(source=source, result="failed")
+            if on_done:
+                on_done(path, e)
+            raise
+        if on_done:
+            on_done(path, None)
+        return path
+
+    def _download(self, source, url, path, mtime):
+        start = time.perf_counter()
+        size = 0
+        # Written next to the destination and renamed, so a half downloaded file never shows up in the repository
+        tmp_path = f"{path}.temp"
+        try:
+            with self._session().get(url, stream=True, timeout=self._timeout) as resp:
+                resp.raise_for_status()
+                with open(tmp_path, "wb") as fh:
+                    for chunk in resp.iter_content(self._chunk_size):
+                        fh.write(chunk)
+                        size += len(chunk)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if mtime is not None:
+            os.utime(path, (time.time(), mtime.timestamp()))
+
+        DOWNLOADS.inc(source=source, result="ok")
+        DOWNLOADED_BYTES.inc(size, source=source)
+        with self._lock:
+            s = self.stats.setdefault(source, {"files": 0, "bytes": 0, "seconds": 0.0})
+            s["files"] += 1
+            s["bytes"] += size
+            s["seconds"] += time.perf_counter() - start
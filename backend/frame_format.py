@@ -0,0 +1,357 @@
+import collections
+import hashlib
+import struct
+import threading
+import zlib
+
+import numpy as np
+from PIL import Image
+
+# Binary EPD frame (.epdf): a fixed size little-endian header followed by the pixels, already in the word order the
+# S1D13524 host memory port expects, so the device can hand the payload to SPI as is.
+#   magic, version, bpp, width, height, area left/top/width/height, waveform id, encoding, payload length, payload crc32
+EPDF_MAGIC = b"EPDF"
+EPDF_VERSION = 1
+EPDF_HEADER = struct.Struct("<4sBBHHHHHHbBII")
+
+# Payload encodings. Length and crc in the header are those of the payload as sent. Must match frontend utils/codec.py
+ENCODINGS = {
+    "raw": 0,
+    "deflate": 1,
+    "rle": 2,
+}
+# Raw deflate with a 4KB window, what the device has to keep around while decoding
+DEFLATE_WBITS = 12
+RLE_MAX_RUN = 0x8000
+
+# Delta update (.delta): magic, version, bpp, width, height, number of records, waveform id, then that many EPDF
+# records, each covering one changed area of the frame
+EPDL_MAGIC = b"EPDL"
+EPDL_HEADER = struct.Struct("<4sBBHHHbx")
+
+# Must match S1D13524.wf_table on the device
+WAVEFORMS = {
+    None: -1,
+    "init": 0,
+    "refresh/mono": 1,
+    "refresh": 2,
+    "delta": 3,
+    "delta/mono": 4,
+}
+
+CONTENT_TYPES = {
+    "pgm": "image/x-portable-graymap",
+    "epdf": "application/x-epd-frame",
+    "delta": "application/x-epd-delta",
+}
+
+
+# 4x4 Bayer matrix, normalised to thresholds in [0, 1)
+BAYER_4X4 = (np.array([[0, 8, 2, 10],
+                       [12, 4, 14, 6],
+                       [3, 11, 1, 9],
+                       [15, 7, 13, 5]], dtype=np.float32) + 0.5) / 16
+
+DITHERS = ("ordered", "diffusion", "none")
+
+
+def quantize(pixels, levels=16, dither="ordered"):
+    """
+    Reduce 8-bit greys to `levels` levels, returned as level indices (0 = black).
+    "ordered" is a Bayer dither, a single vectorized pass. "diffusion" diffuses the quantization error to the next row
+    (1/4, 1/2, 1/4), so each row is one vectorized step; smoother gradients than ordered, at about twice the cost.
+    """
+    step = 255 / (levels - 1)
+    scaled = pixels.astype(np.float32) / step
+
+    if dither == "ordered":
+        height, width = pixels.shape
+        threshold = np.tile(BAYER_4X4, (height // 4 + 1, width // 4 + 1))[:height, :width]
+        out = np.floor(scaled + threshold)
+    elif dither == "diffusion":
+        out = np.empty_like(scaled)
+        err = np.zeros(scaled.shape[1], dtype=np.float32)
+        for y in range(scaled.shape[0]):
+            row = scaled[y] + err
+            out[y] = np.clip(np.rint(row), 0, levels - 1)
+            e = row - out[y]
+            err = 0.5 * e
+            err[1:] += 0.25 * e[:-1]
+            err[:-1] += 0.25 * e[1:]
+    elif dither == "none":
+        out = np.rint(scaled)
+    else:
+        raise ValueError(f"Unknown dither {dither}")
+
+    return np.clip(out, 0, levels - 1).astype(np.uint8)
+
+
+def pack_4bpp(levels):
+    # Two pixels per byte, the left pixel in the low nibble, same as the low byte of a word holds the left pixel at 8bpp
+    flat = levels.reshape(-1)
+    return (flat[0::2] | (flat[1::2] << 4)).astype(np.uint8).tobytes()
+
+
+def to_panel_order(data):
+    # The host memory port takes 16-bit words big-endian, pixels are little-endian within a word
+    return np.frombuffer(data, dtype="<u2").byteswap().tobytes()
+
+
+def encode_deflate(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -DEFLATE_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def encode_rle(data, min_run=4):
+    """
+    Byte oriented run length code the device can decode in pure Python, see RleDecoder in frontend utils/codec.py.
+    Only runs of at least `min_run` bytes are worth a run record, everything else goes out as literals.
+    """
+    values = np.frombuffer(data, dtype=np.uint8)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(values)) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(values)])))
+    runs = lengths >= min_run
+
+    out = bytearray()
+    pos = 0
+    for start, length in zip(starts[runs].tolist(), lengths[runs].tolist()):
+        _rle_literals(out, data[pos:start])
+        value = data[start]
+        for count in [RLE_MAX_RUN] * (length // RLE_MAX_RUN) + [length % RLE_MAX_RUN]:
+            if count:
+                out += bytes((0x80 | (count - 1) >> 8, (count - 1) & 0xFF, value))
+        pos = start + length
+    _rle_literals(out, data[pos:])
+    return bytes(out)
+
+
+def _rle_literals(out, data):
+    for i in range(0, len(data), 128):
+        chunk = data[i:i + 128]
+        out.append(len(chunk) - 1)
+        out += chunk
+
+
+PAYLOAD_ENCODERS = {
+    "raw": bytes,
+    "deflate": encode_deflate,
+    "rle": encode_rle,
+}
+
+
+def encode_pgm(pixels):
+    height, width = pixels.shape
+    return b"P5\n%d %d\n255\n" % (width, height) + pixels.tobytes()
+
+
+def panel_pixels(pixels, bpp=8, dither="ordered"):
+    # What the panel will actually get at this depth: greys at 8bpp, level indices at 4bpp
+    if bpp == 8:
+        return pixels
+    if bpp == 4:
+        # The panel waveforms only resolve 16 greys, so this halves the transfer without losing anything visible
+        return quantize(pixels, levels=16, dither=dither)
+    raise ValueError(f"Unsupported bpp {bpp}")
+
+
+def _epdf_record(values, bpp, width, height, area, waveform, encoding="raw"):
+    payload = to_panel_order(values.tobytes() if bpp == 8 else pack_4bpp(values))
+    payload = PAYLOAD_ENCODERS[encoding](payload)
+    header = EPDF_HEADER.pack(EPDF_MAGIC, EPDF_VERSION, bpp, width, height,
+                              area["left"], area["top"], area["width"], area["height"],
+                              WAVEFORMS[waveform], ENCODINGS[encoding], len(payload), zlib.crc32(payload))
+    return header + payload
+
+
+def check_crop(crop, bpp=8, size=None):
+    """
+    A crop is (left, top, width, height) in pixels. Its columns have to fall on the 16-bit words of the host memory
+    port, so the payload stays in word order: even at 8bpp, multiples of 4 at 4bpp. Inside a frame of `size` (width,
+    height) if given.
+    """
+    left, top, width, height = crop
+    align = 16 // bpp
+    if left < 0 or top < 0 or width <= 0 or height <= 0:
+        raise ValueError(f"Invalid crop {crop}")
+    if left % align or width % align:
+        raise ValueError(f"Crop left and width must be multiples of {align} at {bpp}bpp")
+    if size is not None and (left + width > size[0] or top + height > size[1]):
+        raise ValueError(f"Crop {crop} is outside the {size[0]}x{size[1]} frame")
+
+
+def encode_epdf(pixels, waveform="refresh", bpp=8, dither="ordered", encoding="raw", crop=None):
+    """
+    The whole frame, or with `crop` (left, top, width, height) only that window of it, row-contiguous, its position
+    in the area fields of the header. The frame is dithered before cropping, so a crop matches the full frame exactly.
+    """
+    height, width = pixels.shape
+    values = panel_pixels(pixels, bpp, dither)
+    if crop is None:
+        area = {"left": 0, "top": 0, "width": width, "height": height}
+    else:
+        check_crop(crop, bpp, size=(width, height))
+        left, top, crop_width, crop_height = crop
+        area = {"left": left, "top": top, "width": crop_width, "height": crop_height}
+        values = np.ascontiguousarray(values[top:top + crop_height, left:left + crop_width])
+    return _epdf_record(values, bpp, width, height, area, waveform, encoding)
+
+
+def changed_areas(old, new, tile=32, max_areas=8):
+    """
+    Rectangles covering every pixel that differs between two frames, on a `tile` grid.
+    Changed tiles are merged into horizontal runs per tile row, and runs spanning the same columns in consecutive rows
+    into one rectangle. Past `max_areas` rectangles, their bounding box is returned instead.
+    """
+    height, width = new.shape
+    rows, cols = -(-height // tile), -(-width // tile)
+    diff = np.zeros((rows * tile, cols * tile), dtype=bool)
+    diff[:height, :width] = old != new
+    dirty = diff.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+    areas = list()
+    open_runs = dict()
+    for row in range(rows + 1):
+        runs = set()
+        if row < rows:
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], dirty[row].astype(np.int8), [0]))))
+            runs = set(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+        for run in list(open_runs):
+            if run not in runs:
+                areas.append((open_runs.pop(run), row, run))
+        for run in runs:
+            open_runs.setdefault(run, row)
+
+    rects = list()
+    for top, bottom, (left, right) in areas:
+        x0, y0 = left * tile, top * tile
+        rects.append({"left": x0, "top": y0,
+                      "width": min(right * tile, width) - x0, "height": min(bottom * tile, height) - y0})
+
+    if len(rects) > max_areas:
+        x0 = min(r["left"] for r in rects)
+        y0 = min(r["top"] for r in rects)
+        x1 = max(r["left"] + r["width"] for r in rects)
+        y1 = max(r["top"] + r["height"] for r in rects)
+        rects = [{"left": x0, "top": y0, "width": x1 - x0, "height": y1 - y0}]
+    return sorted(rects, key=lambda r: (r["top"], r["left"]))
+
+
+def encode_delta(pixels, base=None, bpp=8, dither="ordered", waveform="delta", tile=32, max_areas=8, encoding="raw"):
+    """
+    Only the parts of `pixels` that differ from `base`, the frame the device is showing: an EPDL header followed by one
+    EPDF record per changed rectangle, each carrying its area and just that area's pixels, row-contiguous.
+    Without a base, or if most of the frame changed, it's a single full frame record with the "refresh" waveform.
+    """
+    height, width = pixels.shape
+    values = panel_pixels(pixels, bpp, dither)
+    full = {"left": 0, "top": 0, "width": width, "height": height}
+
+    if base is None or base.shape != pixels.shape:
+        areas, waveform = [full], "refresh"
+    else:
+        areas = changed_areas(panel_pixels(base, bpp, dither), values, tile=tile, max_areas=max_areas)
+        if sum(a["width"] * a["height"] for a in areas) > 0.6 * width * height:
+            areas, waveform = [full], "refresh"
+
+    records = [_epdf_record(np.ascontiguousarray(values[a["top"]:a["top"] + a["height"],
+                                                        a["left"]:a["left"] + a["width"]]),
+                            bpp, width, height, a, waveform, encoding)
+               for a in areas]
+    header = EPDL_HEADER.pack(EPDL_MAGIC, EPDF_VERSION, bpp, width, height, len(records), WAVEFORMS[waveform])
+    return header + b"".join(records)
+
+
+def decode_epdf_header(data):
+    magic, version, bpp, width, height, left, top, area_width, area_height, waveform, encoding, length, crc = \
+        EPDF_HEADER.unpack(data[:EPDF_HEADER.size])
+    if magic != EPDF_MAGIC or version != EPDF_VERSION:
+        raise ValueError(f"Not an EPDF v{EPDF_VERSION} frame")
+    return {
+        "bpp": bpp,
+        "width": width,
+        "height": height,
+        "area": {"left": left, "top": top, "width": area_width, "height": area_height},
+        "waveform": waveform,
+        "encoding": encoding,
+        "length": length,
+        "crc": crc,
+    }
+
+
+ENCODERS = {
+    "pgm": encode_pgm,
+    "epdf": encode_epdf,
+}
+
+
+class Frame:
+    """
+    A rendered greyscale frame, with its transport encodings computed on first use and kept for later requests.
+    Given a `store` (a DiskCache) and the `key` the frame was rendered under, encodings are also kept on disk, so they
+    survive the frame being dropped from memory or a restart.
+    Crops can be any window a device asks for, only the `MAX_CROPS` last asked for are kept, in memory only.
+    """
+    MAX_CROPS = 8
+
+    def __init__(self, pixels, key=None, store=None):
+        self.pixels = pixels
+        self.key = key
+        self._store = store
+        self._encoded = dict()
+        self._crops = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._etag = None
+
+    @classmethod
+    def from_file(cls, path, key=None, store=None):
+        with Image.open(path) as img:
+            return cls(np.asarray(img.convert("L")), key=key, store=store)
+
+    @property
+    def etag(self):
+        # Identifies the picture, whatever the encoding it's sent in, hence a weak validator
+        if self._etag is None:
+            self._etag = f'W/"{hashlib.blake2b(self.pixels.tobytes(), digest_size=8).hexdigest()}"'
+        return self._etag
+
+    def representation_etag(self, fmt="pgm", **params):
+        """
+        Strong validator of the bytes `encode` gives for these arguments, the picture's tag with the encoding appended.
+        A frame encodes to the same bytes every time, so a device can resume a download with it (If-Range)
+        """
+        encoding = hashlib.blake2b(repr((fmt, sorted(params.items()))).encode(), digest_size=4).hexdigest()
+        return f'{self.etag[2:-1]}-{encoding}"'
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    def encode(self, fmt="pgm", **params):
+        key = (fmt, tuple(sorted(params.items())))
+        # Encoded under the lock, so a fleet asking for the same frame at once doesn't encode it once per device
+        with self._lock:
+            encoded = self._crops if params.get("crop") else self._encoded
+            data = encoded.get(key)
+            if data is None:
+                data = encoded[key] = self._stored_encode(fmt, params)
+            if encoded is self._crops:
+                self._crops.move_to_end(key)
+                while len(self._crops) > self.MAX_CROPS:
+                    self._crops.popitem(last=False)
+        return data
+
+    def _stored_encode(self, fmt, params):
+        # A PGM is no more than a header on the pixels, not worth the disk space. Crops would only push whole renders
+        # out of it
+        if self._store is None or self.key is None or fmt == "pgm" or params.get("crop"):
+            return ENCODERS[fmt](self.pixels, **params)
+        store_key = self._store.key(self.key, fmt, sorted(params.items()))
+        data = self._store.get(store_key, kind=fmt)
+        if data is None:
+            data = ENCODERS[fmt](self.pixels, **params)
+            self._store.put(store_key, data)
+        return data
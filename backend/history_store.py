@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import pickle
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """
+    Append-only journal of displayed images.
+    Each record is an op byte (add/remove) followed by a 64-bit hash of the image file name, so appending is O(1),
+    a crash can at most tear the last record, and the in-memory set holds small ints instead of path strings.
+    """
+    _RECORD = struct.Struct("<cQ")
+    _ADD = b"+"
+    _REMOVE = b"-"
+
+    def __init__(self, path, legacy_pickle=None, compact_ratio=2, compact_min_records=1024):
+        self._path = path
+        self._compact_ratio = compact_ratio
+        self._compact_min_records = compact_min_records
+        self._lock = threading.Lock()
+        self._ids = set()
+        self._records = 0
+        self._compacting = None
+
+        self._load()
+        self._fh = open(self._path, "ab")
+        if legacy_pickle and os.path.exists(legacy_pickle):
+            self._migrate(legacy_pickle)
+
+    @staticmethod
+    def key(image):
+        # Only the file name, so the repository can be moved around without losing the history
+        digest = hashlib.blake2b(os.path.basename(image).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def __contains__(self, image):
+        return self.key(image) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, image):
+        return self._append(self._ADD, self.key(image))
+
+    def discard(self, image):
+        return self._append(self._REMOVE, self.key(image))
+
+    def close(self):
+        if self._compacting:
+            self._compacting.join()
+        with self._lock:
+            self._fh.close()
+
+    def compact(self):
+        """
+        Rewrite the journal with only the live entries.
+        Records appended while the snapshot is being written are carried over before the swap.
+        """
+        with self._lock:
+            self._fh.flush()
+            snapshot = list(self._ids)
+            offset = self._fh.tell()
+
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(b"".join(self._RECORD.pack(self._ADD, key) for key in snapshot))
+
+            with self._lock:
+                self._fh.flush()
+                with open(self._path, "rb") as journal:
+                    journal.seek(offset)
+                    tail = journal.read()
+                fh.write(tail)
+                fh.flush()
+                os.fsync(fh.fileno())
+                self._fh.close()
+                os.replace(tmp_path, self._path)
+                self._fh = open(self._path, "ab")
+                self._records = len(snapshot) + len(tail) // self._RECORD.size
+
+        logger.info(f"Compacted history to {self._records} records")
+
+    def _append(self, op, key):
+        with self._lock:
+            if (key in self._ids) == (op == self._ADD):
+                return False
+            self._fh.write(self._RECORD.pack(op, key))
+            self._fh.flush()
+            if op == self._ADD:
+                self._ids.add(key)
+            else:
+                self._ids.discard(key)
+            self._records += 1
+            needs_compaction = (self._records > self._compact_min_records
+                                and self._records > self._compact_ratio * len(self._ids))
+        if needs_compaction and not (self._compacting and self._compacting.is_alive()):
+            self._compacting = threading.Thread(target=self.compact, daemon=True)
+            self._compacting.start()
+        return True
+
+    def _load(self):
+        try:
+            with open(self._path, "rb") as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            return
+
+        torn = len(data) % self._RECORD.size
+        if torn:
+            # Crashed in the middle of an append, only the last record is lost
+            logger.warning(f"Dropping {torn} trailing bytes of a torn record in {self._path}")
+            data = data[:-torn]
+            with open(self._path, "r+b") as fh:
+                fh.truncate(len(data))
+
+        for op, key in self._RECORD.iter_unpack(data):
+            if op == self._ADD:
+                self._ids.add(key)
+            else:
+                self._ids.discard(key)
+        self._records = len(data) // self._RECORD.size
+
+    def _migrate(self, legacy_pickle):
+        with open(legacy_pickle, "rb") as fh:
+            legacy = pickle.load(fh)
+        with self._lock:
+            keys = set(self.key(image) for image in legacy) - self._ids
+            self._fh.write(b"".join(self._RECORD.pack(self._ADD, key) for key in keys))
+            self._fh.flush()
+            self._ids |= keys
+            self._records += len(keys)
+        os.replace(legacy_pickle, f"{legacy_pickle}.migrated")
+        logger.info(f"Migrated {len(legacy)} entries from {legacy_pickle}")
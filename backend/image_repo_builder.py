@@ -1,14 +1,26 @@
 import instaloader
 import concurrent.futures
+import functools
 import os
 import threading
 import logging
 
+from downloader import DownloadPool, Quota
+from metrics import REGISTRY
+from source_cursors import SourceCursors
+from url_fetcher import UrlFetcher
+
 logger = logging.getLogger(__name__)
 
+PULL_SECONDS = REGISTRY.histogram("epd_source_pull_seconds", "Time taken by pulls from each source", labels=("source",))
+PULLS = REGISTRY.counter("epd_source_pulls_total", "Pulls from each source, by outcome", labels=("source", "result"))
+ADDED = REGISTRY.counter("epd_repo_images_added_total", "Images added to the repository by the sources")
+REPOSTS = REGISTRY.counter("epd_repo_reposts_skipped_total", "Downloads dropped as reposts of an image already there")
+
 
 class ImageRepoBuilder:
-    def __init__(self, dest_dir, instagram=None, twitter=None, mms=None, urls=None):
+    def __init__(self, dest_dir, instagram=None, twitter=None, mms=None, urls=None, inventory=None, workers=4,
+                 rate=None, backfill=0, dedup=None):
         if isinstance(instagram, str):
             instagram = [instagram]
         if isinstance(twitter, str):
@@ -26,44 +38,231 @@ class ImageRepoBuilder:
             os.makedirs(dest_dir, exist_ok=True)
 
         self._dest_dir = dest_dir
+        # Files are registered as they are written, so the server never has to rescan the repository
+        self._inventory = inventory
+        # All sources download through the same bounded pool, `rate` is the requests/sec allowed per source
+        self._downloads = DownloadPool(workers=workers, rate=rate)
+        self._url_fetcher = UrlFetcher(concurrency=workers)
+        # Where each source was synced up to, so a pull only pages through posts it hasn't seen
+        self._cursors = SourceCursors(os.path.join(dest_dir, "sources.json"))
+        # Older posts walked per pull and source, once the new ones are in. 0 only ever follows new posts
+        self._backfill = backfill
+        # Perceptual hashes of the repository, new downloads that repost an image already there are dropped
+        self._dedup = dedup
 
     def update_repo(self):
-        self.download_from_instagram()
-        self.download_from_twitter()
-        self.download_from_urls()
+        for pull in self.sources().values():
+            pull()
+
+    def sources(self):
+        # Pull functions of the configured sources, each raises if the source couldn't be reached at all
+        sources = dict()
+        if self._instagram:
+            sources["instagram"] = functools.partial(self._pull, "instagram", self.download_from_instagram)
+        if self._twitter:
+            sources["twitter"] = functools.partial(self._pull, "twitter", self.download_from_twitter)
+        if self._urls:
+            sources["urls"] = functools.partial(self._pull, "urls", self.download_from_urls)
+        return sources
+
+    def _pull(self, source, pull):
+        try:
+            with PULL_SECONDS.time(source=source):
+                pull()
+        except Exception:
+            PULLS.inc(source=source, result="failed")
+            raise
+        PULLS.inc(source=source, result="ok")
 
     def download_from_instagram(self, n=10):
-        insta_loader = instaloader.Instaloader()
-        count = 0
+        if not self._instagram:
+            return
+        # Shared by the profiles, claimed before each download and given back if it fails
+        quota = Quota(n)
+        downloads = list()
         lock = threading.Lock()
 
+        def _fetch(source, post, submitted=None):
+            # False once the quota is used up. Downloads started are added to `submitted`, with the post's date
+            if post.typename != 'GraphImage':
+                return True
+            file_name = os.path.join(self._dest_dir, f"instagram_{post.owner_username}_{post.date_utc}")
+            if os.path.exists(f"{file_name}.jpg") or self._is_duplicate(f"{file_name}.jpg"):
+                return True
+            if not quota.claim():
+                return False
+            done = functools.partial(self._downloaded, url=post.url, quota=quota)
+            future = self._downloads.submit(source, post.url, f"{file_name}.jpg", post.date_utc, on_done=done)
+            with lock:
+                downloads.append(future)
+            if submitted is not None:
+                submitted.append((post.date_utc, future))
+            return True
+
         def _download_from_instagram_profile(username):
-            nonlocal count
-            profile = instaloader.Profile.from_username(insta_loader.context, username)
-            posts = profile.get_posts()
+            source = f"instagram:{username}"
+            cursor = self._cursors.get(source)
+            newest = SourceCursors.date(cursor.get("newest"))
 
+            # Newest first, down to the newest post an earlier pull has seen
+            posts = self._instagram_posts(username)
+            # Dates of the new posts dealt with, and the downloads started for them
+            listed = list()
+            submitted = list()
+            top = last = None
             for post in posts:
-                if post.typename == 'GraphImage':
-                    file_name = os.path.join(self._dest_dir, f"instagram_{post.owner_username}_{post.date_utc}")
-                    if os.path.exists(f"{file_name}.jpg"):
-                        continue
-                    with lock:
-                        if count < n:
-                            insta_loader.download_pic(file_name, post.url, post.date_utc)
-                            count += 1
-                        else:
-                            break
+                if getattr(post, "is_pinned", False):
+                    # Pinned posts come first whatever their age, they say nothing about where new posts end
+                    if not _fetch(source, post):
+                        return
+                    continue
+                if top is None:
+                    top = post.date_utc
+                if newest and post.date_utc <= newest:
+                    break
+                if not _fetch(source, post, submitted):
+                    if newest is None:
+                        # First pull, whatever is left is history for the backfill to walk through
+                        self._cursors.update(source, newest=self._settled(top, listed, submitted),
+                                             backfill=self._freeze(posts, last))
+                    # Otherwise the cursor stays put, so the posts we didn't get to are picked up next time
+                    return
+                listed.append(post.date_utc)
+                last = post.date_utc
+            else:
+                if newest is None:
+                    self._cursors.update(source, newest=self._settled(top, listed, submitted), backfilled=True)
+                    return
+            if top is not None and (newest is None or top > newest):
+                settled = self._settled(top, listed, submitted)
+                if settled is not None and (newest is None or settled > newest):
+                    self._cursors.update(source, newest=settled)
+
+            if self._backfill and not cursor.get("backfilled"):
+                self._backfill_instagram(username, source, self._cursors.get(source), _fetch)
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(self._instagram)) as executor:
             logger.info("Pulling from Instagram...")
-            for user in self._instagram:
-                executor.submit(_download_from_instagram_profile, user)
+            listings = [executor.submit(_download_from_instagram_profile, user) for user in self._instagram]
+        failed = 0
+        for user, listing in zip(self._instagram, listings):
+            if listing.exception():
+                logger.error(f"Failed to list posts of {user}: {listing.exception()}")
+                failed += 1
+        concurrent.futures.wait(downloads)
+        self._downloads.log_stats()
+        if failed == len(self._instagram):
+            # Most likely Instagram turning us away, rather than every profile going at once
+            raise listings[0].exception()
+
+    @staticmethod
+    def _settled(top, listed, submitted):
+        """
+        How far a source's cursor can move once its downloads are over: up to `top`, the newest post listed, unless a
+        download failed. Then only up to the newest post older than every failure, so that the failed ones are listed,
+        and tried, again next time. Posts newer than that which did make it are already there, and get skipped.
+        """
+        concurrent.futures.wait([future for _, future in submitted])
+        failed = [date for date, future in submitted if future.exception() is not None]
+        if not failed:
+            return top
+        return max((date for date in listed if date < min(failed)), default=None)
+
+    def _backfill_instagram(self, username, source, cursor, fetch):
+        """
+        Walk on through older posts from where the last walk left off, at most self._backfill of them per pull
+        """
+        backfill = cursor.get("backfill") or dict()
+        oldest = SourceCursors.date(backfill.get("oldest"))
+        posts = self._instagram_posts(username, resume=backfill.get("frozen"))
+        walked = 0
+        for post in posts:
+            # A resumed walk repeats the last post, one that couldn't be resumed starts over from the newest
+            if oldest and post.date_utc >= oldest:
+                continue
+            if walked >= self._backfill or not fetch(source, post):
+                self._cursors.update(source, backfill=self._freeze(posts, oldest))
+                return
+            walked += 1
+            oldest = post.date_utc
+        logger.info(f"Backfilled all of {source}")
+        self._cursors.update(source, backfill=None, backfilled=True)
+
+    @staticmethod
+    def _freeze(posts, oldest):
+        # Where to pick up again: the paused iterator, and the date of the oldest post dealt with so far
+        return {"frozen": posts.freeze()._asdict(), "oldest": oldest.isoformat() if oldest else None}
+
+    def _instagram_posts(self, username, resume=None):
+        # An Instaloader context per profile, they're not meant to be shared between threads
+        insta_loader = instaloader.Instaloader(quiet=True)
+        posts = instaloader.Profile.from_username(insta_loader.context, username).get_posts()
+        if resume:
+            try:
+                posts.thaw(instaloader.FrozenNodeIterator(**resume))
+            except instaloader.InvalidArgumentException as e:
+                # Paused too long ago, or the query changed
+                logger.warning(f"Can't resume the walk through {username}'s posts: {e}")
+        return posts
+
+    def _downloaded(self, path, error, url, quota):
+        if error:
+            logger.error(f"Failed to download {url}: {error}")
+            quota.release()
+            return
+        self._register(path)
+
+    def close(self):
+        self._downloads.close()
+
+    def _is_duplicate(self, path):
+        return self._dedup is not None and self._dedup.is_duplicate(path)
+
+    def _register(self, path):
+        if not os.path.exists(path):
+            return
+        if self._dedup is not None:
+            try:
+                original = self._dedup.add(path)
+            except OSError as e:
+                logger.warning(f"Can't hash {path}: {e}")
+                original = None
+            if original:
+                # Dropped before it's registered, so it's never rendered
+                logger.info(f"Skipping {os.path.basename(path)}, a repost of {original}")
+                os.remove(path)
+                REPOSTS.inc()
+                return
+        ADDED.inc()
+        if self._inventory is not None:
+            self._inventory.register(path)
 
     def download_from_twitter(self, n=10):
         pass
 
     def download_from_urls(self):
-        pass
+        if not self._urls:
+            return
+        polls = list()
+        for url in self._urls:
+            cursor = self._cursors.get(f"url:{url}")
+            path = os.path.join(self._dest_dir, cursor.get("name") or "")
+            if cursor.get("name") and not os.path.exists(path) and not self._is_duplicate(path):
+                # Gone from the repository since, get it again whether it changed or not
+                cursor = dict()
+            polls.append((url, cursor))
+        logger.info(f"Polling {len(polls)} URLs...")
+        results = self._url_fetcher.fetch(polls, self._dest_dir, on_done=self._register)
+        errors = list()
+        for url, result in results.items():
+            if isinstance(result, Exception):
+                logger.error(f"Failed to download {url}: {result!r}")
+                errors.append(result)
+            elif result:
+                self._cursors.update(f"url:{url}", **result)
+        self._url_fetcher.log_stats()
+        if len(errors) == len(results):
+            raise errors[0]
 
     def download_from_mms(self):
         pass
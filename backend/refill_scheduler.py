@@ -0,0 +1,146 @@
+import collections
+import logging
+import math
+import threading
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REFILLS = REGISTRY.counter("epd_refills_total", "Times the repository ran low and the sources were pulled")
+SOURCE_BACKOFF = REGISTRY.gauge("epd_source_backoff_seconds", "How long each failing source is left alone for",
+                                labels=("source",))
+
+
+class RefillScheduler:
+    """
+    Keeps the repository topped up from a thread of its own, so serving a frame never waits on a pull.
+
+    `level()` is how many unseen images the neediest device has left. Once it drops under the low watermark the sources
+    are pulled, round after round, until it's back over the high watermark or the sources have nothing more. The low
+    watermark is at least what the devices are forecast to go through in `lead` seconds (about how long a slow pull
+    takes), from the rate each has been taking frames at lately, up to `max_forecast`; the high one stays the same
+    distance above it. The rate runs up to now, so it dies down once devices stop taking frames, and a refill is at most
+    `max_rounds` rounds through the sources, however far it is from the high watermark.
+
+    A source whose pull raises is left alone for `backoff` seconds, doubling with each failure in a row up to
+    `max_backoff`, while the others are pulled as usual.
+    """
+    def __init__(self, level, sources, on_pulled=None, low=10, high=30, lead=600, interval=300, backoff=60,
+                 max_backoff=3600, window=8, max_forecast=100, max_rounds=5):
+        """
+        :param sources: dict of source name -> function pulling from it
+        :param on_pulled: called after each round with whether the level went up
+        :param interval: seconds between checks when nothing asks for one
+        :param window: takes per device the serve rate is measured over
+        :param max_forecast: most images the low watermark is raised to from the serve rate
+        :param max_rounds: most rounds through the sources per refill
+        """
+        self._level = level
+        self._sources = sources
+        self._on_pulled = on_pulled
+        self._low = low
+        self._high = high
+        self._lead = lead
+        self._interval = interval
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._window = window
+        self._max_forecast = max_forecast
+        self._max_rounds = max_rounds
+        self._lock = threading.Lock()
+        # device -> times of its latest takes
+        self._takes = dict()
+        self._failures = collections.Counter()
+        self._retry_at = dict()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="refill", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._wake.set()
+
+    def served(self, device, remaining):
+        """
+        Note a frame taken by `device`, which has `remaining` images left. Only ever sets an event, never waits
+        """
+        with self._lock:
+            takes = self._takes.get(device)
+            if takes is None:
+                takes = self._takes[device] = collections.deque(maxlen=self._window)
+            takes.append(time.monotonic())
+        if remaining < self.watermarks()[0]:
+            self._wake.set()
+
+    def rate(self):
+        # Frames/sec taken by the fastest device lately, up to now: a burst of takes long past doesn't count for much
+        rate = 0.0
+        now = time.monotonic()
+        with self._lock:
+            for takes in self._takes.values():
+                if len(takes) > 1 and now > takes[0]:
+                    rate = max(rate, (len(takes) - 1) / (now - takes[0]))
+        return rate
+
+    def watermarks(self):
+        low = max(self._low, min(math.ceil(self.rate() * self._lead), self._max_forecast))
+        return low, low + self._high - self._low
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            if self._closed:
+                break
+            try:
+                self._refill()
+            except Exception:
+                logger.exception("Refill failed")
+
+    def _refill(self):
+        low, high = self.watermarks()
+        level = self._level()
+        if level >= low:
+            return
+        logger.info(f"{level} unseen images left, pulling up to {high}")
+        REFILLS.inc()
+        for _ in range(self._max_rounds):
+            if level >= high or self._closed:
+                break
+            pulled = self._pull()
+            new_level = self._level()
+            if self._on_pulled:
+                self._on_pulled(new_level > level)
+            if not pulled or new_level <= level:
+                # Sources are dry or backing off for now
+                break
+            level = new_level
+
+    def _pull(self):
+        # One round through the sources not backing off, False if they all are
+        pulled = False
+        for name, pull in self._sources.items():
+            if time.monotonic() < self._retry_at.get(name, 0):
+                continue
+            pulled = True
+            try:
+                pull()
+            except Exception as e:
+                self._failures[name] += 1
+                delay = min(self._backoff * 2 ** (self._failures[name] - 1), self._max_backoff)
+                self._retry_at[name] = time.monotonic() + delay
+                SOURCE_BACKOFF.set(delay, source=name)
+                logger.warning(f"Pulling from {name} failed ({e}), retrying in {delay:.0f} s")
+            else:
+                self._failures[name] = 0
+                self._retry_at.pop(name, None)
+                SOURCE_BACKOFF.set(0, source=name)
+        return pulled
@@ -0,0 +1,165 @@
+import concurrent.futures
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from renderer import FRAME_SIZE, PIPELINE_VERSION, render_image_timed
+from frame_format import Frame
+from disk_cache import DiskCache
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RENDER_SECONDS = REGISTRY.histogram("epd_render_seconds", "Time spent rendering frames, per step", labels=("stage",))
+RENDER_REQUESTS = REGISTRY.counter("epd_render_cache_requests_total", "Frames asked of the render cache, found or not",
+                                   labels=("result",))
+RENDER_FAILURES = REGISTRY.counter("epd_render_failures_total", "Source images that couldn't be rendered")
+
+
+class RenderCache:
+    """
+    Frames rendered from source images, shared by every device, so an image lined up for several devices is only
+    converted once. Renders run on `executor` (a process pool) when there is one, on the calling thread otherwise.
+    Concurrent requests for the same image wait on the same render. Finished frames are kept in memory, least
+    recently used first out once there are more than `max_frames`.
+    Behind that, renders and their encodings are kept on disk in `render_dir` (see DiskCache), up to `max_bytes`,
+    under a key made of the source's content, the render parameters and the pipeline version. Showing an image again,
+    on any device or after a restart, only costs reading it back, and a change of parameters can't serve stale frames.
+    """
+    def __init__(self, render_dir, executor=None, max_frames=32, render_params=None, max_bytes=256 * 2 ** 20):
+        self._render_dir = render_dir
+        # Passed on to render_image, e.g. fit and panel
+        self._render_params = render_params or dict()
+        self._store = DiskCache(render_dir, max_bytes=max_bytes)
+        for entry in os.scandir(render_dir):
+            if entry.is_file() and entry.name.endswith(".pgm"):
+                # Renders cut short by a crash, or left by versions that didn't keep them
+                os.remove(entry.path)
+        self._executor = executor
+        # Disk lookups (and hashing sources) happen on these threads when renders run in the background
+        self._lookups = None
+        if executor:
+            self._lookups = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="render-lookup")
+        self._max_frames = max_frames
+        self._lock = threading.Lock()
+        # source path -> Future of its Frame, in or out of flight
+        self._frames = OrderedDict()
+        # source path -> (mtime_ns, size, content hash), for the sources in _frames
+        self._digests = dict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def store(self):
+        return self._store
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, source):
+        """
+        :return: a Future resolving to the Frame rendered from `source`
+        """
+        with self._lock:
+            future = self._frames.get(source)
+            if future is not None:
+                self._frames.move_to_end(source)
+                self.hits += 1
+                RENDER_REQUESTS.inc(result="hit")
+                return future
+            self.misses += 1
+            RENDER_REQUESTS.inc(result="miss")
+            future = concurrent.futures.Future()
+            self._frames[source] = future
+            self._evict()
+
+        if self._lookups:
+            self._lookups.submit(self._lookup, source, future)
+        else:
+            self._lookup(source, future)
+        return future
+
+    def discard(self, source):
+        with self._lock:
+            self._frames.pop(source, None)
+            self._digests.pop(source, None)
+
+    def close(self):
+        if self._lookups:
+            self._lookups.shutdown(wait=True)
+
+    def _key(self, source):
+        st = os.stat(source)
+        digest = self._digests.get(source)
+        if digest is None or digest[:2] != (st.st_mtime_ns, st.st_size):
+            content = hashlib.blake2b(digest_size=16)
+            with open(source, "rb") as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b""):
+                    content.update(chunk)
+            digest = (st.st_mtime_ns, st.st_size, content.hexdigest())
+            with self._lock:
+                # Unless it was discarded meanwhile
+                if source in self._frames:
+                    self._digests[source] = digest
+        params = dict(self._render_params)
+        params.setdefault("size", FRAME_SIZE)
+        return DiskCache.key(digest[2], PIPELINE_VERSION, sorted(params.items()))
+
+    def _lookup(self, source, future):
+        try:
+            key = self._key(source)
+            # Read in one go rather than opened by path, another render landing can evict it from under a lookup
+            data = self._store.get(key)
+            if data is not None:
+                frame = Frame.from_file(io.BytesIO(data), key=key, store=self._store)
+        except Exception as e:
+            self._fail(source, future, e)
+            return
+        if data is not None:
+            future.set_result(frame)
+            return
+
+        dest_path = os.path.join(self._render_dir, f"{key}.render.pgm")
+        if self._executor:
+            rendered = self._executor.submit(render_image_timed, source, dest_path, **self._render_params)
+            rendered.add_done_callback(lambda f: self._load(source, key, future, f))
+        else:
+            self._load(source, key, future, None)
+
+    def _load(self, source, key, future, rendered):
+        try:
+            if rendered:
+                path, timings = rendered.result()
+            else:
+                path, timings = render_image_timed(source, os.path.join(self._render_dir, f"{key}.render.pgm"),
+                                                   **self._render_params)
+            with RENDER_SECONDS.time(stage="load"):
+                frame = Frame.from_file(path, key=key, store=self._store)
+            # Kept for next time
+            self._store.adopt(key, path)
+        except Exception as e:
+            self._fail(source, future, e)
+            return
+        for stage, seconds in timings.items():
+            RENDER_SECONDS.observe(seconds, stage=stage)
+        future.set_result(frame)
+
+    def _fail(self, source, future, e):
+        # Don't keep the failure around, the next request for this image tries again
+        self.discard(source)
+        RENDER_FAILURES.inc()
+        future.set_exception(e)
+
+    def _evict(self):
+        # Only finished renders, in-flight ones are already promised to someone
+        while len(self._frames) > self._max_frames:
+            for source, future in self._frames.items():
+                if future.done():
+                    del self._frames[source]
+                    self._digests.pop(source, None)
+                    break
+            else:
+                return
@@ -0,0 +1,102 @@
+import functools
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+FRAME_SIZE = (1280, 960)
+FITS = ("fit", "fill", "stretch")
+# Part of the key renders are cached under, bump it whenever render_pixels changes its output
+PIPELINE_VERSION = 2
+
+# Tone curves per panel, starting points to be tuned by eye. Renders keep all 256 greys, reducing them to what the
+# panel's waveforms can show is left to the dithering in frame_format.quantize
+PANELS = {
+    "linear": {"gamma": 1.0, "contrast": 1.0},
+    "pl_10.7": {"gamma": 0.8, "contrast": 1.15},
+}
+
+
+@functools.lru_cache(maxsize=16)
+def tone_lut(gamma=1.0, contrast=1.0):
+    """
+    256 entry lookup table: gamma, then contrast around mid grey
+    """
+    x = np.arange(256, dtype=np.float64) / 255
+    y = (x ** gamma - 0.5) * contrast + 0.5
+    return np.rint(np.clip(y, 0, 1) * 255).astype(np.uint8)
+
+
+def _lap(timings, stage, start):
+    # Seconds since `start` added to `stage` in `timings`, if there's a dict to keep them in
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+
+def render_pixels(img, size=FRAME_SIZE, fit="fit", panel="linear", background=255, timings=None):
+    """
+    The render stage: an opened image to a frame of greys for `panel`, rotated to the panel's orientation.
+    "fit" scales the whole image into the frame, letterboxed with `background`; "fill" covers the frame, cropping the
+    overflow evenly; "stretch" ignores the aspect ratio.
+    :param timings: dict the seconds spent in each step are added to
+    :return: uint8 array of shape (height, width)
+    """
+    start = time.perf_counter()
+    width, height = size
+    # The panel is mounted in portrait, so the source is laid out on a (height, width) canvas and rotated afterwards
+    canvas = (height, width)
+
+    # Let the JPEG decoder downscale by up to 8 and skip the colour conversion, most of the cost at phone resolutions
+    img.draft("L", canvas)
+    img = img.convert("L")
+    start = _lap(timings, "decode", start)
+
+    if fit == "stretch":
+        scaled = canvas
+    elif fit in FITS:
+        pick = min if fit == "fit" else max
+        scale = pick(canvas[0] / img.width, canvas[1] / img.height)
+        scaled = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    else:
+        raise ValueError(f"Unknown fit {fit}")
+    img = img.resize(scaled, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    if scaled != canvas:
+        # Centered, letterboxed (fit) or cropped (fill)
+        frame = Image.new("L", canvas, background)
+        frame.paste(img, ((canvas[0] - scaled[0]) // 2, (canvas[1] - scaled[1]) // 2))
+        img = frame
+    start = _lap(timings, "resize", start)
+
+    pixels = np.asarray(img.transpose(Image.Transpose.ROTATE_90))
+    start = _lap(timings, "rotate", start)
+    pixels = np.take(tone_lut(**PANELS[panel]), pixels)
+    _lap(timings, "tone_curve", start)
+    return pixels
+
+
+def render_image(src_path, dest_path, size=FRAME_SIZE, fit="fit", panel="linear", timings=None):
+    """
+    Convert a source image to the greyscale PGM frame shown on the EPD.
+    Runs in worker processes, so it has to stay a plain module level function.
+    :return: dest_path, once the frame is completely written
+    """
+    with Image.open(src_path) as img:
+        pixels = render_pixels(img, size=size, fit=fit, panel=panel, timings=timings)
+
+    # Write next to the destination and rename, so nobody ever sees a half written frame
+    start = time.perf_counter()
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+    Image.fromarray(pixels, "L").save(tmp_path, format="PPM")
+    os.replace(tmp_path, dest_path)
+    _lap(timings, "save", start)
+    return dest_path
+
+
+def render_image_timed(src_path, dest_path, **params):
+    # For worker processes, whose metrics never reach the server: the step timings come back with the path
+    timings = dict()
+    return render_image(src_path, dest_path, timings=timings, **params), timings
@@ -0,0 +1,200 @@
+import bisect
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class RepoInventory:
+    """
+    Persistent manifest of the images in the repository, kept up to date incrementally.
+    Writers (ImageRepoBuilder) register files as they land. The directory is only walked by refresh(): on startup, to
+    catch files added or changed by hand (compared by mtime/size), and as a last resort when the sources come up
+    empty, skipped if the directory mtime hasn't moved since the last walk.
+
+    Every image gets a sequence number when it first shows up, in arrival order. Devices keep a cursor into that
+    sequence, so finding the next image a device hasn't seen never needs a `repo - history` over the whole repository.
+    Files found gone by a walk are handed to `on_removed`, as paths, once the walk is done.
+
+    The manifest is a text journal with one record per line:
+        +<TAB>mtime_ns<TAB>size<TAB>name<TAB>seq   file added or changed
+        -<TAB>name                                 file removed
+        @<TAB>mtime_ns                             directory scanned at this mtime
+    """
+    EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+    def __init__(self, repo_dir, manifest="inventory.log", on_removed=None):
+        self._repo_dir = repo_dir
+        self._on_removed = on_removed
+        self._manifest = os.path.join(repo_dir, manifest)
+        self._lock = threading.Lock()
+        # Held for a walk of the directory, one at a time
+        self._walking = threading.Lock()
+        # name -> (mtime_ns, size, seq)
+        self._entries = dict()
+        # Sequence numbers in ascending order and the matching names, removed names are skipped until the next load
+        self._seqs = list()
+        self._names = list()
+        self._next_seq = 0
+        self._dir_mtime = None
+        # Bumped on every change, so callers can tell whether anything happened since they last looked
+        self.version = 0
+
+        self._load()
+        self._fh = open(self._manifest, "a", encoding="utf8")
+        self.refresh()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return os.path.basename(path) in self._entries
+
+    def paths(self):
+        with self._lock:
+            return set(os.path.join(self._repo_dir, name) for name in self._entries)
+
+    def after(self, seq):
+        """
+        Images that showed up after `seq`, oldest first, as (seq, path)
+        """
+        # Copied out a batch at a time, callers mostly stop after the first few
+        while True:
+            with self._lock:
+                start = bisect.bisect_right(self._seqs, seq)
+                items = list(zip(self._seqs[start:start + 64], self._names[start:start + 64]))
+            if not items:
+                return
+            for item_seq, name in items:
+                entry = self._entries.get(name)
+                if entry and entry[2] == item_seq:
+                    yield item_seq, os.path.join(self._repo_dir, name)
+            seq = items[-1][0]
+
+    def count_after(self, seq):
+        # An upper bound, removed images are still counted until the next load
+        with self._lock:
+            return len(self._seqs) - bisect.bisect_right(self._seqs, seq)
+
+    def register(self, path):
+        # Record a file that was just written to the repository
+        name = os.path.basename(path)
+        if not self._wanted(name):
+            return
+        st = os.stat(os.path.join(self._repo_dir, name))
+        with self._lock:
+            self._add(name, st.st_mtime_ns, st.st_size)
+            self._fh.flush()
+
+    def refresh(self, force=False):
+        dir_mtime = os.stat(self._repo_dir).st_mtime_ns
+        if not force and dir_mtime == self._dir_mtime:
+            return
+
+        # Walked without holding the lock, so devices and downloads aren't held up by a large repository
+        with self._walking:
+            version = self.version
+            present = dict()
+            with os.scandir(self._repo_dir) as it:
+                for entry in it:
+                    if entry.is_file() and self._wanted(entry.name):
+                        st = entry.stat()
+                        present[entry.name] = (st.st_mtime_ns, st.st_size)
+
+            with self._lock:
+                if self.version != version:
+                    # Files were registered during the walk, which may have seen them before they were written, or not
+                    # at all: whatever it found different from the manifest is looked at again
+                    stale = [name for name in set(present) | set(self._entries)
+                             if self._entries.get(name, (None, None))[:2] != present.get(name)]
+                    for name in stale:
+                        present.pop(name, None)
+                    present.update(self._restat(stale))
+                for name, stat in present.items():
+                    if self._entries.get(name, (None, None))[:2] != stat:
+                        self._add(name, *stat)
+                removed = set(self._entries) - set(present)
+                for name in removed:
+                    self._remove(name)
+
+                self._dir_mtime = dir_mtime
+                self._write(f"@\t{dir_mtime}")
+                self._fh.flush()
+        logger.info(f"Rescanned {self._repo_dir}: {len(self._entries)} images")
+        if removed and self._on_removed:
+            self._on_removed([os.path.join(self._repo_dir, name) for name in sorted(removed)])
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+    def _restat(self, names):
+        # (name, (mtime_ns, size)) of those still there
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self._repo_dir, name))
+            except FileNotFoundError:
+                continue
+            yield name, (st.st_mtime_ns, st.st_size)
+
+    def _wanted(self, name):
+        return name.lower().endswith(RepoInventory.EXTENSIONS)
+
+    def _add(self, name, mtime, size):
+        # A file changed in place keeps its place in the sequence
+        if name in self._entries:
+            seq = self._entries[name][2]
+        else:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._seqs.append(seq)
+            self._names.append(name)
+        self._entries[name] = (mtime, size, seq)
+        self.version += 1
+        self._write(f"+\t{mtime}\t{size}\t{name}\t{seq}")
+
+    def _remove(self, name):
+        del self._entries[name]
+        self.version += 1
+        self._write(f"-\t{name}")
+
+    def _write(self, record):
+        self._fh.write(record)
+        self._fh.write("\n")
+
+    def _load(self):
+        records = 0
+        try:
+            with open(self._manifest, "r", encoding="utf8") as fh:
+                for line in fh:
+                    if not line.endswith("\n"):
+                        # Torn last record, force a rescan to pick the file up again
+                        self._dir_mtime = None
+                        break
+                    fields = line[:-1].split("\t")
+                    if fields[0] == "+":
+                        name, seq = fields[3], int(fields[4])
+                        self._entries[name] = (int(fields[1]), int(fields[2]), seq)
+                        self._next_seq = max(self._next_seq, seq + 1)
+                    elif fields[0] == "-":
+                        self._entries.pop(fields[1], None)
+                    elif fields[0] == "@":
+                        self._dir_mtime = int(fields[1])
+                    records += 1
+        except FileNotFoundError:
+            return
+
+        for name, (_, _, seq) in sorted(self._entries.items(), key=lambda item: item[1][2]):
+            self._seqs.append(seq)
+            self._names.append(name)
+
+        # Rewrite the manifest once it's mostly superseded records
+        if records > 2 * len(self._entries) + 1:
+            tmp_path = f"{self._manifest}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as fh:
+                for name, (mtime, size, seq) in sorted(self._entries.items(), key=lambda item: item[1][2]):
+                    fh.write(f"+\t{mtime}\t{size}\t{name}\t{seq}\n")
+                if self._dir_mtime is not None:
+                    fh.write(f"@\t{self._dir_mtime}\n")
+            os.replace(tmp_path, self._manifest)
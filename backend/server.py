@@ -1,90 +1,527 @@
 from image_repo_builder import ImageRepoBuilder
+from history_store import HistoryStore
+from repo_inventory import RepoInventory
+from render_cache import RenderCache
+from device_cursor import DeviceCursor
+from dedup_index import DedupIndex
+from refill_scheduler import RefillScheduler
+from frame_format import CONTENT_TYPES, DITHERS, ENCODINGS, WAVEFORMS, check_crop, encode_delta
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import contextlib
 import os
-import pickle
-import glob
 import logging
-from collections import deque
+import multiprocessing
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+import http
 import http.server
-from PIL import Image
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+FETCH_SECONDS = REGISTRY.histogram("epd_fetch_seconds", "Time to answer a device's frame request, per device",
+                                   labels=("device",))
+REQUESTS = REGISTRY.counter("epd_requests_total", "Frame requests, by method, format and status",
+                            labels=("method", "format", "status"))
+SERVED_BYTES = REGISTRY.counter("epd_served_bytes_total", "Frame bytes sent to devices, per format", labels=("format",))
+
 
 class ImageServer:
-    def __init__(self, repo_dir="image_repo", image_sources=None):
+    """
+    Serves a stream of frames to any number of devices. Each device (see DeviceCursor) walks the repository on its own
+    cursor with its own history, while the frames themselves come from one RenderCache, so devices going through the
+    same images only pay for each render once.
+    The "default" device keeps the repository level history, which is what a single frame setup has always used.
+
+    Only the ids in `devices` are served when it's given. Otherwise any id is taken on, until `max_devices` are known
+    (have state in `<repo_dir>/devices`), and the rest are turned away. Devices idle for `idle_timeout` seconds are
+    let go of, their cursor and history are loaded again from disk when they're back.
+    """
+    def __init__(self, repo_dir="image_repo", image_sources=None, prefetch=1, min_queue=10, max_queue=30,
+                 refill_lead=600, render=None, dedup_distance=24, render_cache_bytes=256 * 2 ** 20, devices=None,
+                 max_devices=100, idle_timeout=3600):
         self._repo_dir = repo_dir
-        # This keeps record of all the files that have been displayed
-        self._history = os.path.join(repo_dir, "history.pkl")
+        # This keeps record of all the files that have been displayed on the default device
+        self._history = HistoryStore(os.path.join(repo_dir, "history.log"),
+                                     legacy_pickle=os.path.join(repo_dir, "history.pkl"))
+        self._state_dir = os.path.join(repo_dir, "devices")
+        os.makedirs(self._state_dir, exist_ok=True)
         if not image_sources:
             image_sources = dict()
-        self._repo_builder = ImageRepoBuilder(dest_dir=self._repo_dir, **image_sources)
-        self._image_queue = set()
-        self._update_queue()
-        self._next_image = self.update_next_image()
+        self._devices = dict()
+        self._devices_lock = threading.Lock()
+        self._max_devices = max_devices
+        self._idle_timeout = idle_timeout
+        self._next_sweep = time.monotonic() + idle_timeout
+        if devices is not None:
+            self._allowed = set(DeviceCursor.safe_id(device) for device in devices) | {"default"}
+            self._known = set(self._allowed)
+        else:
+            self._allowed = None
+            # Every device that has been served before, from the files it left
+            self._known = {"default"}
+            for name in os.listdir(self._state_dir):
+                for suffix in (".json", ".history.log"):
+                    if name.endswith(suffix):
+                        self._known.add(name[:-len(suffix)])
+        self._inventory = RepoInventory(repo_dir, on_removed=self._removed)
+        # Downloads within `dedup_distance` bits of an image already in the repository are reposts, None keeps them all
+        self._dedup = None
+        if dedup_distance is not None:
+            self._dedup = DedupIndex(os.path.join(repo_dir, "dedup.log"), max_distance=dedup_distance)
+            # Hash what's already there in the background, the first request shouldn't wait on a full repository
+            threading.Thread(target=self._dedup.add_missing, args=(sorted(self._inventory.paths()),),
+                             name="dedup", daemon=True).start()
+        self._repo_builder = ImageRepoBuilder(dest_dir=self._repo_dir, inventory=self._inventory, dedup=self._dedup,
+                                              **image_sources)
 
-    def _get_history(self):
-        try:
-            with open(self._history, "rb") as fh:
-                history = pickle.load(fh)
-        except FileNotFoundError as e:
-            history = set()
-        return history
-
-    def _update_history(self, history):
-        with open(self._history, "wb") as fh:
-            pickle.dump(history, fh)
-
-    def _update_queue(self, min_len=10, pull_from_sources=True):
-        if len(self._image_queue) >= min_len:
-            return
+        # Number of upcoming frames kept rendered in the background for each device. With none, the next frame is
+        # rendered on the request thread once the response is out (see line_up)
+        self._prefetch = prefetch
+        self._executor = None
+        if prefetch:
+            # Not forked: by the time a render is submitted there are other threads, and open connections a forked
+            # worker would hold on to, so a device hanging up wouldn't close them
+            self._executor = ProcessPoolExecutor(max_workers=min(prefetch, os.cpu_count() or 1),
+                                                 mp_context=multiprocessing.get_context("forkserver"))
+        # Renders and their encodings are also kept on disk, within `render_cache_bytes`
+        self._renders = RenderCache(os.path.join(repo_dir, "renders"), executor=self._executor, render_params=render,
+                                    max_bytes=render_cache_bytes)
 
-        history = self._get_history()
-        repo = set(glob.glob(os.path.join(self._repo_dir, "*.jpg"))
-                   + glob.glob(os.path.join(self._repo_dir, "*.jpeg")))
+        # Pulls happen in the background: once the neediest device is down to `min_queue` unseen images (or what the
+        # devices get through in `refill_lead` seconds, if more), up to `max_queue`
+        self._refills = RefillScheduler(self._level, self._repo_builder.sources(), on_pulled=self._pulled,
+                                        low=min_queue, high=max_queue, lead=refill_lead)
+        self._cursor("default")
+        self._pulled(True)
+        self._refills.start()
 
-        self._image_queue |= (repo - history)
+        REGISTRY.gauge("epd_repo_images", "Images in the repository", collect=lambda: len(self._inventory))
+        REGISTRY.gauge("epd_render_cache_frames", "Frames held by the render cache", collect=lambda: len(self._renders))
+        REGISTRY.gauge("epd_disk_cache_bytes", "Bytes used by the on-disk render cache",
+                       collect=lambda: self._renders.store.bytes)
+        REGISTRY.gauge("epd_device_queue_depth", "Unseen images each device has left, lined up or not",
+                       labels=("device",), collect=self._queue_depths)
+        REGISTRY.gauge("epd_device_history_size", "Images each device has been shown", labels=("device",),
+                       collect=self._history_sizes)
 
-        # If we're still short on images, pull from internet
-        if pull_from_sources and len(self._image_queue) < min_len:
-            logger.info(f"Pulling more images...")
-            self._repo_builder.update_repo()
-            self._update_queue(min_len=min_len, pull_from_sources=False)
+    @property
+    def renders(self):
+        return self._renders
 
-    def update_next_image(self):
-        # Get the next image from the queue
-        if len(self._image_queue) == 0:
-            logger.error(f"No new images to serve, add more images!")
-            return
+    def admits(self, device):
+        # Whether `device` is served, taking it on if there's room for another one
+        with self._devices_lock:
+            return self._admit(DeviceCursor.safe_id(device))
+
+    def _admit(self, device):
+        if device in self._known:
+            return True
+        # "default" is always known, and isn't counted
+        if self._allowed is not None or len(self._known) > self._max_devices:
+            return False
+        self._known.add(device)
+        return True
+
+    def _cursor(self, device):
+        device = DeviceCursor.safe_id(device)
+        now = time.monotonic()
+        with self._devices_lock:
+            if now >= self._next_sweep:
+                self._evict_idle(now)
+            cursor = self._devices.get(device)
+            if cursor is None:
+                if not self._admit(device):
+                    raise KeyError(f"Unknown device {device}")
+                history = self._history if device == "default" else None
+                cursor = DeviceCursor(device, self._state_dir, history=history)
+                self._devices[device] = cursor
+            cursor.used = now
+        return cursor
 
-        next_image = self._image_queue.pop()
-        self._next_image = next_image
-        logger.info(f"\nNext image is: {next_image}\n")
+    def _evict_idle(self, now):
+        # Called with _devices_lock held, so nothing picks a cursor up while it's being closed
+        self._next_sweep = now + min(self._idle_timeout, 60)
+        for device, cursor in list(self._devices.items()):
+            if device != "default" and now - cursor.used > self._idle_timeout:
+                logger.info(f"Letting go of {device}, idle for {now - cursor.used:.0f} s")
+                del self._devices[device]
+                cursor.close()
 
-        # Convert image to PGM
-        img = Image.open(next_image).convert('L')
+    def _level(self):
+        # Unseen images left to the device that has the fewest
+        with self._devices_lock:
+            cursors = list(self._devices.values())
+        levels = list()
+        for cursor in cursors:
+            with cursor.lock:
+                levels.append(cursor.remaining(self._inventory))
+        return min(levels, default=0)
 
-        # TODO: Resize keeping aspect ratio
-        img = img.rotate(90, expand=1).resize((1280, 960), Image.Resampling.LANCZOS)
-        img.save(os.path.join(self._repo_dir, "the_image.pgm"))
+    def _queue_depths(self):
+        with self._devices_lock:
+            cursors = list(self._devices.values())
+        depths = dict()
+        for cursor in cursors:
+            with cursor.lock:
+                depths[cursor.device] = cursor.remaining(self._inventory)
+        return depths
 
-        history = self._get_history()
-        history.add(self._next_image)
-        self._update_history(history)
+    def _history_sizes(self):
+        with self._devices_lock:
+            return {device: len(cursor.history) for device, cursor in self._devices.items()}
 
-        self._update_queue(min_len=10)
-        return next_image
+    def _removed(self, images):
+        # Nobody can be shown an image that's gone, forgetting it keeps the histories from growing with the repository's
+        # turnover (their journals get compacted once they're mostly removals)
+        with self._devices_lock:
+            # Held throughout, an idle cursor can't be closed under us
+            histories = set(cursor.history for cursor in self._devices.values())
+            histories.add(self._history)
+            for history in histories:
+                for image in images:
+                    history.discard(image)
+
+    def _pulled(self, new):
+        if not new:
+            # Sources are dry, pick up anything dropped into the repository by hand
+            self._inventory.refresh()
+        # Start rendering what just came in
+        with self._devices_lock:
+            cursors = list(self._devices.values())
+        for cursor in cursors:
+            with cursor.lock:
+                cursor.fill(self._inventory, self._renders, self._prefetch + 1)
+
+    def current_frame(self, device="default"):
+        # What the device would get next, without taking it
+        cursor = self._cursor(device)
+        with cursor.lock:
+            cursor.fill(self._inventory, self._renders, self._prefetch + 1)
+            return cursor.current()
+
+    def shown_frame(self, device="default"):
+        return self._cursor(device).shown
+
+    def take_frame(self, device="default", etag=None):
+        """
+        Hand out the device's current frame and move its cursor on, atomically, so concurrent requests from the same
+        device each get their own frame. Other devices are not affected. Sending the frame is left to the caller, and
+        so is line_up() once it's sent.
+        If the device already has the current frame (`etag` matches), nothing changes.
+        :return: the frame, the frame the device was showing until now (None if unknown), and whether it's new
+        """
+        cursor = self._cursor(device)
+        with cursor.lock:
+            cursor.fill(self._inventory, self._renders, self._prefetch + 1)
+            frame = cursor.current()
+            shown = cursor.shown
+            if frame is not None and etag == frame.etag:
+                return frame, shown, False
+            cursor.take()
+            if self._executor:
+                cursor.fill(self._inventory, self._renders, self._prefetch + 1)
+            remaining = cursor.remaining(self._inventory)
+        self._refills.served(cursor.device, remaining)
+        return frame, shown, True
+
+    def line_up(self, device="default"):
+        # Start on the device's next frames after a take. Without prefetch that's a render on this thread, so this is
+        # for once the frame has been sent
+        cursor = self._cursor(device)
+        with cursor.lock:
+            cursor.fill(self._inventory, self._renders, self._prefetch + 1)
+
+    def close(self):
+        self._refills.close()
+        self._renders.close()
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        self._repo_builder.close()
+        with self._devices_lock:
+            for cursor in self._devices.values():
+                cursor.close()
+        self._history.close()
+        self._inventory.close()
+        if self._dedup is not None:
+            self._dedup.close()
 
 
 class ImageRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep-alive, so a device can fetch everything it needs in a wake (a HEAD, the frame, a few tiles) over one
+    # connection, pipelined or not. Every response has a Content-Length. Idle connections are dropped after `timeout`
+    # seconds, a device that went to sleep without closing its connection doesn't hold a thread for long
+    protocol_version = "HTTP/1.1"
+    timeout = 30
+    # The header and the body go out as separate writes, Nagle would hold the body back for the device's delayed ACK
+    # on every request after the first
+    disable_nagle_algorithm = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=IMAGE_REPO_DIR, **kwargs)
 
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # A device that hung up with part of an answer unread, e.g. a frame it only needed the top of
+            pass
+
+    # The same frame is offered as a plain PGM and as a binary EPD frame, picked by extension or Accept header
+    FRAME_PATHS = {
+        "the_image.pgm": "pgm",
+        "the_image.epdf": "epdf",
+        "the_image.delta": "delta",
+    }
+
     def do_GET(self) -> None:
-        super().do_GET()
-        if self.path.endswith("the_image.pgm"):
-            image_server.update_next_image()
+        if urllib.parse.urlsplit(self.path).path == "/metrics":
+            self._send_metrics()
+            return
+        fmt = self._frame_format()
+        if not fmt:
+            super().do_GET()
+            return
+        with self._observed(fmt):
+            self._get_frame(fmt)
+
+    def _get_frame(self, fmt):
+        try:
+            params = self._frame_params(fmt)
+        except ValueError as e:
+            self.send_error(http.HTTPStatus.BAD_REQUEST, str(e))
+            return
+        device = self._device
+        if device is None:
+            self.send_error(http.HTTPStatus.NOT_FOUND, "Unknown device")
+            return
+        if "Range" in self.headers and fmt != "delta":
+            # A device resuming a download that was cut short: the rest of the frame it was just given, if it's the
+            # one it names. The queue doesn't move
+            frame = image_server.shown_frame(device)
+            if frame is not None and frame.representation_etag(fmt, **params) == self._if_range():
+                self._send_frame(frame, None, fmt, params, byte_range=self.headers["Range"])
+                return
+        frame, shown, modified = image_server.take_frame(device=device, etag=self._if_none_match())
+        if not modified:
+            self._send_not_modified(frame, fmt, params)
+            return
+        if self._query().get("reset"):
+            # The device blanked its panel, there's nothing to build a delta on
+            shown = None
+        self._send_frame(frame, shown, fmt, params)
+        image_server.line_up(device)
 
+    def do_HEAD(self) -> None:
+        # Lets a device check for a new frame without taking it, the queue doesn't move
+        fmt = self._frame_format()
+        if not fmt:
+            super().do_HEAD()
+            return
+        with self._observed(fmt):
+            self._head_frame(fmt)
+
+    def _head_frame(self, fmt):
+        try:
+            params = self._frame_params(fmt)
+        except ValueError as e:
+            self.send_error(http.HTTPStatus.BAD_REQUEST, str(e))
+            return
+        device = self._device
+        if device is None:
+            self.send_error(http.HTTPStatus.NOT_FOUND, "Unknown device")
+            return
+        frame = image_server.current_frame(device)
+        if frame is not None and frame.etag == self._if_none_match():
+            self._send_not_modified(frame, fmt, params)
+            return
+        self._send_frame(frame, image_server.shown_frame(device), fmt, params, body=False)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    @contextlib.contextmanager
+    def _observed(self, fmt):
+        # Latency per device and outcome of a frame request, devices that aren't served are all counted as "unknown"
+        self._status = None
+        start = time.perf_counter()
+        device = self._device_id()
+        self._device = device if image_server.admits(device) else None
+        try:
+            yield
+        finally:
+            FETCH_SECONDS.observe(time.perf_counter() - start,
+                                  device=DeviceCursor.safe_id(self._device) if self._device else "unknown")
+            REQUESTS.inc(method=self.command, format=fmt, status=self._status)
+
+    def _send_metrics(self):
+        data = REGISTRY.expose().encode()
+        self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _if_none_match(self):
+        # Whether the device still shows the picture, whatever encoding it got it in: the picture's weak tag, from a
+        # frame's tag or from one of its representations'. We only ever hand out one tag per frame, the first is all
+        # we need to look at
+        tag = self._validator("If-None-Match")
+        if not tag:
+            return None
+        picture = (tag[2:] if tag.startswith("W/") else tag).strip('"').partition("-")[0]
+        return f'W/"{picture}"'
+
+    def _if_range(self):
+        # Only a strong tag says the bytes are the same (RFC 7233), a weak one gets the whole frame again
+        tag = self._validator("If-Range")
+        return None if not tag or tag.startswith("W/") else tag
+
+    def _validator(self, name):
+        value = self.headers.get(name)
+        return value.split(",")[0].strip() if value else None
+
+    def _etag(self, frame, fmt, params):
+        # Deltas depend on what the device shows, only whole frames and crops have representations of their own
+        return frame.etag if fmt == "delta" else frame.representation_etag(fmt, **params)
+
+    def _send_not_modified(self, frame, fmt, params):
+        self.send_response(http.HTTPStatus.NOT_MODIFIED)
+        self.send_header("ETag", self._etag(frame, fmt, params))
+        self.send_header("Vary", "Accept")
+        self.end_headers()
+
+    def _query(self):
+        return urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+    def _device_id(self):
+        # Each frame says who it is, so that it gets its own sequence of images: ?device=<id>, an X-Device-Id header
+        # or a path prefix, e.g. /kitchen/the_image.epdf. Older frames are all "default"
+        query = self._query()
+        if "device" in query:
+            return query["device"][0]
+        if "X-Device-Id" in self.headers:
+            return self.headers["X-Device-Id"]
+        return os.path.dirname(urllib.parse.urlsplit(self.path).path).strip("/") or "default"
+
+    def _frame_format(self):
+        name = os.path.basename(urllib.parse.urlsplit(self.path).path)
+        fmt = self.FRAME_PATHS.get(name)
+        if fmt == "pgm" and CONTENT_TYPES["epdf"] in self.headers.get("Accept", ""):
+            fmt = "epdf"
+        return fmt
+
+    def _frame_params(self, fmt):
+        # Encoding options from the query string, e.g. the_image.epdf?bpp=4&dither=diffusion&encoding=deflate
+        query = self._query()
+        params = dict()
+        if fmt == "pgm":
+            return params
+        if "bpp" in query:
+            params["bpp"] = int(query["bpp"][0])
+            if params["bpp"] not in (4, 8):
+                raise ValueError(f"Unsupported bpp {params['bpp']}")
+        if "dither" in query:
+            params["dither"] = query["dither"][0]
+            if params["dither"] not in DITHERS:
+                raise ValueError(f"Unknown dither {params['dither']}")
+        if "encoding" in query:
+            params["encoding"] = query["encoding"][0]
+            if params["encoding"] not in ENCODINGS:
+                raise ValueError(f"Unknown encoding {params['encoding']}")
+        if fmt == "epdf" and "width" in query:
+            # Just a window of the frame, e.g. &left=640&top=0&width=320&height=240 for a widget
+            try:
+                params["crop"] = tuple(int(query.get(name, ["0"])[0]) for name in ("left", "top", "width", "height"))
+            except ValueError:
+                raise ValueError("Crop left/top/width/height must be integers")
+            check_crop(params["crop"], params.get("bpp", 8))
+        if fmt == "delta" and "waveform" in query:
+            params["waveform"] = query["waveform"][0]
+            if params["waveform"] not in WAVEFORMS:
+                raise ValueError(f"Unknown waveform {params['waveform']}")
+        return params
+
+    @staticmethod
+    def _parse_range(value, size):
+        """
+        :return: first and last byte of a single "bytes=" range, None if it isn't one (the whole frame is sent then)
+        :raise ValueError: if it's past the end of the frame, or empty
+        """
+        unit, _, spec = value.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+        first, _, last = spec.strip().partition("-")
+        try:
+            first, last = int(first) if first else None, int(last) if last else None
+        except ValueError:
+            return None
+        if first is None:
+            if last is None:
+                return None
+            # The last n bytes, the last 0 can't be satisfied
+            if last <= 0:
+                raise ValueError(f"Range {value} is empty")
+            return max(0, size - last), size - 1
+        last = size - 1 if last is None else last
+        if first >= size or last < first:
+            raise ValueError(f"Range {value} is outside the {size} bytes of the frame")
+        return first, min(last, size - 1)
+
+    def _send_frame(self, frame, shown, fmt, params, body=True, byte_range=None):
+        if frame is None:
+            self.send_error(http.HTTPStatus.NOT_FOUND, "No image to serve")
+            return
+        if fmt == "delta":
+            # Depends on what this particular device shows, so it's not worth caching on the frame
+            data = encode_delta(frame.pixels, base=shown.pixels if shown else None, **params)
+        else:
+            try:
+                data = frame.encode(fmt, **params)
+            except ValueError as e:
+                # A crop that doesn't fit in the frame
+                self.send_error(http.HTTPStatus.BAD_REQUEST, str(e))
+                return
+        size = len(data)
+        try:
+            byte_range = byte_range and self._parse_range(byte_range, size)
+        except ValueError:
+            self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if byte_range:
+            first, last = byte_range
+            data = memoryview(data)[first:last + 1]
+            self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        else:
+            self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-Type", CONTENT_TYPES[fmt])
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", self._etag(frame, fmt, params))
+        self.send_header("Vary", "Accept")
+        if fmt != "delta":
+            # Deltas depend on what the device was showing, which has moved on by the time it asks for the rest
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+            SERVED_BYTES.inc(len(data), format=fmt)
+
+
+class FleetHTTPServer(http.server.ThreadingHTTPServer):
+    # A fleet of frames waking up on the same minute all connect at once, the default backlog of 5 would turn most of
+    # them away to retry a second later
+    request_queue_size = 256
+
+
+IMAGE_REPO_DIR = os.path.join(os.path.dirname(__file__), "image_repo")
+image_server = None
 
 if __name__ == "__main__":
     SOURCES = {
@@ -92,8 +529,14 @@ if __name__ == "__main__":
         "twitter": [],
         "urls": []
     }
-    IMAGE_REPO_DIR = os.path.join(os.path.dirname(__file__), "image_repo")
 
-    image_server = ImageServer(repo_dir=IMAGE_REPO_DIR, image_sources=SOURCES)
-    with http.server.HTTPServer(("", 8080), ImageRequestHandler) as httpd:
+    # Number of upcoming frames kept rendered in the background, for each device
+    PREFETCH = 2
+    # How source images are laid out on the frame (fit, fill or stretch) and the panel whose tone curve to apply
+    RENDER = {"fit": "fit", "panel": "pl_10.7"}
+
+    image_server = ImageServer(repo_dir=IMAGE_REPO_DIR, image_sources=SOURCES, prefetch=PREFETCH, render=RENDER)
+    # Each connection on its own thread: a device holding its connection open between requests, or reading its frame
+    # at WiFi speed, doesn't hold up the others
+    with FleetHTTPServer(("", 8080), ImageRequestHandler) as httpd:
         httpd.serve_forever()
@@ -0,0 +1,45 @@
+import datetime
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SourceCursors:
+    """
+    How far each source has been synced, saved as one JSON file beside the repository:
+        newest      date of the newest post seen, later pulls stop there
+        backfill    where the walk through older posts left off: the paused iterator and the date it had reached
+        backfilled  the walk reached the source's first post
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._cursors = dict()
+        try:
+            with open(path, "r", encoding="utf8") as fh:
+                self._cursors = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f"Ignoring broken source cursors in {path}: {e}")
+
+    def get(self, source):
+        with self._lock:
+            return dict(self._cursors.get(source, dict()))
+
+    def update(self, source, **fields):
+        with self._lock:
+            cursor = self._cursors.setdefault(source, dict())
+            for name, value in fields.items():
+                cursor[name] = value.isoformat() if isinstance(value, datetime.datetime) else value
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as fh:
+                json.dump(self._cursors, fh)
+            os.replace(tmp_path, self._path)
+
+    @staticmethod
+    def date(value):
+        return datetime.datetime.fromisoformat(value) if value else None
@@ -0,0 +1,21 @@
+import http.server
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def serve():
+    # Starts a stand-in server in the background, shut down after the test
+    servers = list()
+
+    def _serve(handler_cls, server_cls=http.server.ThreadingHTTPServer):
+        httpd = server_cls(("127.0.0.1", 0), handler_cls)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return httpd
+
+    yield _serve
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
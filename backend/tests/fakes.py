@@ -0,0 +1,255 @@
+"""
+Stand-ins for what the backend and the device talk to: a CDN serving Instagram posts, image URLs with cache
+validators, a connection that drops, and the EPD controller behind SPI
+"""
+import collections
+import datetime
+import email.utils
+import hashlib
+import http.server
+import io
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from image_repo_builder import ImageRepoBuilder
+
+from hardware.display_platforms.pl_epd.epson.epson_s1d13524 import S1D13524
+from utils.comm import RemoteFile
+
+
+def jpeg(size=(64, 64), seed=0):
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, size[::-1], dtype=np.uint8), "L").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+class PostHandler(http.server.BaseHTTPRequestHandler):
+    # Answers every post's image with `body`, after `latency` seconds, noting the connections it came in on
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    body = b""
+    connections = set()
+
+    def do_GET(self):
+        PostHandler.connections.add(self.client_address)
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+FrozenPosts = collections.namedtuple("FrozenPosts", "index")
+
+
+class Posts:
+    """
+    A profile's posts, newest first, that can be paused and resumed like instaloader's NodeIterator
+    """
+    def __init__(self, base_url, username, count, index=0):
+        self._base_url = base_url
+        self._username = username
+        self._count = count
+        self._index = index
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._index >= self._count:
+            raise StopIteration
+        self._index += 1
+        i = self._count - self._index
+        return SimpleNamespace(typename="GraphImage", owner_username=self._username,
+                               date_utc=datetime.datetime(2024, 1, 1) + datetime.timedelta(days=i),
+                               url=f"{self._base_url}/{self._username}/{i}.jpg")
+
+    def freeze(self):
+        # Like NodeIterator, resuming repeats the last post handed out
+        return FrozenPosts(max(self._index - 1, 0))
+
+
+class PostsBuilder(ImageRepoBuilder):
+    # Lists `posts` posts per profile, served from `base_url`, instead of asking Instagram
+    def __init__(self, base_url, posts, **kwargs):
+        super().__init__(**kwargs)
+        self._base_url = base_url
+        self._posts = posts
+
+    def _instagram_posts(self, username, resume=None):
+        index = resume["index"] if resume else 0
+        return Posts(self._base_url, username, self._posts, index=index)
+
+
+class UrlHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `images` by path. Paths under /etag/ answer with an ETag, under /lm/ with Last-Modified, and either gets a
+    304 when it's sent back unchanged. Tallies the statuses and body bytes sent, and the most requests in flight
+    """
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    images = dict()
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    statuses = dict()
+    body_bytes = 0
+
+    @classmethod
+    def reset(cls, images, latency=0.0):
+        cls.images = images
+        cls.latency = latency
+        cls.max_in_flight = 0
+
+    @classmethod
+    def poll(cls, builder):
+        # Statuses and body bytes of one pull of the URL source
+        cls.statuses = dict()
+        cls.body_bytes = 0
+        builder.download_from_urls()
+        return dict(cls.statuses), cls.body_bytes
+
+    def do_GET(self):
+        cls = UrlHandler
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            time.sleep(self.latency)
+            body = cls.images[self.path]
+            version = hashlib.md5(body).hexdigest()
+            etag = f'"{version}"'
+            last_modified = email.utils.formatdate(int(version[:6], 16), usegmt=True)
+            if self.path.startswith("/etag/") and self.headers.get("If-None-Match") == etag:
+                return self._respond(304)
+            if self.path.startswith("/lm/") and self.headers.get("If-Modified-Since") == last_modified:
+                return self._respond(304)
+            headers = {"Content-Type": "image/jpeg", "Content-Length": str(len(body))}
+            if self.path.startswith("/etag/"):
+                headers["ETag"] = etag
+            if self.path.startswith("/lm/"):
+                headers["Last-Modified"] = last_modified
+            self._respond(200, headers, body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def _respond(self, status, headers=None, body=b""):
+        with UrlHandler.lock:
+            UrlHandler.statuses[status] = UrlHandler.statuses.get(status, 0) + 1
+            UrlHandler.body_bytes += len(body)
+        self.send_response(status)
+        for name, value in (headers or {"Content-Length": "0"}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CuttingProxy:
+    """
+    Relays each connection to `upstream`, cutting the first ones after `offsets` bytes of what comes back, one offset
+    each, the way a WiFi drop looks to the device. Later connections go through untouched
+    """
+    def __init__(self, upstream, offsets):
+        self._upstream = upstream
+        self._offsets = list(offsets)
+        self._lock = threading.Lock()
+        self.cuts = 0
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                offset = self._offsets.pop(0) if self._offsets else None
+            threading.Thread(target=self._relay, args=(client, offset), daemon=True).start()
+
+    def _relay(self, client, offset):
+        with client, socket.create_connection(self._upstream) as upstream:
+            threading.Thread(target=self._forward, args=(client, upstream), daemon=True).start()
+            sent = 0
+            while True:
+                data = upstream.recv(65536)
+                if not data:
+                    return
+                if offset is not None and sent + len(data) >= offset:
+                    client.sendall(data[:offset - sent])
+                    with self._lock:
+                        self.cuts += 1
+                    client.shutdown(socket.SHUT_RDWR)
+                    return
+                client.sendall(data)
+                sent += len(data)
+
+    @staticmethod
+    def _forward(client, upstream):
+        try:
+            data = client.recv(4096)
+            while data:
+                upstream.sendall(data)
+                data = client.recv(4096)
+            upstream.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class CountingRemoteFile(RemoteFile):
+    resumes = 0
+
+    def _resume(self):
+        resumed = super()._resume()
+        CountingRemoteFile.resumes += resumed
+        return resumed
+
+
+class BufferSpi:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write_bytes(self, data):
+        self.data += data
+
+
+class BufferDriver(S1D13524):
+    # The device's image loading path, with what it sends to the controller kept in `_spi.data`
+    def __init__(self):
+        self._spi = BufferSpi()
+
+    def _set_cs(self, state):
+        pass
+
+    def _send_cmd(self, cmd):
+        pass
+
+    def _send_params(self, params):
+        pass
+
+    def _send_param(self, param):
+        pass
+
+    def _wait_idle(self, timeout_ms=5000):
+        pass
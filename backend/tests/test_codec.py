@@ -0,0 +1,130 @@
+import io
+
+import numpy as np
+import pytest
+
+from frame_format import ENCODINGS, PAYLOAD_ENCODERS, RLE_MAX_RUN
+
+from utils.codec import CHUNK_SIZE, open_payload
+
+
+class TrickleFile(io.BytesIO):
+    # Hands out at most `step` bytes per read, like a socket does
+    def __init__(self, data, step):
+        super().__init__(data)
+        self._step = step
+
+    def read(self, nbytes=-1):
+        return super().read(self._step if nbytes < 0 else min(nbytes, self._step))
+
+    def readinto(self, buf):
+        return super().readinto(memoryview(buf)[:self._step])
+
+
+def payload():
+    # Flat areas, long runs (longer than a run record holds) and noise, as a quote card on a photo would give
+    rng = np.random.default_rng(0)
+    return b"".join((bytes(5000), b"\xff" * (RLE_MAX_RUN + 123), rng.integers(0, 256, 20000, dtype=np.uint8).tobytes(),
+                     bytes(range(256)) * 40, b"\x11" * 3))
+
+
+def decoder(data, encoding, step=None):
+    encoded = PAYLOAD_ENCODERS[encoding](data)
+    src = io.BytesIO(encoded) if step is None else TrickleFile(encoded, step)
+    return open_payload(src, {"encoding": ENCODINGS[encoding], "length": len(encoded)})
+
+
+def read_all(payload, size):
+    out = bytearray()
+    chunk = payload.read(size)
+    while chunk:
+        out += chunk
+        chunk = payload.read(size)
+    return bytes(out)
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "rle"])
+@pytest.mark.parametrize("size", [1, 7, 1000, CHUNK_SIZE, 3 * CHUNK_SIZE + 5])
+def test_round_trip_in_chunks(encoding, size):
+    data = payload()
+    assert read_all(decoder(data, encoding), size) == data
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "rle"])
+@pytest.mark.parametrize("step", [1, 3, 1000])
+def test_round_trip_from_short_reads(encoding, step):
+    # Records and runs split across whatever the source hands out
+    data = payload()
+    assert read_all(decoder(data, encoding, step=step), CHUNK_SIZE) == data
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "rle"])
+def test_readinto_fills_whole_chunks(encoding):
+    data = payload()
+    stream = decoder(data, encoding)
+    buf = bytearray(CHUNK_SIZE)
+    out = bytearray()
+    n = stream.readinto(buf)
+    while n:
+        # Short only at the end
+        assert n == CHUNK_SIZE or len(out) + n == len(data)
+        out += buf[:n]
+        n = stream.readinto(buf)
+    assert bytes(out) == data
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "rle"])
+def test_seek_forward(encoding):
+    data = payload()
+    stream = decoder(data, encoding)
+    stream.seek(4999)
+    assert stream.read(3) == data[4999:5002]
+    stream.seek(40000)
+    assert stream.tell() == 40000
+    assert stream.read(100) == data[40000:40100]
+    # Staying put is fine
+    stream.seek(40100)
+    assert stream.read(10) == data[40100:40110]
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "rle"])
+def test_seek_backward_raises(encoding):
+    stream = decoder(payload(), encoding)
+    stream.seek(100)
+    with pytest.raises(ValueError):
+        stream.seek(50)
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "rle"])
+def test_seek_past_the_end_raises(encoding):
+    data = payload()
+    with pytest.raises(EOFError):
+        decoder(data, encoding).seek(len(data) + 1)
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "rle"])
+def test_truncated_payload_raises(encoding):
+    data = payload()
+    encoded = PAYLOAD_ENCODERS[encoding](data)
+    # The header promises more than the connection delivers
+    hdr = {"encoding": ENCODINGS[encoding], "length": len(encoded)}
+    stream = open_payload(io.BytesIO(encoded[:len(encoded) // 2]), hdr)
+    with pytest.raises(EOFError):
+        read_all(stream, CHUNK_SIZE)
+
+
+def test_rle_record_cut_short_raises():
+    # A run record whose count and value are missing, within the payload's length
+    stream = open_payload(io.BytesIO(b"\x80"), {"encoding": ENCODINGS["rle"], "length": 1})
+    with pytest.raises(EOFError):
+        stream.read(10)
+
+
+def test_raw_payload_is_read_as_is():
+    src = io.BytesIO(b"pixels")
+    assert open_payload(src, {"encoding": ENCODINGS["raw"], "length": 6}) is src
+
+
+def test_unknown_encoding_raises():
+    with pytest.raises(ValueError):
+        open_payload(io.BytesIO(b""), {"encoding": 9, "length": 0})
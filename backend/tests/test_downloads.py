@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from fakes import PostHandler, PostsBuilder, jpeg
+from repo_inventory import RepoInventory
+
+
+@pytest.fixture
+def stand_in(serve):
+    PostHandler.latency = 0.05
+    PostHandler.body = jpeg(size=(64, 64))
+    PostHandler.connections.clear()
+    return f"http://127.0.0.1:{serve(PostHandler).server_address[1]}"
+
+
+def pull(base_url, repo_dir, profiles, posts, n, workers=4):
+    inventory = RepoInventory(repo_dir)
+    builder = PostsBuilder(base_url, posts, dest_dir=repo_dir, inventory=inventory, workers=workers,
+                           instagram=[f"profile{i}" for i in range(profiles)])
+    try:
+        builder.download_from_instagram(n=n)
+        return len(inventory), builder._downloads.stats
+    finally:
+        builder.close()
+        inventory.close()
+
+
+def test_every_post_lands_in_the_inventory(stand_in, tmp_path):
+    count, stats = pull(stand_in, str(tmp_path), profiles=3, posts=4, n=12)
+    assert count == 12
+    assert sorted(stats) == ["instagram:profile0", "instagram:profile1", "instagram:profile2"]
+    assert all(s["files"] == 4 for s in stats.values())
+    # Downloads ran side by side, each worker on its own connection
+    assert len(PostHandler.connections) > 1
+
+
+def test_quota_is_shared_by_the_profiles(stand_in, tmp_path):
+    count, _ = pull(stand_in, str(tmp_path), profiles=3, posts=4, n=5)
+    assert count == 5
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".temp")]
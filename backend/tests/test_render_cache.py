@@ -0,0 +1,44 @@
+import os
+
+from fakes import jpeg
+from render_cache import RenderCache
+
+
+def sources(tmp_path, count):
+    paths = list()
+    for i in range(count):
+        path = tmp_path / f"image_{i}.jpg"
+        path.write_bytes(jpeg(size=(320, 240), seed=i))
+        paths.append(str(path))
+    return paths
+
+
+def test_render_evicted_from_disk_is_rendered_again(tmp_path):
+    source, = sources(tmp_path, 1)
+    renders = RenderCache(str(tmp_path / "renders"))
+    frame = renders.get(source).result()
+    # Gone from under the cache, as when another render landing evicts it between a lookup and the read
+    os.remove(renders.store.path(frame.key))
+    renders.discard(source)
+    again = renders.get(source).result()
+    assert (again.pixels == frame.pixels).all()
+    assert os.path.exists(renders.store.path(again.key))
+
+
+def test_source_digests_are_dropped_with_their_frames(tmp_path):
+    renders = RenderCache(str(tmp_path / "renders"), max_frames=2)
+    for source in sources(tmp_path, 5):
+        renders.get(source).result()
+    assert len(renders) == 2
+    assert len(renders._digests) == 2
+
+
+def test_crops_stay_out_of_the_disk_cache(tmp_path):
+    source, = sources(tmp_path, 1)
+    renders = RenderCache(str(tmp_path / "renders"))
+    frame = renders.get(source).result()
+    frame.encode("epdf", bpp=8)
+    entries = len(renders.store)
+    for left in range(0, 320, 16):
+        frame.encode("epdf", bpp=8, crop=(left, 0, 16, 16))
+    assert len(renders.store) == entries
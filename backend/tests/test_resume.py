@@ -0,0 +1,105 @@
+import http.client
+
+import pytest
+
+from fakes import BufferDriver, CountingRemoteFile, CuttingProxy, jpeg
+from frame_format import EPDF_HEADER
+import server
+
+from utils import misc
+from utils.comm import close_connections
+
+
+@pytest.fixture
+def image_server(serve, tmp_path, monkeypatch):
+    monkeypatch.setattr(misc, "RemoteFile", CountingRemoteFile)
+    for i in range(2):
+        (tmp_path / f"image_{i}.jpg").write_bytes(jpeg(size=(1600, 1200), seed=i))
+    image_server = server.image_server = server.ImageServer(repo_dir=str(tmp_path), dedup_distance=None)
+    httpd = serve(server.ImageRequestHandler, server_cls=server.FleetHTTPServer)
+    yield image_server, httpd.server_address
+    close_connections()
+    image_server.close()
+
+
+def load(upstream, offsets, query, area=None):
+    # One frame through a connection cut at each of `offsets` in turn, as the device's driver loads it
+    proxy = CuttingProxy(upstream, offsets)
+    CountingRemoteFile.resumes = 0
+    try:
+        driver = BufferDriver()
+        left, top = (area["left"], area["top"]) if area else (0, 0)
+        driver.load_image(f"http://127.0.0.1/the_image.epdf?{query}&device=test:{proxy.port}", area, left, top)
+        close_connections()
+    finally:
+        proxy.close()
+    assert proxy.cuts == len(offsets)
+    return bytes(driver._spi.data)
+
+
+def window(frame, crop, bpp):
+    # The crop cut out of the full frame's payload, row by row
+    data = frame.encode("epdf", bpp=bpp)[EPDF_HEADER.size:]
+    left, top, width, height = crop
+    row = frame.width * bpp // 8
+    return b"".join(data[y * row + left * bpp // 8:y * row + (left + width) * bpp // 8]
+                    for y in range(top, top + height))
+
+
+@pytest.mark.parametrize("encoding", ["raw", "deflate"])
+def test_frame_resumes_over_three_cuts(image_server, encoding):
+    image_server, upstream = image_server
+    data = load(upstream, (30000, 2000, 20000), f"bpp=8&encoding={encoding}")
+    assert CountingRemoteFile.resumes == 3
+    assert data == image_server.shown_frame("test").encode("epdf", bpp=8)[EPDF_HEADER.size:]
+
+
+def test_crop_resumes_to_the_same_pixels(image_server):
+    image_server, upstream = image_server
+    crop = (960, 0, 320, 160)
+    area = dict(zip(("left", "top", "width", "height"), crop))
+    data = load(upstream, (8000, 2000, 5000), "bpp=4", area=area)
+    assert CountingRemoteFile.resumes == 3
+    assert data == window(image_server.shown_frame("test"), crop, 4)
+
+
+def get(address, query, headers, method="GET"):
+    conn = http.client.HTTPConnection(*address)
+    try:
+        conn.request(method, f"/the_image.epdf?{query}&device=test", headers=headers)
+        resp = conn.getresponse()
+        return resp.status, resp.getheader("ETag"), resp.getheader("Content-Range"), resp.read()
+    finally:
+        conn.close()
+
+
+def test_each_encoding_has_its_own_strong_tag(image_server):
+    image_server, address = image_server
+    _, raw, _, _ = get(address, "bpp=8", {}, method="HEAD")
+    # Still the same picture, whatever encoding the device got it in
+    status, deflate, _, _ = get(address, "bpp=8&encoding=deflate", {"If-None-Match": raw})
+    assert status == 304
+    assert not raw.startswith("W/") and not deflate.startswith("W/") and raw != deflate
+
+
+@pytest.mark.parametrize("byte_range", ["bytes=-0", "bytes=10-5"])
+def test_empty_range_is_not_satisfiable(image_server, byte_range):
+    image_server, address = image_server
+    _, etag, _, data = get(address, "bpp=8", {})
+    status, _, content_range, body = get(address, "bpp=8", {"Range": byte_range, "If-Range": etag})
+    assert status == 416 and content_range == f"bytes */{len(data)}" and not body
+
+
+def test_range_is_resumed_on_a_strong_tag_only(image_server):
+    image_server, address = image_server
+    _, etag, _, data = get(address, "bpp=8", {})
+    status, _, content_range, body = get(address, "bpp=8", {"Range": "bytes=-100", "If-Range": etag})
+    assert status == 206 and content_range == f"bytes {len(data) - 100}-{len(data) - 1}/{len(data)}"
+    assert body == data[-100:]
+    # The tag of another encoding of the same frame doesn't name these bytes
+    other = image_server.shown_frame("test").representation_etag("epdf", bpp=4)
+    status, _, _, _ = get(address, "bpp=8", {"Range": "bytes=-100", "If-Range": other})
+    assert status == 200
+    # Nor does a weak one (RFC 7233)
+    status, _, _, _ = get(address, "bpp=8", {"Range": "bytes=-100", "If-Range": f"W/{etag}"})
+    assert status == 200
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from fakes import UrlHandler, jpeg
+from image_repo_builder import ImageRepoBuilder
+from repo_inventory import RepoInventory
+
+# A third of the URLs answer with an ETag, a third with Last-Modified, the rest with neither
+PATHS = [f"/{('etag', 'lm', 'plain')[i % 3]}/{i}.jpg" for i in range(12)]
+PLAIN = [path for path in PATHS if path.startswith("/plain/")]
+
+
+@pytest.fixture
+def url_source(serve, tmp_path):
+    UrlHandler.reset({path: jpeg(size=(64, 48), seed=i) for i, path in enumerate(PATHS)}, latency=0.05)
+    base_url = f"http://127.0.0.1:{serve(UrlHandler).server_address[1]}"
+    inventory = RepoInventory(str(tmp_path))
+    builder = ImageRepoBuilder(dest_dir=str(tmp_path), inventory=inventory, workers=4,
+                               urls=[base_url + path for path in PATHS])
+    yield builder, inventory
+    builder.close()
+    inventory.close()
+
+
+def test_first_poll_fetches_every_url(url_source, tmp_path):
+    builder, inventory = url_source
+    responses, _ = UrlHandler.poll(builder)
+    assert responses == {200: len(PATHS)}
+    assert len(inventory) == len(PATHS)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".temp")]
+    assert UrlHandler.max_in_flight <= 4
+
+
+def test_repoll_is_conditional(url_source):
+    builder, inventory = url_source
+    UrlHandler.poll(builder)
+    responses, body_bytes = UrlHandler.poll(builder)
+    assert responses == {304: len(PATHS) - len(PLAIN), 200: len(PLAIN)}
+    assert body_bytes == sum(len(UrlHandler.images[path]) for path in PLAIN)
+    # A plain URL answering with the same image doesn't add it again
+    assert len(inventory) == len(PATHS)
+
+
+def test_changed_image_is_added(url_source):
+    builder, inventory = url_source
+    UrlHandler.poll(builder)
+    UrlHandler.images[PATHS[0]] = jpeg(size=(64, 48), seed=100)
+    UrlHandler.images[PATHS[1]] = jpeg(size=(64, 48), seed=101)
+    UrlHandler.poll(builder)
+    assert len(inventory) == len(PATHS) + 2
@@ -0,0 +1,106 @@
+import asyncio
+import email.utils
+import hashlib
+import logging
+import os
+import time
+
+import aiohttp
+
+from downloader import DOWNLOADED_BYTES, DOWNLOADS
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png"}
+
+
+class UrlFetcher:
+    """
+    Polls URLs on an asyncio event loop, at most `concurrency` requests in flight, streaming each body straight to disk.
+    Each URL's ETag and Last-Modified come back with the result, and are sent back on the next poll: an unchanged URL
+    answers 304 with no body. Files are named after the URL and their content, so a URL whose image changes adds a new
+    file rather than overwriting the one already shown.
+    """
+    def __init__(self, concurrency=8, timeout=60, chunk_size=65536):
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._chunk_size = chunk_size
+        self.stats = {"files": 0, "bytes": 0, "not_modified": 0, "failed": 0}
+
+    def fetch(self, polls, dest_dir, on_done=None):
+        """
+        :param polls: (url, validators) pairs, validators being what this returned for the url last time, or empty
+        :param on_done: called with the path of each new file, once it's in place
+        :return: dict of url -> validators ({etag, last_modified, name}) if the url changed, None if it didn't, or the
+                 exception it failed with
+        """
+        return asyncio.run(self._fetch_all(polls, dest_dir, on_done))
+
+    def log_stats(self):
+        logger.info(f"URLs: {self.stats['files']} files, {self.stats['bytes'] / 1e6:.1f} MB, "
+                    f"{self.stats['not_modified']} unchanged, {self.stats['failed']} failed")
+
+    async def _fetch_all(self, polls, dest_dir, on_done):
+        semaphore = asyncio.Semaphore(self._concurrency)
+        connector = aiohttp.TCPConnector(limit=self._concurrency)
+        timeout = aiohttp.ClientTimeout(total=self._timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            urls = [url for url, _ in polls]
+            results = await asyncio.gather(
+                *(self._fetch(session, semaphore, url, validators, dest_dir, on_done) for url, validators in polls),
+                return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                self.stats["failed"] += 1
+                DOWNLOADS.inc(source="urls", result="failed")
+        return dict(zip(urls, results))
+
+    async def _fetch(self, session, semaphore, url, validators, dest_dir, on_done):
+        headers = dict()
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        async with semaphore:
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 304:
+                    self.stats["not_modified"] += 1
+                    DOWNLOADS.inc(source="urls", result="not_modified")
+                    return None
+                resp.raise_for_status()
+                content_type = resp.headers.get("Content-Type", "").split(";")[0].strip()
+                ext = EXTENSIONS.get(content_type) or os.path.splitext(resp.url.path)[1].lower() or ".jpg"
+                url_hash = hashlib.blake2b(url.encode("utf8"), digest_size=6).hexdigest()
+                # Written next to the destination and renamed once complete, named after what was written
+                tmp_path = os.path.join(dest_dir, f"url_{url_hash}.temp")
+                content_hash = hashlib.blake2b(digest_size=6)
+                size = 0
+                try:
+                    with open(tmp_path, "wb") as fh:
+                        async for chunk in resp.content.iter_chunked(self._chunk_size):
+                            fh.write(chunk)
+                            content_hash.update(chunk)
+                            size += len(chunk)
+                    name = f"url_{url_hash}_{content_hash.hexdigest()}{ext}"
+                    path = os.path.join(dest_dir, name)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                etag = resp.headers.get("ETag")
+                last_modified = resp.headers.get("Last-Modified")
+
+        if last_modified:
+            try:
+                os.utime(path, (time.time(), email.utils.parsedate_to_datetime(last_modified).timestamp()))
+            except (TypeError, ValueError):
+                pass
+        self.stats["files"] += 1
+        self.stats["bytes"] += size
+        DOWNLOADS.inc(source="urls", result="ok")
+        DOWNLOADED_BYTES.inc(size, source="urls")
+        if on_done:
+            on_done(path)
+        return {"etag": etag, "last_modified": last_modified, "name": name}
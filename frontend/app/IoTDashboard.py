@@ -1,6 +1,8 @@
+import json
 import time
 
 from app.common import BaseApp
+from utils.comm import RemoteFile, close_connections
 from utils.logging import Logger
 
 logger = Logger(__name__)
@@ -11,19 +13,64 @@ class IoTDashboard(BaseApp):
         super().__init__(display_platform=display_platform, **kwargs)
         self._mcu = self._display_platform.mcu
 
-    def run(self, img_path="http://macbook-pro.local/the_image.pgm:8080", update_interval_sec=86400, **kwargs):
+    def run(self, img_path="http://macbook-pro.local/the_image.pgm:8080", update_interval_sec=86400,
+            clear_on_wake=True, **kwargs):
         # Ideally we'd like to clear screen only for selected cases like PWRON_RESET, but we see ghosting in
         # image display so better to clear for every case (or remove if condition)
-        if self._mcu.power.reset_cause() in ("PWRON_RESET", "SOFT_RESET", "HARD_RESET", "DEEPSLEEP_RESET"):
-            self.clear()
+        # Delta updates (the_image.delta) rely on the panel still showing the last frame, so pass clear_on_wake=False
+        clear_causes = ("PWRON_RESET", "SOFT_RESET", "HARD_RESET")
+        if clear_on_wake:
+            clear_causes += ("DEEPSLEEP_RESET",)
+        reset_cause = self._mcu.power.reset_cause()
+        # RTC memory only survives deep sleep. It holds the ETag of the frame on the panel
+        state = self._load_state() if reset_cause == "DEEPSLEEP_RESET" else dict()
         while True:
-            self._display_platform.show_image(img_path, **kwargs)
-            logger.info(f"Updated Image", to_file=True)
+            if state.get("etag") and self._is_current(img_path, state["etag"]):
+                # Nothing new on the server: no download, no clearing, no update
+                logger.info(f"No new image", to_file=True)
+            else:
+                cleared = reset_cause in clear_causes
+                if cleared:
+                    self.clear()
+                hdr = self._display_platform.show_image(self._request_path(img_path, reset=cleared),
+                                                        etag=None if cleared else state.get("etag"), **kwargs)
+                if hdr["type"] != "NOT_MODIFIED":
+                    logger.info(f"Updated Image", to_file=True)
+                    state["etag"] = hdr.get("etag")
+                    self._save_state(state)
+            reset_cause = None
             self.deep_sleep(update_interval_sec=update_interval_sec)
             # Waking up from deep sleep starts the program from very beginning. If we're here then it was light sleep
             logger.info(f"Just woke-up from light sleep")
             self._mcu.network.connect()
 
+    def _is_current(self, img_path, etag):
+        # Conditional HEAD, doesn't move the server's queue
+        if not img_path.startswith("http"):
+            return False
+        url, port = self._request_path(img_path).rsplit(":", 1)
+        with RemoteFile(url=url, port=port, headers={"If-None-Match": etag}, method="HEAD") as remote_file:
+            return remote_file.status == 304
+
+    def _load_state(self):
+        try:
+            return json.loads(self._mcu.rtc_memory())
+        except ValueError:
+            return dict()
+
+    def _save_state(self, state):
+        self._mcu.rtc_memory(json.dumps(state))
+
+    def _request_path(self, img_path, reset=False):
+        # Tell the server who we are, and whether the panel was blanked since its last frame
+        if not img_path.startswith("http"):
+            return img_path
+        url, port = img_path.rsplit(":", 1)
+        url += f"{'&' if '?' in url else '?'}device={self._mcu.unique_id()}"
+        if reset:
+            url += "&reset=1"
+        return f"{url}:{port}"
+
     def clear(self):
         self._display_platform.clear()
         time.sleep(5)
@@ -32,5 +79,7 @@ class IoTDashboard(BaseApp):
         self._display_platform.show_image(img_path, **kwargs)
 
     def deep_sleep(self, update_interval_sec=86400):
+        # Kept open for the whole wake, the server would only notice it gone once it times out
+        close_connections()
         self._mcu.network.disconnect()
         self._mcu.power.deep_sleep(update_interval_sec * 1000)
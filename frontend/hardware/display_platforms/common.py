@@ -12,5 +12,9 @@ class DisplayPlatform:
     def clear(self):
         raise NotImplementedError
 
-    def show_image(self, img_path, **kwargs):
+    def show_image(self, img_path, etag=None, **kwargs):
+        """
+        :param etag: ETag of the image currently shown, if the server says it's still current nothing is done
+        :return: image header, with the ETag of what is shown now in hdr["etag"]
+        """
         raise NotImplementedError
@@ -124,8 +124,19 @@ class S1D13524(S1D135xx):
     def pattern_check(self, size):
         return self._pattern_check(self.yres, self.xres, size, S1D13524.LD_IMG_8BPP)
 
-    def load_image(self, path, area, left, top):
-        return self._load_image(path, S1D13524.LD_IMG_8BPP, 8, area, left, top)
+    def load_image(self, path, area, left, top, etag=None):
+        # 8bpp unless the frame header says otherwise, see _img_mode
+        return self._load_image(path, S1D13524.LD_IMG_8BPP, 8, area, left, top, etag=etag)
+
+    def _img_mode(self, bpp):
+        modes = {
+            4: S1D13524.LD_IMG_4BPP,
+            8: S1D13524.LD_IMG_8BPP,
+            16: S1D13524.LD_IMG_16BPP
+        }
+        if bpp not in modes:
+            raise ValueError(f"Unsupported bpp {bpp}")
+        return modes[bpp]
 
     def early_init(self):
         self._hrdy_mask = S1D13524.STATUS_HRDY
@@ -167,6 +178,13 @@ class S1D13524(S1D135xx):
         self._cmd(S1D13524.CMD.INIT_CTLR_MODE, params)
         self._wait_idle()
 
+    @classmethod
+    def waveform_name(cls, wf_id):
+        for name, value in cls.wf_table.items():
+            if value == wf_id:
+                return name
+        return None
+
     def update(self, wfid, area=None):
         wfid = S1D13524.wf_table.get(wfid)
         super()._update(wfid, area=area)
@@ -1,15 +1,45 @@
-import struct
 from utils.logging import Logger
 from utils.misc import ImageFile
+from utils.codec import open_payload
 import os
 
+try:
+    import micropython
+except ImportError:
+    micropython = None
+try:
+    # The ESP32 port runs threads on the core the WiFi stack isn't on. CPython has the same module
+    import _thread
+except ImportError:
+    _thread = None
+
 logger = Logger(__name__)
 
+if micropython:
+    @micropython.viper
+    def swap_bytes(buf, nbytes: int):
+        # Little endian words to big endian, in place. Native code, a Python loop over every byte of a frame would
+        # take seconds on the ESP32
+        p = ptr8(buf)
+        i = 0
+        while i < nbytes - 1:
+            b = p[i]
+            p[i] = p[i + 1]
+            p[i + 1] = b
+            i += 2
+else:
+    def swap_bytes(buf, nbytes):
+        # CPython, where the driver gets tested and benchmarked. MicroPython can't assign to extended slices
+        end = nbytes & ~1
+        buf[0:end:2], buf[1:end:2] = buf[1:end:2], buf[0:end:2]
+
 
 class S1D135xx:
     TEMP_MASK = 0x00FF
 
     DATA_BUFFER_LENGTH = 2048
+    # Receive frames from the network on a second thread while SPI sends the previous chunk
+    OVERLAP_TRANSFERS = True
 
     XMASK = 0x0FFF
     YMASK = 0x0FFF
@@ -123,23 +153,100 @@ class S1D135xx:
         self._send_cmd_cs(S1D135xx.CMD.LD_IMG_END)
         self._wait_idle()
 
-    def _wflib_wr(self, data):
+    def _wflib_wr(self, buf, nbytes):
         self._set_cs(0)
         self._send_cmd(S1D135xx.CMD.WRITE_REG)
         self._send_param(S1D135xx.Register.HOST_MEM_PORT)
-        self._transfer_data(data)
+        self._write_data(buf, nbytes, False)
         self._set_cs(1)
 
-    def _transfer_file(self, file):
-        chunk = file.read(S1D135xx.DATA_BUFFER_LENGTH)
-        while chunk:
-            self._transfer_data(chunk)
-            chunk = file.read(S1D135xx.DATA_BUFFER_LENGTH)
-
-    def _transfer_image(self, file, area, left, top, width):
+    def _transfer_file(self, file, panel_order=False, nbytes=None, overlap=False):
+        # Everything up to the end of the file, or just the next nbytes. Read into one buffer and handed to SPI as is,
+        # nothing is allocated per chunk
+        if overlap and _thread and S1D135xx.OVERLAP_TRANSFERS:
+            return self._transfer_overlapped(file, panel_order, nbytes)
+        buf = bytearray(S1D135xx.DATA_BUFFER_LENGTH)
+        view = memoryview(buf)
+        remaining = nbytes
+        while remaining is None or remaining:
+            n = file.readinto(view if remaining is None or remaining >= len(buf) else view[:remaining])
+            if not n:
+                break
+            self._write_data(buf, n, panel_order)
+            if remaining is not None:
+                remaining -= n
+
+    def _transfer_overlapped(self, file, panel_order, nbytes):
+        """
+        _transfer_file with two buffers: one is filled from `file` on another thread while SPI sends the other, so the
+        radio isn't left waiting on SPI, and the other way around. Each buffer is guarded by a pair of locks, as
+        MicroPython's _thread has nothing else: `free` held while it's being filled, `filled` until it has been
+        """
+        size = S1D135xx.DATA_BUFFER_LENGTH
+        bufs = (bytearray(size), bytearray(size))
+        free = (_thread.allocate_lock(), _thread.allocate_lock())
+        filled = (_thread.allocate_lock(), _thread.allocate_lock())
+        for lock in filled:
+            lock.acquire()
+        # Bytes in each buffer, 0 once the file is over. Anything the receiver raises, and whether to stop it
+        sizes = [0, 0]
+        state = {"error": None, "stop": False}
+        if micropython:
+            # Room for the HTTP client reconnecting and decoders on the receiving thread, the default is 4 KB
+            _thread.stack_size(16 * 1024)
+        _thread.start_new_thread(self._receive, (file, bufs, sizes, free, filled, nbytes, state))
+        i = 0
+        try:
+            while True:
+                filled[i].acquire()
+                if not sizes[i]:
+                    break
+                self._write_data(bufs[i], sizes[i], panel_order)
+                free[i].release()
+                i ^= 1
+        finally:
+            if state["error"] is None and sizes[i]:
+                # SPI failed, let the receiver go
+                state["stop"] = True
+                for lock in free:
+                    if lock.locked():
+                        lock.release()
+        if state["error"] is not None:
+            raise state["error"]
+
+    @staticmethod
+    def _receive(file, bufs, sizes, free, filled, remaining, state):
+        # The other end of _transfer_overlapped, on its own thread
+        views = (memoryview(bufs[0]), memoryview(bufs[1]))
+        i = 0
+        try:
+            while True:
+                free[i].acquire()
+                if state["stop"]:
+                    return
+                n = 0
+                if remaining is None or remaining:
+                    view = views[i]
+                    n = file.readinto(view if remaining is None or remaining >= len(view) else view[:remaining])
+                sizes[i] = n
+                filled[i].release()
+                if not n:
+                    return
+                if remaining is not None:
+                    remaining -= n
+                i ^= 1
+        except Exception as e:
+            state["error"] = e
+            sizes[i] = 0
+            filled[i].release()
+
+    def _transfer_image(self, file, area, left, top, width, panel_order=False):
         if width < area["width"] or width < (left + area["width"]):
             raise ValueError("Invalid combination of width/left/area")
 
+        buf = bytearray(S1D135xx.DATA_BUFFER_LENGTH)
+        view = memoryview(buf)
+
         # First ignore the top cropped area
         file.seek(file.tell() + top * width)
 
@@ -151,18 +258,22 @@ class S1D135xx:
 
             # Transfer data of interest in chunks
             while remaining:
-                read_count = min(remaining, S1D135xx.DATA_BUFFER_LENGTH)
-                chunk = file.read(read_count)
-                self._transfer_data(chunk)
-                remaining -= read_count
+                n = file.readinto(view[:min(remaining, len(buf))])
+                if not n:
+                    raise EOFError(f"Image ends {remaining} bytes short of line {line}")
+                self._write_data(buf, n, panel_order)
+                # A socket read can come back short
+                remaining -= n
 
             # Move file pointer to end of line
             file.seek(file.tell() + width - (left + area["width"]))
 
-    def _transfer_data(self, data):
-        # Data is a byte array in little endian. Target wants word array in big endian
-        data = struct.pack(f"<{len(data) // 2}H", *struct.unpack(f">{len(data) // 2}H", data))
-        self._spi.write_bytes(data)
+    def _write_data(self, buf, nbytes, panel_order):
+        # The first nbytes of buf to SPI. Data is in little endian words unless it's in panel order, the target wants
+        # them in big endian
+        if not panel_order:
+            swap_bytes(buf, nbytes)
+        self._spi.write_bytes(buf if nbytes == len(buf) else memoryview(buf)[:nbytes])
 
     def _send_cmd_area(self, cmd, mode, area):
         args = [
@@ -281,11 +392,12 @@ class S1D135xx:
         # Original code is more generic to support loading wflib from FatFS or EEPROM
         # Here we simplify it by assuming wflib is available as a file
         # So we just read wflib file and transfer it
+        buf = bytearray(S1D135xx.DATA_BUFFER_LENGTH)
         with open(wflib, "rb") as f:
-            chunk = f.read(S1D135xx.DATA_BUFFER_LENGTH)
-            while chunk:
-                self._wflib_wr(chunk)
-                chunk = f.read(S1D135xx.DATA_BUFFER_LENGTH)
+            n = f.readinto(buf)
+            while n:
+                self._wflib_wr(buf, n)
+                n = f.readinto(buf)
 
         self._wait_idle()
         self._send_cmd_cs(S1D135xx.CMD.BST_END_SDR)
@@ -348,9 +460,25 @@ class S1D135xx:
 
         self._send_cmd_cs(S1D135xx.CMD.LD_IMG_END)
 
-    def _load_image(self, path, mode, bpp, area=None, left=0, top=0):
-        with ImageFile(path) as img_file:
-            hdr = img_file.pnm_read_header()
+    def _load_image(self, path, mode, bpp, area=None, left=0, top=0, etag=None):
+        crop = None
+        if area:
+            crop = {"left": left, "top": top, "width": area["width"], "height": area["height"]}
+        with ImageFile(path, etag=etag, crop=crop) as img_file:
+            if img_file.not_modified:
+                # Same frame as last time, leave the controller alone
+                return {"type": "NOT_MODIFIED", "etag": etag}
+
+            hdr = img_file.read_header()
+            hdr["etag"] = img_file.etag
+            if hdr["type"] == "EPDL":
+                return self._load_delta(img_file, hdr)
+            # Binary frames come in the controller's word order and go to SPI untouched
+            panel_order = hdr.get("panel_order", False)
+            # and may be packed at a different depth than the caller asked for
+            if hdr.get("bpp", bpp) != bpp:
+                bpp = hdr["bpp"]
+                mode = self._img_mode(bpp)
 
             self._set_cs(0)
 
@@ -366,17 +494,65 @@ class S1D135xx:
             self._send_cmd(S1D135xx.CMD.WRITE_REG)
             self._send_param(S1D135xx.Register.HOST_MEM_PORT)
 
-            if not area:
-                self._transfer_file(img_file)
+            # Compressed payloads are decoded chunk by chunk on their way to SPI
+            payload = open_payload(img_file, hdr)
+            # Cropped by the server: the payload is just the area's pixels, row-contiguous
+            cropped = area and hdr.get("area") == crop
+            if not area or cropped:
+                self._transfer_file(payload, panel_order=panel_order, overlap=img_file.remote)
             else:
-                self._transfer_image(img_file, area, left, top, hdr["width"])
+                # Cropping works on bytes, which hold two pixels at 4bpp
+                byte_area = {"width": area["width"] * bpp // 8, "height": area["height"]}
+                self._transfer_image(payload, byte_area, left * bpp // 8, top, hdr["width"] * bpp // 8,
+                                     panel_order=panel_order)
 
             self._set_cs(1)
 
+            if img_file.crc is not None and (not area or cropped) and img_file.crc != hdr["crc"]:
+                logger.warning(f"CRC mismatch in {path}: expected {hdr['crc']}, got {img_file.crc}")
+
         self._wait_idle()
 
         self._send_cmd_cs(S1D135xx.CMD.LD_IMG_END)
         self._wait_idle()
+        return hdr
+
+    def _load_delta(self, img_file, hdr):
+        """
+        Load each changed area of a delta update into the image buffer.
+        The areas are returned in hdr["areas"], to be updated one by one: pixels of the buffer between them are
+        whatever the controller had, which is not necessarily what the panel shows
+        """
+        hdr["areas"] = list()
+        for _ in range(hdr["count"]):
+            rec = img_file.epdf_read_header()
+            area = rec["area"]
+
+            self._set_cs(0)
+            self._send_cmd_area(S1D135xx.CMD.LD_IMG_AREA, self._img_mode(rec["bpp"]), area)
+            self._set_cs(1)
+            self._wait_idle()
+            self._set_cs(0)
+            self._send_cmd(S1D135xx.CMD.WRITE_REG)
+            self._send_param(S1D135xx.Register.HOST_MEM_PORT)
+            if rec["encoding"]:
+                self._transfer_file(open_payload(img_file, rec), panel_order=True, overlap=img_file.remote)
+            else:
+                self._transfer_file(img_file, panel_order=True, nbytes=rec["length"], overlap=img_file.remote)
+            self._set_cs(1)
+
+            if img_file.crc != rec["crc"]:
+                logger.warning(f"CRC mismatch in area {area}: expected {rec['crc']}, got {img_file.crc}")
+
+            self._wait_idle()
+            self._send_cmd_cs(S1D135xx.CMD.LD_IMG_END)
+            self._wait_idle()
+            hdr["areas"].append(area)
+
+        return hdr
+
+    def _img_mode(self, bpp):
+        raise NotImplementedError
 
     def _update(self, wfid, area=None):
         self._set_cs(0)
@@ -110,13 +110,27 @@ class PlEpd(DisplayPlatform):
 
         logger.info(f"Initialized EPDC", to_file=True)
 
-    def show_image(self, img_path, area=None, left=0, top=0):
-        self._epdc.load_image(img_path, area=area, left=left, top=top)
+    def show_image(self, img_path, area=None, left=0, top=0, etag=None):
+        hdr = self._epdc.load_image(img_path, area=area, left=left, top=top, etag=etag)
+        if hdr["type"] == "NOT_MODIFIED":
+            logger.info(f"Image not modified, skipping the update")
+            return hdr
+
+        # Binary frames can carry a waveform hint from the server
+        waveform = self._epdc.waveform_name(hdr.get("waveform")) or "refresh"
+        # A delta update brings its own list of changed areas, possibly none
+        areas = hdr.get("areas", [area])
+        if not areas:
+            logger.info(f"Nothing changed, skipping the update")
+            return hdr
+
         self._epdc.update_temp()
         self._psu.on()
-        self._epdc.update("refresh", area=area)
+        for update_area in areas:
+            self._epdc.update(waveform, area=update_area)
         self._epdc.wait_update_end()
         self._psu.off()
+        return hdr
 
     def clear(self):
         logger.info(f"Clearing the screen")
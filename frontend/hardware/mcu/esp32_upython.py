@@ -1,3 +1,4 @@
+import binascii
 import json
 import time
 
@@ -266,6 +267,16 @@ class ESP32uPy(mcu.MCU):
     def sleep_ms(ms):
         return time.sleep_ms(ms)
 
+    @staticmethod
+    def unique_id():
+        return binascii.hexlify(machine.unique_id()).decode()
+
+    def rtc_memory(self, data=None):
+        # A few hundred bytes that survive deep sleep (not a power loss)
+        if data is None:
+            return self._rtc.memory()
+        self._rtc.memory(data)
+
     def rtc_time(self, *args):
         dt = self._rtc.datetime(*args)
         # Return a formatted string and in California timezone
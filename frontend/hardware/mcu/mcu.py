@@ -132,6 +132,13 @@ class MCU:
     def sleep_ms(ms):
         raise NotImplementedError
 
+    @staticmethod
+    def unique_id():
+        raise NotImplementedError
+
+    def rtc_memory(self, data=None):
+        raise NotImplementedError
+
     @staticmethod
     def ticks_ms():
         raise NotImplementedError
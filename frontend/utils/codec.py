@@ -0,0 +1,210 @@
+import io
+
+try:
+    # MicroPython >= 1.21
+    import deflate
+except ImportError:
+    deflate = None
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+# EPDF payload encodings, see backend/frame_format.py
+ENCODING_RAW = 0
+ENCODING_DEFLATE = 1
+ENCODING_RLE = 2
+# Raw deflate stream with a 4KB window, which is all the decoder has to keep around
+DEFLATE_WBITS = 12
+
+CHUNK_SIZE = 2048
+
+
+class PayloadReader(io.IOBase):
+    """
+    Exactly `nbytes` of a frame payload from `src`, read in chunks, so a decoder can't run past its record
+    """
+    def __init__(self, src, nbytes):
+        self._src = src
+        self._remaining = nbytes
+
+    def read(self, nbytes=CHUNK_SIZE):
+        if not self._remaining:
+            return b""
+        data = self._src.read(min(nbytes, self._remaining))
+        if not data:
+            raise EOFError(f"Payload ends {self._remaining} bytes short")
+        self._remaining -= len(data)
+        return data
+
+    def drain(self):
+        while self.read():
+            pass
+
+    def readinto(self, buf):
+        if not self._remaining:
+            return 0
+        n = self._src.readinto(buf if len(buf) <= self._remaining else memoryview(buf)[:self._remaining])
+        if not n:
+            raise EOFError(f"Payload ends {self._remaining} bytes short")
+        self._remaining -= n
+        return n
+
+
+class Decoder:
+    """
+    File-like view of the decoded payload: readinto() decodes straight into the caller's buffer as the bytes come,
+    never the whole frame, and seek() can only skip forward
+    """
+    def __init__(self, src, nbytes):
+        self._src = PayloadReader(src, nbytes)
+        self._pos = 0
+        self._skip = None
+
+    def readinto(self, buf):
+        # Short only at the end of the payload, callers count on full chunks
+        view = memoryview(buf)
+        n = 0
+        while n < len(view):
+            decoded = self._decode_into(view[n:])
+            if not decoded:
+                break
+            n += decoded
+        if n < len(view):
+            # Decoded everything, the record's crc covers any padding the decoder left unread
+            self._src.drain()
+        self._pos += n
+        return n
+
+    def read(self, nbytes):
+        buf = bytearray(nbytes)
+        n = self.readinto(buf)
+        return buf if n == nbytes else buf[:n]
+
+    def seek(self, pos):
+        if self._pos < pos and self._skip is None:
+            self._skip = memoryview(bytearray(CHUNK_SIZE))
+        while self._pos < pos:
+            if not self.readinto(self._skip[:min(pos - self._pos, CHUNK_SIZE)]):
+                raise EOFError(f"Can't seek past the end of the payload")
+        if self._pos != pos:
+            raise ValueError(f"Cannot go back in a compressed payload")
+
+    def tell(self):
+        return self._pos
+
+    def _decode_into(self, view):
+        # Some decoded bytes into `view`, how many, 0 at the end of the payload
+        raise NotImplementedError
+
+
+class InflateDecoder(Decoder):
+    def __init__(self, src, nbytes, wbits=DEFLATE_WBITS):
+        super().__init__(src, nbytes)
+        self._obj = None
+        if deflate:
+            self._stream = deflate.DeflateIO(self._src, deflate.RAW, wbits)
+        elif hasattr(zlib, "decompressobj"):
+            # CPython, where the decoder gets tested and benchmarked
+            self._obj = zlib.decompressobj(-wbits)
+        else:
+            self._stream = zlib.DecompIO(self._src, -wbits)
+
+    def _decode_into(self, view):
+        if self._obj is None:
+            return self._stream.readinto(view)
+        data = b""
+        while not data:
+            compressed = self._obj.unconsumed_tail or self._src.read(CHUNK_SIZE)
+            if not compressed:
+                return 0
+            data = self._obj.decompress(compressed, len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+class RleDecoder(Decoder):
+    """
+    Byte oriented run length code, simple enough to decode in pure Python:
+        0x00-0x7F  n          n + 1 literal bytes follow
+        0x80-0xFF  n, m, v    byte v repeated ((n & 0x7F) << 8 | m) + 1 times
+    The encoded bytes go through one buffer, and runs are written by doubling what's already in the caller's.
+    """
+    def __init__(self, src, nbytes):
+        super().__init__(src, nbytes)
+        self._buf = bytearray(CHUNK_SIZE)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._literal = 0
+        self._run = 0
+        self._value = 0
+
+    def _fill(self, nbytes):
+        # At least nbytes in the buffer, unless the payload is over
+        while self._end - self._start < nbytes:
+            left = self._end - self._start
+            # Less than a record left over, moved to the front
+            for i in range(left):
+                self._buf[i] = self._buf[self._start + i]
+            self._start, self._end = 0, left
+            n = self._src.readinto(self._view[left:])
+            if not n:
+                return False
+            self._end += n
+        return True
+
+    def _decode_into(self, view):
+        n = 0
+        while n < len(view):
+            if self._run:
+                count = min(self._run, len(view) - n)
+                view[n] = self._value
+                filled = 1
+                while filled < count:
+                    step = min(filled, count - filled)
+                    view[n + filled:n + filled + step] = view[n:n + step]
+                    filled += step
+                n += count
+                self._run -= count
+            elif self._literal:
+                if not self._fill(1):
+                    raise EOFError(f"RLE literal cut short")
+                count = min(self._literal, len(view) - n, self._end - self._start)
+                view[n:n + count] = self._view[self._start:self._start + count]
+                n += count
+                self._start += count
+                self._literal -= count
+            elif not self._fill(1):
+                break
+            else:
+                control = self._buf[self._start]
+                if control < 0x80:
+                    self._start += 1
+                    self._literal = control + 1
+                else:
+                    if not self._fill(3):
+                        raise EOFError(f"RLE run cut short")
+                    self._run = ((control & 0x7F) << 8 | self._buf[self._start + 1]) + 1
+                    self._value = self._buf[self._start + 2]
+                    self._start += 3
+        return n
+
+
+DECODERS = {
+    ENCODING_DEFLATE: InflateDecoder,
+    ENCODING_RLE: RleDecoder,
+}
+
+
+def open_payload(src, hdr):
+    """
+    :param src: file positioned at the start of an EPDF payload, as described by `hdr`
+    :return: `src` itself for raw payloads, otherwise a decoder reading the payload from it
+    """
+    encoding = hdr.get("encoding", ENCODING_RAW)
+    if encoding == ENCODING_RAW:
+        return src
+    if encoding not in DECODERS:
+        raise ValueError(f"Unsupported payload encoding {encoding}")
+    return DECODERS[encoding](src, hdr["length"])
@@ -1,52 +1,452 @@
 import socket
+import time
 
+BUFFER_SIZE = 2048
+# What's left of a body that lasts until the connection closes
+UNTIL_CLOSE = 1 << 30
 
-class RemoteFile:
-    def __init__(self, url='http://macbook-pro.local/sample_image.pgm', port=8080):
-        self._port = port
-        _, _, self._host, self._path = url.split('/', 3)
-        self._addr = socket.getaddrinfo(self._host.split(":")[0], self._port)[0][-1]
+# (host, port) -> HttpConnection, kept open between requests
+_connections = dict()
+
+
+def get_connection(host, port=80, timeout=10):
+    """
+    The open connection to host:port, or a new one. Requests to the same server share it, so only the first pays for
+    the name lookup and the TCP handshake
+    """
+    key = (host, int(port))
+    conn = _connections.get(key)
+    if conn is None:
+        conn = _connections[key] = HttpConnection(host, port, timeout=timeout)
+    return conn
+
+
+def close_connections():
+    # Before the radio goes off
+    for conn in _connections.values():
+        conn.close()
+    _connections.clear()
+
+
+class HttpConnection:
+    """
+    An HTTP/1.1 connection, kept alive across requests and reopened when the server closes it. Requests can be
+    pipelined: send several with request(), then read the answers in the same order with response(). Each answer has
+    to be read, or closed, before the next one.
+    Everything received goes through one buffer, the end of a read can hold the start of the next answer.
+    """
+    def __init__(self, host, port=80, timeout=10, buffer_size=BUFFER_SIZE):
+        self.host = host
+        self.port = int(port)
+        self._timeout = timeout
+        self._addr = None
+        self._socket = None
+        self._recv_into = None
+        # Unread bytes are _buf[_start:_end]
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        # Requests sent and not answered yet, oldest first: (method, path, headers)
+        self.pending = list()
+        self._answered = 0
+        self.connects = 0
+
+    @property
+    def size(self):
+        return len(self._buf)
+
+    def buffered(self):
+        return self._end - self._start
+
+    def connect(self):
+        if self._socket is not None:
+            return
+        if self._addr is None:
+            self._addr = socket.getaddrinfo(self.host, self.port)[0][-1]
         self._socket = socket.socket()
+        self._socket.settimeout(self._timeout)
         self._socket.connect(self._addr)
-        self._send_http_request()
-        # This value should only be updated for the "contents" of the file, not HTTP header
-        self._curr_pos = 0
-        self._http_header = self._parse_http_header()
+        # MicroPython's readinto waits for the whole buffer, it's never asked for more than is known to be coming
+        self._recv_into = getattr(self._socket, "recv_into", None) or self._socket.readinto
+        self._start = self._end = 0
+        self._answered = 0
+        self.connects += 1
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._start = self._end = 0
+        self.pending = list()
+
+    def request(self, path, headers=None, method="GET"):
+        # Sent right away, the answer is read later
+        self.connect()
+        self.pending.append((method, path, headers or dict()))
+        try:
+            self._send(method, path, headers)
+        except OSError:
+            # Closed by the server since the last answer
+            if not self._answered:
+                raise
+            self._reopen()
+
+    def response(self, retries=3):
+        # The answer to the oldest request not read yet
+        return RemoteFile(retries=retries, connection=self)
+
+    def read_header(self):
+        """
+        Header of the answer to the oldest pending request. If the server closed the connection in between, as it does
+        after a while idle, the pending requests are sent again on a new one
+        :return: the request, and the header
+        """
+        if self._socket is None:
+            self._reopen()
+        try:
+            header = self._read_header()
+        except OSError:
+            if not self._answered or self._end > self._start:
+                raise
+            self._reopen()
+            header = self._read_header()
+        self._answered += 1
+        return self.pending.pop(0), header
+
+    def take(self, view, nbytes):
+        # Up to nbytes of what's buffered into view
+        n = min(self._end - self._start, nbytes)
+        view[:n] = self._view[self._start:self._start + n]
+        self._start += n
+        return n
+
+    def skip(self, nbytes):
+        n = min(self._end - self._start, nbytes)
+        self._start += n
+        return n
+
+    def peek(self, nbytes):
+        return bytes(self._view[self._start:self._start + min(self._end - self._start, nbytes)])
+
+    def recv_into(self, view, nbytes):
+        # Straight off the socket, with nothing buffered
+        return self._recv_into(view, nbytes)
+
+    def fill(self, nbytes=None):
+        """
+        Receive into the empty buffer, `nbytes` at most if they're known to be coming, otherwise whatever has arrived
+        (at the cost of an allocation)
+        :return: how many bytes, 0 if the connection closed
+        """
+        self._start = 0
+        if nbytes is None:
+            data = self._socket.recv(len(self._buf))
+            self._end = len(data)
+            self._view[:self._end] = data
+        else:
+            self._end = self._recv_into(self._view, min(nbytes, len(self._buf)))
+        return self._end
+
+    def readline(self):
+        # A line of framing (a chunk size, a trailer), up to and including b"\n"
+        line = b""
+        while line[-1:] != b"\n":
+            if self._start == self._end and not self.fill():
+                raise OSError(f"Connection closed in a line")
+            chunk = self.peek(self._end - self._start)
+            i = chunk.find(b"\n")
+            n = len(chunk) if i < 0 else i + 1
+            line += chunk[:n]
+            self._start += n
+        return line
+
+    def _send(self, method, path, headers):
+        request = f'{method} /{path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+        if headers:
+            for name, value in headers.items():
+                request += f'{name}: {value}\r\n'
+        self._socket.sendall(bytes(request + '\r\n', 'utf8'))
+
+    def _reopen(self):
+        pending = self.pending
+        self.close()
+        self.connect()
+        for method, path, headers in pending:
+            self._send(method, path, headers)
+        self.pending = pending
+
+    def _read_header(self):
+        # HTTP header and content is separated by a '\r\n\r\n'. Read into the buffer as it comes, what's past the
+        # separator is the start of the body
+        while True:
+            i = bytes(self._view[self._start:self._end]).find(b"\r\n\r\n")
+            if i >= 0:
+                break
+            if self._start:
+                # Make room at the end
+                self._buf[:self._end - self._start] = self._buf[self._start:self._end]
+                self._start, self._end = 0, self._end - self._start
+            if self._end == len(self._buf):
+                raise ValueError(f"HTTP header from {self.host} doesn't fit in {len(self._buf)} bytes")
+            data = self._socket.recv(len(self._buf) - self._end)
+            if not data:
+                raise OSError(f"Connection closed in the HTTP header")
+            self._view[self._end:self._end + len(data)] = data
+            self._end += len(data)
+        header = str(bytes(self._view[self._start:self._start + i]), 'utf8')
+        self._start += i + 4
+        return header
+
+
+class RemoteFile:
+    """
+    A file over HTTP, read as it arrives: reads return exactly what was asked for unless the body ends first, at its
+    Content-Length or last chunk, and readinto() fills the caller's buffer without allocating, straight from the socket
+    for anything but small reads.
+
+    The request goes out on the connection shared by everything sent to that server (see get_connection), which stays
+    open for the next request once the body has been read. Closing a file before the end of its body closes the
+    connection, unless more answers are queued behind it.
+
+    If the connection drops before the end of a body the server accepts ranges for (Accept-Ranges: bytes), it's
+    reopened with a Range request for the rest, and reading carries on from the same position, so whatever the bytes
+    are being streamed to never notices. `retries` reconnections are attempted in a row, waiting longer each time for
+    the WiFi to come back, and as many drops in a row without a byte in between.
+    """
+    def __init__(self, url='http://macbook-pro.local/sample_image.pgm', port=8080, headers=None, method="GET",
+                 timeout=10, retries=3, connection=None):
+        """
+        :param connection: read the next answer on this HttpConnection instead, to a request already sent
+        """
+        if connection is None:
+            _, _, host, path = url.split('/', 3)
+            connection = get_connection(host.split(":")[0], port, timeout=timeout)
+            connection.request(path, headers, method)
+        self._conn = connection
+        self._retries = retries
+        (self._method, self._path, self._headers), self._http_header = connection.read_header()
+        self.status, self.headers = self._split_http_header(self._http_header)
+        # Body bytes taken from the connection, whether read or skipped
         self._curr_pos = 0
+        self._closed = False
+        self._keep_alive = self._http_header.startswith("HTTP/1.1") and self.headers.get("connection") != "close"
+        # Body length, None if it's chunked or lasts until the connection closes
+        self._length = None
+        self._chunked = False
+        self._chunk_left = 0
+        self._done = False
+        if self._method == "HEAD" or self.status in (204, 304):
+            self._length = 0
+        elif self.headers.get("transfer-encoding") == "chunked":
+            self._chunked = True
+        elif "content-length" in self.headers:
+            self._length = int(self.headers["content-length"])
+        else:
+            self._keep_alive = False
+        self._resumable = self._method == "GET" and self.status == 200 and self._length is not None \
+            and self.headers.get("accept-ranges") == "bytes" and not self.headers.get("etag", "W/").startswith("W/")
+        self.resumes = 0
+        self._resumed_at = None
+        self._stalls = 0
+
+    @property
+    def length(self):
+        return self._length
 
     def close(self):
-        self._socket.close()
+        if self._closed:
+            return
+        self._closed = True
+        if not self._complete():
+            if not self._conn.pending:
+                self._conn.close()
+                return
+            # More answers are queued behind this one
+            while self.seek(self._curr_pos + self._conn.size, partial=True):
+                pass
+        if not self._keep_alive:
+            self._conn.close()
 
     def read(self, nbytes):
-        rx = self._socket.recv(nbytes)
-        self._curr_pos += len(rx)
-        return rx
+        data = bytearray(nbytes)
+        n = self.readinto(data)
+        return data if n == nbytes else data[:n]
+
+    def readinto(self, buf):
+        """
+        Fill `buf` (a bytearray or memoryview) from the body
+        :return: how many bytes it got, less than len(buf) only at the end of the body
+        """
+        view = memoryview(buf)
+        nbytes = len(view)
+        pos = 0
+        while pos < nbytes:
+            n = self._body_into(view[pos:] if pos else view, nbytes - pos)
+            if not n:
+                break
+            pos += n
+        return pos
 
-    def seek(self, pos):
-        move_bytes = pos - self._curr_pos
-        if move_bytes < 0:
+    def seek(self, pos, partial=False):
+        # Forward only, skipping over the buffer. With `partial`, False if the body ended first
+        if pos < self._curr_pos:
             raise ValueError(f"Cannot go back in a remote file as everything is done on the fly")
-        chunk_size = 1024
-        while move_bytes > 0:
-            move_bytes -= len(self.read(min(move_bytes, chunk_size)))
+        while self._curr_pos < pos:
+            if not self._buffer():
+                if partial:
+                    return False
+                raise EOFError(f"Cannot seek past the end of /{self._path}")
+            self._consumed(self._conn.skip(min(self._left(), pos - self._curr_pos)))
+        return True
 
     def tell(self):
         return self._curr_pos
 
     def readline(self, end=b"\n"):
+        # Up to and including `end`, or what's left of the body
         line = b""
-        len_end = len(end)
-        while line[-len_end:] != end:
-            line += self.read(1)
+        while line[-len(end):] != end:
+            if not self._buffer():
+                break
+            chunk = self._conn.peek(self._left())
+            i = chunk.find(end[-1:])
+            n = len(chunk) if i < 0 else i + 1
+            line += chunk[:n]
+            self._consumed(self._conn.skip(n))
         return line
 
-    def _send_http_request(self):
-        self._socket.send(bytes(f'GET /{self._path} HTTP/1.0\r\nHost: {self._host}\r\n\r\n', 'utf8'))
+    def _complete(self):
+        if self._length is not None:
+            return self._curr_pos >= self._length
+        return self._done
+
+    def _left(self):
+        # How much of the body comes before the next piece of framing: the rest of the body, or of the current chunk
+        if self._done:
+            return 0
+        if self._chunked:
+            if not self._chunk_left:
+                self._next_chunk()
+            return self._chunk_left
+        if self._length is None:
+            return UNTIL_CLOSE
+        return self._length - self._curr_pos
+
+    def _next_chunk(self):
+        if self._curr_pos:
+            # CRLF after the previous chunk's data
+            self._conn.readline()
+        self._chunk_left = int(self._conn.readline().split(b";")[0].strip(), 16)
+        if not self._chunk_left:
+            # Trailers, up to a blank line
+            while self._conn.readline().strip():
+                pass
+            self._done = True
+
+    def _consumed(self, n):
+        self._curr_pos += n
+        if self._chunked:
+            self._chunk_left -= n
+
+    def _buffer(self):
+        # Some of the body in the connection's buffer, False at the end of the body
+        while not self._conn.buffered():
+            left = self._left()
+            if not left:
+                return False
+            # Reading the chunk size may have brought some in
+            if not self._conn.buffered() and not self._receive(None, left):
+                return False
+        return self._left() != 0
+
+    def _body_into(self, view, nbytes):
+        # Some of the body into view, 0 at its end
+        left = self._left()
+        if not left:
+            return 0
+        nbytes = min(nbytes, left)
+        if self._conn.buffered():
+            n = self._conn.take(view, nbytes)
+        elif nbytes >= self._conn.size // 4:
+            # Big reads skip the buffer, the socket writes straight into the caller's
+            n = self._receive(view, nbytes)
+        elif self._buffer():
+            n = self._conn.take(view, min(nbytes, self._left()))
+        else:
+            n = 0
+        self._consumed(n)
+        return n
+
+    def _receive(self, view, nbytes):
+        """
+        Up to nbytes of the body into `view`, or into the connection's buffer without one, reconnecting if the body is
+        cut short
+        :return: how many, 0 if the body is over, or when a reconnection put some of it in the buffer
+        """
+        while True:
+            try:
+                n = self._conn.fill(nbytes) if view is None else self._conn.recv_into(view, nbytes)
+            except OSError:
+                if not self._resume():
+                    raise
+                n = 0
+            else:
+                if n:
+                    return n
+                self._keep_alive = False
+                if self._length is None and not self._chunked:
+                    # Over when the connection closes
+                    self._done = True
+                    return 0
+                if not self._resume():
+                    return 0
+            if self._conn.buffered():
+                return 0
+
+    def _resume(self):
+        """
+        Reconnect and ask for the rest of the body, from where reading got to.
+        :return: False if the body is complete, or can't be resumed
+        """
+        if not self._resumable or self._conn.pending or self._curr_pos >= self._length:
+            return False
+        self._stalls = self._stalls + 1 if self._curr_pos == self._resumed_at else 0
+        if self._stalls >= self._retries:
+            return False
+        self._resumed_at = self._curr_pos
+        # The same request, for the same frame: a new one mustn't be handed out instead
+        headers = dict(self._headers)
+        headers.pop("If-None-Match", None)
+        headers["Range"] = f"bytes={self._curr_pos}-"
+        headers["If-Range"] = self.headers["etag"]
+        for attempt in range(self._retries):
+            time.sleep(attempt)
+            self._conn.close()
+            try:
+                self._conn.request(self._path, headers, self._method)
+                _, header = self._conn.read_header()
+            except OSError:
+                continue
+            status, resp_headers = self._split_http_header(header)
+            if status != 206 or not resp_headers.get("content-range", "").startswith(f"bytes {self._curr_pos}-"):
+                raise ValueError(f"Unable to resume /{self._path} at {self._curr_pos}, the server answered {status}")
+            self._keep_alive = header.startswith("HTTP/1.1") and resp_headers.get("connection") != "close"
+            self.resumes += 1
+            return True
+        self._conn.close()
+        return False
 
-    def _parse_http_header(self):
-        # HTTP header and content is separated by a '\r\n\r\n'
-        header = self.readline(end=b"\r\n\r\n")
-        return str(header[:-4], 'utf8')
+    @staticmethod
+    def _split_http_header(header):
+        # Status code and a dict of headers, with lower case names
+        lines = header.split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        headers = dict()
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
 
     def __enter__(self):
         return self
@@ -1,6 +1,20 @@
 import json
+import struct
+import binascii
 from utils.comm import RemoteFile
 
+# Binary EPD frame header, see backend/frame_format.py
+EPDF_MAGIC = b"EPDF"
+EPDF_VERSION = 1
+EPDF_HEADER_FORMAT = "<4sBBHHHHHHbBII"
+EPDF_HEADER_SIZE = struct.calcsize(EPDF_HEADER_FORMAT)
+EPDF_CONTENT_TYPE = "application/x-epd-frame"
+# Delta update: a short header followed by one EPDF record per changed area
+EPDL_MAGIC = b"EPDL"
+EPDL_HEADER_FORMAT = "<4sBBHHHbx"
+EPDL_HEADER_SIZE = struct.calcsize(EPDL_HEADER_FORMAT)
+EPDL_CONTENT_TYPE = "application/x-epd-delta"
+
 
 def load_config(config_file):
     with open(config_file, "rb") as f:
@@ -9,22 +23,89 @@ def load_config(config_file):
 
 
 class ImageFile:
-    def __init__(self, path):
+    def __init__(self, path, etag=None, crop=None):
+        """
+        :param etag: ETag of the frame we already have, a remote file then comes back not_modified if it's the same
+        :param crop: window of the frame we need ({left, top, width, height}), a remote file is then asked for just
+                     that. Check the area in the header, a server that can't crop sends the whole frame
+        """
         self._path = path
+        self._crc = None
         if path.startswith("http:") or path.startswith("https:"):
             try:
                 url, port = path.rsplit(":", 1)
             except ValueError:
                 raise ValueError(f"path should be of format http://[hostname]/[path]:[port]")
-            self._file_handle = RemoteFile(url=url, port=port)
+            if crop:
+                url += f"{'&' if '?' in url else '?'}left={crop['left']}&top={crop['top']}" \
+                       f"&width={crop['width']}&height={crop['height']}"
+            headers = {"Accept": EPDF_CONTENT_TYPE}
+            if etag:
+                headers["If-None-Match"] = etag
+            self._file_handle = RemoteFile(url=url, port=port, headers=headers)
         else:
             self._file_handle = open(path, mode="rb")
 
+    @property
+    def remote(self):
+        return isinstance(self._file_handle, RemoteFile)
+
+    @property
+    def not_modified(self):
+        return isinstance(self._file_handle, RemoteFile) and self._file_handle.status == 304
+
+    @property
+    def etag(self):
+        if isinstance(self._file_handle, RemoteFile):
+            return self._file_handle.headers.get("etag")
+        return None
+
+    @property
+    def frame_type(self):
+        if isinstance(self._file_handle, RemoteFile):
+            content_type = self._file_handle.headers.get("content-type")
+        elif self._path.endswith(".epdf"):
+            content_type = EPDF_CONTENT_TYPE
+        elif self._path.endswith(".delta"):
+            content_type = EPDL_CONTENT_TYPE
+        else:
+            content_type = None
+
+        if content_type == EPDF_CONTENT_TYPE:
+            return "EPDF"
+        if content_type == EPDL_CONTENT_TYPE:
+            return "EPDL"
+        return "PNM"
+
+    @property
+    def crc(self):
+        return self._crc
+
     def close(self):
         self._file_handle.close()
 
     def read(self, nbytes):
-        return self._file_handle.read(nbytes)
+        data = self._file_handle.read(nbytes)
+        if self._crc is not None:
+            self._crc = binascii.crc32(data, self._crc)
+        return data
+
+    def readinto(self, buf):
+        # Into a preallocated buffer, bytearray or memoryview
+        n = self._file_handle.readinto(buf)
+        if self._crc is not None and n:
+            self._crc = binascii.crc32(buf if n == len(buf) else memoryview(buf)[:n], self._crc)
+        return n
+
+    def read_exact(self, nbytes):
+        # A socket read can come back short, keep going until we have it all
+        data = self.read(nbytes)
+        while len(data) < nbytes:
+            chunk = self.read(nbytes - len(data))
+            if not chunk:
+                raise EOFError(f"Unexpected end of {self._path}")
+            data += chunk
+        return data
 
     def readline(self):
         return self._file_handle.readline()
@@ -35,6 +116,56 @@ class ImageFile:
     def tell(self):
         return self._file_handle.tell()
 
+    def read_header(self):
+        frame_type = self.frame_type
+        if frame_type == "EPDF":
+            return self.epdf_read_header()
+        if frame_type == "EPDL":
+            return self.delta_read_header()
+        return self.pnm_read_header()
+
+    def delta_read_header(self):
+        """
+        Header of a delta update, `count` EPDF records follow, read each with epdf_read_header
+        """
+        magic, version, bpp, width, height, count, waveform = \
+            struct.unpack(EPDL_HEADER_FORMAT, self.read_exact(EPDL_HEADER_SIZE))
+        if magic != EPDL_MAGIC or version != EPDF_VERSION:
+            raise ValueError(f"Unable to read header in file {self._path}")
+
+        return {
+            "type": "EPDL",
+            "width": width,
+            "height": height,
+            "bpp": bpp,
+            "count": count,
+            "waveform": waveform
+        }
+
+    def epdf_read_header(self):
+        """
+        Fixed size binary header, parsed in a single read. The payload that follows is already in the panel's word
+        order. From here on the payload crc is accumulated as it's read, compare it against hdr["crc"] at the end.
+        """
+        magic, version, bpp, width, height, left, top, area_width, area_height, waveform, encoding, length, crc = \
+            struct.unpack(EPDF_HEADER_FORMAT, self.read_exact(EPDF_HEADER_SIZE))
+        if magic != EPDF_MAGIC or version != EPDF_VERSION:
+            raise ValueError(f"Unable to read header in file {self._path}")
+
+        self._crc = 0
+        return {
+            "type": "EPDF",
+            "width": width,
+            "height": height,
+            "bpp": bpp,
+            "area": {"left": left, "top": top, "width": area_width, "height": area_height},
+            "waveform": waveform,
+            "encoding": encoding,
+            "length": length,
+            "crc": crc,
+            "panel_order": True
+        }
+
     def pnm_read_header(self):
         """
         :param pnm_file: This should be a file object so that after reading the header,
@@ -79,4 +210,4 @@ class ImageFile:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        return
+        self.close()